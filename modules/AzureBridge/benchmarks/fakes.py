@@ -0,0 +1,342 @@
+# Copyright (c) 2020 Intel Corporation.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM,OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+"""In-process stand-ins for the EII Message Bus, the IoT Edge module client
+and Azure Blob Storage used by the forwarding benchmarks.
+"""
+import gzip
+import json
+import zlib
+import time
+import asyncio
+import threading
+import importlib
+
+from eab.aggregator import AGGREGATE_PROPERTY
+
+# Decoders for the content types of the bridge's codecs, the binary codecs'
+# packages are only needed by the scenarios which use them
+DECODERS = {
+    'application/json': json.loads,
+    'application/x-msgpack':
+        lambda data: importlib.import_module('msgpack').unpackb(data),
+    'application/cbor':
+        lambda data: importlib.import_module('cbor2').loads(data),
+}
+
+# Decompressors for the content encodings of compressed messages
+DECOMPRESSORS = {
+    'gzip': gzip.decompress,
+    'deflate': zlib.decompress,
+}
+
+
+class FakeMessage:
+    """EII Message Bus message.
+    """
+    def __init__(self, meta_data, blob):
+        """Constructor.
+
+        :param dict meta_data: Message meta-data
+        :param bytes blob: Message blob
+        """
+        self.meta_data = meta_data
+        self.blob = blob
+
+    def get_meta_data(self):
+        """Get the message's meta-data.
+        """
+        return self.meta_data
+
+    def get_blob(self):
+        """Get the message's blob, if any.
+        """
+        return self.blob
+
+
+class FakeSubscriber:
+    """EII Message Bus subscriber which replays synthetic video analytics
+    results at a fixed rate.
+
+    The time each message is returned from :code:`recv()` is recorded, so
+    that the forward latency can be measured when it is sent on.
+    """
+    def __init__(self, topic, rate, count, frame_size=0, num_defects=2,
+                 encoding='jpeg'):
+        """Constructor.
+
+        :param str topic: Topic name, used in the image handles
+        :param rate: Messages per second, 0 for as fast as possible
+        :param int count: Number of messages to publish
+        :param int frame_size: Size of the frame blob in bytes, 0 for
+            meta-data only messages
+        :param int num_defects: Number of defects in each message's
+            meta-data
+        :param str encoding: Encoding type of the frames, None for raw
+            frames
+        """
+        self.topic = topic
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self.count = count
+        self.frame_size = frame_size
+        self.num_defects = num_defects
+        self.encoding = encoding
+        # Repeating pattern, so that encoding the frames does some work
+        self.pattern = (bytes(range(256)) * (frame_size // 256 + 1))
+        self.pattern = self.pattern[:frame_size]
+        self.sent = 0
+        self.recv_times = {}
+        self.start_time = None
+        self._closed = threading.Event()
+
+    def recv(self):
+        """Return the next message, waiting until it is due.
+        """
+        if self.start_time is None:
+            self.start_time = time.monotonic()
+        if self.sent >= self.count:
+            # Nothing more to publish, block until closed
+            self._closed.wait()
+        if self._closed.is_set():
+            raise RuntimeError('Subscriber closed')
+
+        due = self.start_time + self.sent * self.interval
+        delay = due - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+        img_handle = f'{self.topic}-{self.sent:08d}'
+        meta = {
+            'img_handle': img_handle,
+            'height': 1080,
+            'width': 1920,
+            'channels': 3,
+            'defects': [
+                {'type': i % 3, 'tl': [10 * i, 20 * i],
+                 'br': [10 * i + 50, 20 * i + 50]}
+                for i in range(self.num_defects)],
+        }
+        frame = None
+        if self.frame_size > 0:
+            # New buffer for every frame, like the EII Message Bus
+            frame = bytes(memoryview(self.pattern))
+            if self.encoding is not None:
+                meta['encoding_type'] = self.encoding
+                meta['encoding_level'] = 95
+        self.sent += 1
+        self.recv_times[img_handle] = time.monotonic()
+        return FakeMessage(meta, frame)
+
+    def close(self):
+        """Close the subscriber, unblocking any pending :code:`recv()`.
+        """
+        self._closed.set()
+
+
+class FakeModuleClient:
+    """Azure IoT Hub module client which waits a fixed latency for every sent
+    message, like a round trip to the edgeHub.
+    """
+    def __init__(self, latency=0.0):
+        """Constructor.
+
+        :param latency: Seconds each send takes
+        """
+        self.latency = latency
+        self.messages = 0
+        self.bytes = 0
+        self.send_times = {}
+        self.summarized = 0
+
+    async def send_message_to_output(self, msg, output_name):
+        """Record the send time of each meta-data object in the message,
+        or the number of frames of a window summary.
+        """
+        await asyncio.sleep(self.latency)
+        now = time.monotonic()
+        data = msg.data
+        self.messages += 1
+        self.bytes += len(data)
+        if msg.content_encoding in DECOMPRESSORS:
+            data = DECOMPRESSORS[msg.content_encoding](data)
+        body = DECODERS[msg.content_type](data)
+        if AGGREGATE_PROPERTY in msg.custom_properties:
+            self.summarized += body['frames']
+            return
+        if not isinstance(body, list):
+            body = [body]
+        for meta in body:
+            self.send_times[meta['img_handle']] = now
+
+
+class FakeBlobClient:
+    """Azure blob client which blocks for a latency plus a transfer time
+    based on the configured bandwidth.
+    """
+    def __init__(self, service, name):
+        """Constructor.
+
+        :param FakeBlobServiceClient service: Parent service client
+        :param str name: Blob name
+        """
+        self.service = service
+        self.name = name
+
+    def upload_blob(self, data, **kwargs):
+        """Block for the upload time and record the upload.
+        """
+        time.sleep(self.service.request_time(len(data)))
+        self.service.record(1, len(data), self.name)
+
+    def stage_block(self, block_id, data, **kwargs):
+        """Block for the upload time of a block and record its bytes.
+        """
+        time.sleep(self.service.request_time(len(data)))
+        self.service.record(0, len(data))
+
+    def commit_block_list(self, block_list, **kwargs):
+        """Block for a request and record the upload.
+        """
+        time.sleep(self.service.request_time(0))
+        self.service.record(1, 0, self.name)
+
+
+class FakeContainerClient:
+    """Azure container client.
+    """
+    def create_container(self):
+        """Create the container, this is a no-op.
+        """
+        pass
+
+
+class FakeBlobServiceClient:
+    """Azure blob service client.
+    """
+    def __init__(self, latency=0.0, bandwidth=0):
+        """Constructor.
+
+        :param latency: Seconds each upload takes, on top of the transfer
+        :param bandwidth: Bytes per second of each upload, 0 for unlimited
+        """
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.lock = threading.Lock()
+        self.uploads = 0
+        self.bytes = 0
+        self.done_times = {}
+
+    def request_time(self, nbytes):
+        """Get the time a request uploading the given number of bytes takes.
+        """
+        delay = self.latency
+        if self.bandwidth > 0:
+            delay += nbytes / self.bandwidth
+        return delay
+
+    def record(self, uploads, nbytes, name=None):
+        """Record completed uploads and uploaded bytes.
+
+        If the name of a blob is given, its upload is recorded as completed
+        now.
+        """
+        with self.lock:
+            self.uploads += uploads
+            self.bytes += nbytes
+            if name is not None:
+                self.done_times[name] = time.monotonic()
+
+    def get_blob_client(self, container, blob):
+        """Get a client for the given blob.
+        """
+        return FakeBlobClient(self, blob)
+
+    def get_container_client(self, container):
+        """Get a client for the given container.
+        """
+        return FakeContainerClient()
+
+
+class FakeAsyncBlobUploader:
+    """Stand-in for :code:`eab.upload.AsyncBlobUploader` which uploads into a
+    :code:`FakeBlobServiceClient` without blocking the asyncio loop.
+
+    Concurrent uploads are limited to the size of the connection pool.
+    """
+    def __init__(self, service, pool_size):
+        """Constructor.
+
+        :param FakeBlobServiceClient service: Service client to record into
+        :param int pool_size: Maximum number of concurrent uploads
+        """
+        self.service = service
+        self.pool_size = pool_size
+        self._connections = None
+
+    async def request(self, nbytes):
+        """Wait for a connection and the time of a request uploading the
+        given number of bytes.
+        """
+        if self._connections is None:
+            # Created here so that it belongs to the running loop
+            self._connections = asyncio.Semaphore(self.pool_size)
+
+        async with self._connections:
+            await asyncio.sleep(self.service.request_time(nbytes))
+
+    def get_blob_client(self, container_name, blob_name):
+        """Get an async client for the given blob.
+        """
+        return FakeAsyncBlobClient(self, blob_name)
+
+    async def upload(self, container_name, blob_name, data, **kwargs):
+        """Wait for the upload and record it.
+        """
+        await self.request(len(data))
+        self.service.record(1, len(data), blob_name)
+
+    async def close(self):
+        """Close the uploader, this is a no-op.
+        """
+        pass
+
+
+class FakeAsyncBlobClient:
+    """Async Azure blob client of a :code:`FakeAsyncBlobUploader`.
+    """
+    def __init__(self, uploader, name):
+        """Constructor.
+
+        :param FakeAsyncBlobUploader uploader: Parent uploader
+        :param str name: Blob name
+        """
+        self.uploader = uploader
+        self.name = name
+
+    async def stage_block(self, block_id, data, **kwargs):
+        """Wait for the upload of a block and record its bytes.
+        """
+        await self.uploader.request(len(data))
+        self.uploader.service.record(0, len(data))
+
+    async def commit_block_list(self, block_list, **kwargs):
+        """Wait for a request and record the upload.
+        """
+        await self.uploader.request(0)
+        self.uploader.service.record(1, 0, self.name)
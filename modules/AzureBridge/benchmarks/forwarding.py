@@ -0,0 +1,425 @@
+# Copyright (c) 2020 Intel Corporation.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM,OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+"""Benchmark of the Azure Bridge forwarding hot path.
+
+Each scenario runs the bridge's subscriber listener against in-process
+stand-ins for the EII Message Bus, the IoT Edge module client and Azure Blob
+Storage (see :code:`benchmarks.fakes`), so it can be run headless without an
+IoT Edge runtime. Every scenario runs in its own process so that its peak
+RSS can be reported.
+
+Run from the AzureBridge module directory with:
+
+    python3 -m benchmarks.forwarding
+"""
+import time
+import json
+import asyncio
+import argparse
+import resource
+import multiprocessing as mp
+
+from benchmarks.fakes import (
+    FakeSubscriber, FakeModuleClient, FakeBlobServiceClient,
+    FakeAsyncBlobUploader)
+from eab.encoder import FrameEncoder, check_encoding
+from eab.metrics import BridgeMetrics
+from eab.topic import Topic
+from eab.upload import UploadPool, UPLOAD_MODE_THREAD, UPLOAD_MODE_ASYNC
+
+# Benchmark scenarios, each is a set of overrides of the default parameters
+SCENARIOS = {
+    'metadata': {},
+    'metadata-metrics': {
+        'metrics': True,
+    },
+    'metadata-traced': {
+        'trace': {},
+    },
+    'metadata-large': {
+        'num_defects': 20,
+    },
+    'metadata-projected': {
+        'num_defects': 20,
+        'metadata': {'include': ['img_handle', 'defects.type']},
+    },
+    'metadata-large-msgpack': {
+        'num_defects': 20,
+        'codec': 'msgpack',
+    },
+    'metadata-large-cbor': {
+        'num_defects': 20,
+        'codec': 'cbor',
+    },
+    'metadata-large-gzip': {
+        'num_defects': 20,
+        'compression': {'algorithm': 'gzip', 'min_bytes': 256},
+    },
+    'metadata-aggregated': {
+        'num_defects': 20,
+        'aggregate': {
+            'window_ms': 100,
+            'forward': False,
+            'reducers': [
+                {'name': 'defects', 'op': 'count', 'field': 'defects'},
+                {'name': 'types', 'op': 'count_by', 'field': 'defects.type'},
+            ],
+        },
+    },
+    'metadata-batched': {
+        'batch': {'max_count': 100, 'max_linger_ms': 50},
+    },
+    'frames': {
+        'frame_size': 1024 * 1024,
+        'container': 'benchmark',
+    },
+    'frames-slow-storage': {
+        'frame_size': 1024 * 1024,
+        'container': 'benchmark',
+        'upload_bandwidth': 50 * 1024 * 1024,
+    },
+    'frames-metrics': {
+        'frame_size': 1024 * 1024,
+        'container': 'benchmark',
+        'metrics': True,
+    },
+    'frames-async': {
+        'frame_size': 1024 * 1024,
+        'container': 'benchmark',
+        'upload_mode': UPLOAD_MODE_ASYNC,
+    },
+    'frames-slow-storage-async': {
+        'frame_size': 1024 * 1024,
+        'container': 'benchmark',
+        'upload_bandwidth': 50 * 1024 * 1024,
+        'upload_mode': UPLOAD_MODE_ASYNC,
+    },
+    'small-frames': {
+        'frame_size': 32 * 1024,
+        'container': 'benchmark',
+    },
+    'small-frames-packed': {
+        'frame_size': 32 * 1024,
+        'container': 'benchmark',
+        'pack': {'max_frames': 100, 'max_linger_ms': 1000},
+    },
+    'raw-frames': {
+        'count': 200,
+        'frame_size': 1920 * 1080 * 3,
+        'encoding': None,
+        'container': 'benchmark',
+    },
+    'raw-frames-jpeg': {
+        'count': 200,
+        'frame_size': 1920 * 1080 * 3,
+        'encoding': None,
+        'container': 'benchmark',
+        'encode': {'format': 'jpeg'},
+    },
+    'raw-frames-zstd': {
+        'count': 200,
+        'frame_size': 1920 * 1080 * 3,
+        'encoding': None,
+        'container': 'benchmark',
+        'encode': {'format': 'zstd'},
+    },
+    'raw-frames-slow-storage': {
+        'rate': 5,
+        'count': 100,
+        'frame_size': 6 * 1024 * 1024,
+        'encoding': None,
+        'container': 'benchmark',
+        'upload_bandwidth': 50 * 1024 * 1024,
+    },
+    'raw-frames-slow-storage-blocks': {
+        'rate': 5,
+        'count': 100,
+        'frame_size': 6 * 1024 * 1024,
+        'encoding': None,
+        'container': 'benchmark',
+        'upload_bandwidth': 50 * 1024 * 1024,
+        'block_upload': {'threshold': 4 * 1024 * 1024,
+                         'block_size': 1024 * 1024,
+                         'max_concurrency': 4},
+    },
+}
+
+DEFAULTS = {
+    'topics': 1,
+    'rate': 0,
+    'count': 5000,
+    'frame_size': 0,
+    'encoding': 'jpeg',
+    'container': None,
+    'num_defects': 2,
+    'codec': 'json',
+    'compression': None,
+    'metadata': None,
+    'batch': None,
+    'encode': None,
+    'encode_workers': 4,
+    'block_upload': None,
+    'pack': None,
+    'aggregate': None,
+    'metrics': False,
+    'trace': None,
+    'queue_depth': 16,
+    'send_latency': 0.001,
+    'upload_latency': 0.005,
+    'upload_bandwidth': 0,
+    'upload_mode': UPLOAD_MODE_THREAD,
+    'upload_workers': 4,
+    'max_inflight_uploads': 32,
+    'max_inflight_bytes': 128 * 1024 * 1024,
+    'timeout': 120.0,
+}
+
+
+class BenchBridgeState:
+    """Stand-in for :code:`eab.bridge_state.BridgeState` with only the
+    attributes used by the subscriber listeners.
+    """
+    def __init__(self, loop, params):
+        """Constructor.
+
+        :param loop: asyncio loop
+        :param dict params: Scenario parameters
+        """
+        self.loop = loop
+        self.module_client = FakeModuleClient(params['send_latency'])
+        self.store_forward = None
+        if params['container'] is not None:
+            self.bsc = FakeBlobServiceClient(
+                    params['upload_latency'], params['upload_bandwidth'])
+            self.upload_pool = UploadPool(
+                    params['upload_workers'], params['max_inflight_bytes'],
+                    params['max_inflight_uploads'])
+        else:
+            self.bsc = None
+            self.upload_pool = None
+
+        self.metrics = BridgeMetrics() if params['metrics'] else None
+
+        self.frame_encoder = None
+        if params['encode'] is not None:
+            check_encoding(params['encode']['format'])
+            self.frame_encoder = FrameEncoder(params['encode_workers'])
+
+        self.async_uploader = None
+        if self.bsc is not None and params['upload_mode'] == UPLOAD_MODE_ASYNC:
+            self.async_uploader = FakeAsyncBlobUploader(
+                    self.bsc, params['max_inflight_uploads'])
+
+
+def percentile(values, pct):
+    """Get the given percentile of a list of values.
+    """
+    if not values:
+        return float('nan')
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(pct / 100.0 * (len(values) - 1))))
+    return values[index]
+
+
+async def run_scenario(params):
+    """Run a single scenario in the current process.
+
+    :param dict params: Scenario parameters
+    :return: Scenario results
+    :rtype: dict
+    """
+    loop = asyncio.get_event_loop()
+    bs = BenchBridgeState(loop, params)
+
+    subscribers = []
+    topics = []
+    for i in range(params['topics']):
+        name = f'topic{i}'
+        conf = {'az_output_topic': name, 'queue_depth': params['queue_depth'],
+                'codec': params['codec']}
+        if params['container'] is not None:
+            conf['az_blob_container_name'] = params['container']
+        if params['compression'] is not None:
+            conf['compression'] = params['compression']
+        if params['metadata'] is not None:
+            conf['metadata'] = params['metadata']
+        if params['batch'] is not None:
+            conf['batch'] = params['batch']
+        if params['encode'] is not None:
+            conf['encode'] = params['encode']
+        if params['block_upload'] is not None:
+            conf['block_upload'] = params['block_upload']
+        if params['pack'] is not None:
+            conf['pack'] = params['pack']
+        if params['trace'] is not None:
+            conf['trace'] = params['trace']
+        if params['aggregate'] is not None:
+            conf['aggregate'] = dict(params['aggregate'],
+                                     az_output_topic=f'{name}-summary')
+
+        sub = FakeSubscriber(name, params['rate'], params['count'],
+                             params['frame_size'], params['num_defects'],
+                             params['encoding'])
+        subscribers.append(sub)
+        topics.append(Topic(bs, name, sub, conf))
+
+    total = params['count'] * params['topics']
+    summarized_only = params['aggregate'] is not None and \
+        not params['aggregate'].get('forward', True)
+    start = time.monotonic()
+    for topic in topics:
+        topic.start()
+
+    # Wait for every message to be forwarded and every frame uploaded
+    deadline = start + params['timeout']
+    while time.monotonic() < deadline:
+        if summarized_only:
+            done = bs.module_client.summarized >= total
+        else:
+            done = len(bs.module_client.send_times) >= total
+        if bs.bsc is not None and params['pack'] is not None:
+            # Packs hold a varying number of frames
+            done = done and bs.bsc.bytes >= total * params['frame_size']
+        elif bs.bsc is not None:
+            done = done and bs.bsc.uploads >= total
+        if done:
+            break
+        await asyncio.sleep(0.01)
+    elapsed = time.monotonic() - start
+
+    for topic in topics:
+        topic.stop()
+    if bs.upload_pool is not None:
+        bs.upload_pool.shutdown(wait=False)
+    if bs.frame_encoder is not None:
+        bs.frame_encoder.shutdown(wait=False)
+
+    latencies = []
+    send_times = bs.module_client.send_times
+    for sub in subscribers:
+        for img_handle, recv_time in sub.recv_times.items():
+            if img_handle in send_times:
+                latencies.append((send_times[img_handle] - recv_time) * 1000)
+
+    # Time from receiving a frame until its upload completed, for packs this
+    # is the time of the pack's first frame
+    upload_latencies = []
+    if bs.bsc is not None:
+        recv_times = {}
+        for sub in subscribers:
+            recv_times.update(sub.recv_times)
+        for blob_name, done_time in bs.bsc.done_times.items():
+            recv_time = recv_times.get(blob_name.rsplit('.', 1)[0])
+            if recv_time is not None:
+                upload_latencies.append((done_time - recv_time) * 1000)
+
+    forwarded = len(send_times)
+    if summarized_only:
+        # Only the summaries are sent, count the frames they cover
+        forwarded = bs.module_client.summarized
+    results = {
+        'forwarded': forwarded,
+        'expected': total,
+        'elapsed_s': elapsed,
+        'msgs_per_s': forwarded / elapsed,
+        'out_messages': bs.module_client.messages,
+        'out_kb': bs.module_client.bytes / 1024,
+        'p50_ms': percentile(latencies, 50),
+        'p99_ms': percentile(latencies, 99),
+        'blobs': 0,
+        'upload_mb_per_s': 0.0,
+        'upload_p99_ms': percentile(upload_latencies, 99),
+    }
+    if bs.bsc is not None:
+        results['blobs'] = bs.bsc.uploads
+        results['upload_mb_per_s'] = bs.bsc.bytes / elapsed / 1024 ** 2
+    return results
+
+
+def scenario_process(params, results):
+    """Process target running a single scenario.
+    """
+    result = asyncio.get_event_loop().run_until_complete(run_scenario(params))
+
+    # ru_maxrss is in kilobytes on Linux
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    result['peak_rss_mb'] = usage.ru_maxrss / 1024.0
+    results.put(result)
+
+
+def main():
+    """Main method.
+    """
+    ap = argparse.ArgumentParser()
+    ap.add_argument('scenarios', nargs='*', metavar='scenario',
+                    help=f'Scenarios to run, one of {", ".join(SCENARIOS)} '
+                         '(default: all)')
+    for key, value in DEFAULTS.items():
+        if key in ('container', 'encoding', 'compression', 'metadata',
+                   'batch', 'encode', 'block_upload', 'pack',
+                   'aggregate', 'metrics', 'trace'):
+            continue
+        ap.add_argument(f'--{key.replace("_", "-")}', type=type(value),
+                        default=None, help=f'(default: scenario or {value})')
+    ap.add_argument('--json', action='store_true',
+                    help='Print the results as JSON')
+    args = ap.parse_args()
+
+    scenarios = args.scenarios or list(SCENARIOS)
+    for name in scenarios:
+        if name not in SCENARIOS:
+            ap.error(f'Unknown scenario: {name}')
+    all_results = {}
+    ctx = mp.get_context('spawn')
+
+    for name in scenarios:
+        params = dict(DEFAULTS)
+        params.update(SCENARIOS[name])
+        for key in DEFAULTS:
+            value = getattr(args, key, None)
+            if value is not None:
+                params[key] = value
+
+        results = ctx.Queue()
+        proc = ctx.Process(target=scenario_process, args=(params, results))
+        proc.start()
+        all_results[name] = results.get()
+        proc.join()
+
+    if args.json:
+        print(json.dumps(all_results, indent=4))
+        return
+
+    print(f'{"scenario":<27} {"msgs/s":>9} {"p50 (ms)":>9} {"p99 (ms)":>9} '
+          f'{"out msgs":>9} {"out KB":>8} {"blobs":>7} {"upload MB/s":>12} '
+          f'{"upload p99":>11} '
+          f'{"peak RSS MB":>12}')
+    for name, r in all_results.items():
+        if r['forwarded'] < r['expected']:
+            name = f'{name} (timeout)'
+        print(f'{name:<27} {r["msgs_per_s"]:>9.0f} {r["p50_ms"]:>9.2f} '
+              f'{r["p99_ms"]:>9.2f} {r["out_messages"]:>9} '
+              f'{r["out_kb"]:>8.0f} {r["blobs"]:>7} '
+              f'{r["upload_mb_per_s"]:>12.1f} {r["upload_p99_ms"]:>11.2f} '
+              f'{r["peak_rss_mb"]:>12.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,176 @@
+# Copyright (c) 2020 Intel Corporation.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM,OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+"""Benchmark of :code:`eab.config.find_root_changes()` against the previous
+dictdiffer based implementation.
+
+Run from the AzureBridge module directory with:
+
+    python3 -m benchmarks.root_changes
+"""
+import copy
+import timeit
+import argparse
+from dictdiffer import diff
+from eab.config import find_root_changes
+
+
+def legacy_find_root_changes(orig, new):
+    """Previous implementation of :code:`find_root_changes()` which walks
+    every nested value with dictdiffer.
+
+    .. note:: This implementation skips root keys which were added, since
+        dictdiffer reports them as an addition to the root itself.
+    """
+    changes = diff(orig, new)
+    changed_keys = []
+    removed_keys = []
+
+    for change_type, key_info, mod in changes:
+        if change_type == 'change' or change_type == 'add':
+            if isinstance(key_info, (list, tuple,)):
+                key = key_info[0]
+            else:
+                key = key_info
+            if key == '':
+                continue
+            base_key = key.split('.')[0]
+            if base_key not in changed_keys:
+                changed_keys.append(base_key)
+        else:
+            if key_info != '':
+                if isinstance(key_info, (list, tuple,)):
+                    key = key_info[0]
+                else:
+                    key = key_info
+                if key not in changed_keys:
+                    changed_keys.append(key)
+            else:
+                for key, value in mod:
+                    if key in orig and key not in removed_keys:
+                        removed_keys.append(key)
+
+    return (changed_keys, removed_keys,)
+
+
+def make_config(num_services):
+    """Generate a synthetic EII configuration with a config and interfaces
+    key for each service, shaped like the Video Analytics configuration.
+
+    :param int num_services: Number of services
+    :rtype: dict
+    """
+    config = {}
+    for i in range(num_services):
+        name = f'Service{i}'
+        config[f'/{name}/config'] = {
+            'encoding': {'level': 95, 'type': 'jpeg'},
+            'max_jobs': 20,
+            'max_workers': 4,
+            'queue_size': 10,
+            'udfs': [{
+                'device': 'CPU',
+                'model_bin': f'common/udfs/python/{name}/model.bin',
+                'model_xml': f'common/udfs/python/{name}/model.xml',
+                'name': f'{name.lower()}.classifier',
+                'ref_config_roi': f'common/udfs/python/{name}/roi.json',
+                'type': 'python'
+            }]
+        }
+        config[f'/{name}/interfaces'] = {
+            'Publishers': [{
+                'AllowedClients': ['*'],
+                'EndPoint': f'0.0.0.0:{65000 + i}',
+                'Name': 'default',
+                'Topics': [f'{name.lower()}_results'],
+                'Type': 'zmq_tcp'
+            }],
+            'Subscribers': [{
+                'EndPoint': '/EII/sockets',
+                'Name': 'default',
+                'PublisherAppName': 'VideoIngestion',
+                'Topics': ['camera1_stream'],
+                'Type': 'zmq_ipc',
+                'zmq_recv_hwm': 50
+            }]
+        }
+    return config
+
+
+def make_changes(config):
+    """Copy the configuration, changing a nested value in 10% of the keys,
+    removing 5% of the keys and adding one new key.
+
+    :param dict config: Configuration to change
+    :rtype: dict
+    """
+    new = copy.deepcopy(config)
+    keys = list(new.keys())
+    for key in keys[::10]:
+        if key.endswith('/config'):
+            new[key]['udfs'][0]['device'] = 'GPU'
+        else:
+            new[key]['Subscribers'][0]['zmq_recv_hwm'] = 100
+    for key in keys[5::20]:
+        del new[key]
+    new['/NewService/config'] = {}
+    return new
+
+
+def main():
+    """Main method.
+    """
+    ap = argparse.ArgumentParser()
+    ap.add_argument('-s', '--services', type=int, nargs='+',
+                    default=[10, 100, 1000],
+                    help='Number of services in the synthetic configs')
+    ap.add_argument('-n', '--number', type=int, default=0,
+                    help='Iterations per measurement (default: automatic)')
+    args = ap.parse_args()
+
+    print(f'{"services":>8} {"keys":>6} {"legacy (ms)":>12} '
+          f'{"current (ms)":>13} {"speedup":>8}')
+    for num_services in args.services:
+        orig = make_config(num_services)
+        new = make_changes(orig)
+
+        # Both implementations must agree on the result, except that the
+        # legacy implementation does not report newly added root keys
+        expected = legacy_find_root_changes(orig, new)
+        result = find_root_changes(orig, new)
+        added = set(new) - set(orig)
+        assert set(expected[0]) | added == set(result[0]), \
+            'changed keys differ'
+        assert set(expected[1]) == set(result[1]), 'removed keys differ'
+
+        timings = []
+        for fn in (legacy_find_root_changes, find_root_changes):
+            timer = timeit.Timer(lambda: fn(orig, new))
+            number = args.number
+            if number <= 0:
+                number, _ = timer.autorange()
+            best = min(timer.repeat(repeat=5, number=number)) / number
+            timings.append(best * 1000.0)
+
+        print(f'{num_services:>8} {len(orig):>6} {timings[0]:>12.3f} '
+              f'{timings[1]:>13.3f} {timings[0] / timings[1]:>7.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,334 @@
+# Copyright (c) 2020 Intel Corporation.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM,OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+"""Azure Bridge windowed aggregation of meta-data into summary messages.
+
+The frames of a topic are counted into panes of :code:`slide_ms`, and every
+:code:`slide_ms` a summary of the panes in the last :code:`window_ms` is
+sent. Windows are tumbling if the two are equal and sliding otherwise. Each
+reducer keeps a partial result per pane, which are merged into the summary,
+so that sliding windows do not keep the frames themselves.
+
+Pane and window boundaries are computed in integer milliseconds since the
+epoch, so that they do not drift and frames at the edge of a pane are
+counted in the right one.
+"""
+import time
+import asyncio
+import logging
+import numbers
+from collections import deque
+
+from eab.codec import JsonCodec, make_message
+from eab.projection import compile_values
+
+# Custom property set on summary messages, tells consumers that the body of
+# the message is a window summary instead of a frame's meta-data
+AGGREGATE_PROPERTY = 'eab_aggregate'
+AGGREGATE_FORMAT = 'window'
+
+# Keys of every summary, which reducers cannot use as their name
+SUMMARY_KEYS = ('topic', 'window_start_ms', 'window_end_ms', 'frames')
+
+# Default window length
+DEFAULT_WINDOW_MS = 10000
+
+
+def _now_ms():
+    """Get the current time in milliseconds since the epoch.
+    """
+    return time.time_ns() // 1000000
+
+
+def _numbers(values):
+    """Filter the numeric values of a field.
+    """
+    return [v for v in values
+            if isinstance(v, numbers.Number) and not isinstance(v, bool)]
+
+
+class Reducer:
+    """Reduces a field of the meta-data of a window's frames to a value.
+
+    The supported operations are :code:`count`, which counts the frames, or
+    the values of the field if one is given, :code:`count_by`, which counts
+    the frames by each value of the field, and :code:`sum`, :code:`min`,
+    :code:`max` and :code:`mean` of the numeric values of the field.
+    """
+    OPS = ('count', 'count_by', 'sum', 'min', 'max', 'mean')
+
+    def __init__(self, name, op, field=None):
+        """Constructor.
+
+        :param str name: Key of the result in the summary
+        :param str op: Reducer operation
+        :param str field: Dot separated field path, only optional for the
+            count operation
+        :raises ValueError: If the reducer is invalid
+        """
+        if op not in self.OPS:
+            raise ValueError(f'Unknown reducer operation: {op}')
+        if field is None and op != 'count':
+            raise ValueError(f'Reducer operation {op} requires a field')
+        self.name = name
+        self.op = op
+        self.values = compile_values(field) if field is not None else None
+
+    @classmethod
+    def from_config(cls, reducer_conf):
+        """Create a reducer from its configuration.
+
+        :param dict reducer_conf: Reducer configuration from the digital twin
+        :return: Reducer
+        """
+        return cls(reducer_conf['name'], reducer_conf['op'],
+                   reducer_conf.get('field'))
+
+    def new(self):
+        """Get the partial result of an empty pane.
+        """
+        if self.op == 'count_by':
+            return {}
+        if self.op == 'mean':
+            return [0, 0]
+        if self.op == 'count':
+            return 0
+        return None
+
+    def add(self, partial, meta_data):
+        """Add a frame's meta-data to a partial result.
+
+        :param partial: Partial result
+        :param dict meta_data: Meta-data of the frame
+        :return: New partial result
+        """
+        if self.op == 'count':
+            if self.values is None:
+                return partial + 1
+            return partial + len(self.values(meta_data))
+        if self.op == 'count_by':
+            for value in self.values(meta_data):
+                key = str(value)
+                partial[key] = partial.get(key, 0) + 1
+            return partial
+
+        values = _numbers(self.values(meta_data))
+        if not values:
+            return partial
+        if self.op == 'mean':
+            partial[0] += sum(values)
+            partial[1] += len(values)
+            return partial
+        if self.op == 'sum':
+            value = sum(values)
+        elif self.op == 'min':
+            value = min(values)
+        else:
+            value = max(values)
+        return value if partial is None else self.merge([partial, value])
+
+    def merge(self, partials):
+        """Merge the partial results of panes.
+
+        :param list partials: Partial results
+        :return: Merged partial result
+        """
+        if self.op == 'count_by':
+            merged = {}
+            for partial in partials:
+                for key, count in partial.items():
+                    merged[key] = merged.get(key, 0) + count
+            return merged
+        if self.op == 'mean':
+            return [sum(p[0] for p in partials), sum(p[1] for p in partials)]
+        if self.op == 'count':
+            return sum(partials)
+        partials = [p for p in partials if p is not None]
+        if not partials:
+            return None
+        if self.op == 'sum':
+            return sum(partials)
+        if self.op == 'min':
+            return min(partials)
+        return max(partials)
+
+    def result(self, partial):
+        """Get the value of a merged partial result for the summary.
+        """
+        if self.op == 'mean':
+            return partial[0] / partial[1] if partial[1] else None
+        return partial
+
+
+class WindowAggregator:
+    """Aggregates the meta-data of a topic's frames into a summary message
+    per window.
+    """
+    def __init__(self, send, topic, output_name, reducers, window_ms,
+                 slide_ms=None, codec=None, compressor=None,
+                 clock=_now_ms):
+        """Constructor.
+
+        :param send: Coroutine function called with the message and output
+            name to send a summary
+        :param str topic: EII Message Bus topic, added to the summaries
+        :param str output_name: Output stream name of the summaries
+        :param list reducers: List of :code:`Reducer` objects
+        :param int window_ms: Window length in milliseconds
+        :param int slide_ms: Time in milliseconds between windows, the
+            window length for tumbling windows
+        :param codec: Codec to serialize the summaries, defaults to JSON
+        :param eab.codec.Compressor compressor: Optional compressor for the
+            summaries
+        :param clock: Function returning the current time in integer
+            milliseconds
+        :raises ValueError: If the window is invalid
+        """
+        if slide_ms is None:
+            slide_ms = window_ms
+        window_ms = int(window_ms)
+        slide_ms = int(slide_ms)
+        if slide_ms <= 0 or window_ms < slide_ms:
+            raise ValueError('Window slide must be positive and not longer '
+                             'than the window')
+        if window_ms % slide_ms != 0:
+            raise ValueError('Window length must be a multiple of its slide')
+
+        self.log = logging.getLogger(output_name)
+        self.send = send
+        self.topic = topic
+        self.output_name = output_name
+        self.codec = codec if codec is not None else JsonCodec()
+        self.compressor = compressor
+        self.reducers = reducers
+        self.window_ms = window_ms
+        self.slide_ms = slide_ms
+        self.clock = clock
+        # Deque of (pane start, frames, partial results)
+        self._panes = deque()
+        self._task = None
+
+    @classmethod
+    def from_config(cls, send, topic, aggregate_conf, codec=None,
+                    compressor=None):
+        """Create an aggregator from a topic's :code:`aggregate`
+        configuration.
+
+        :param send: Coroutine function called with the message and output
+            name to send a summary
+        :param str topic: EII Message Bus topic, added to the summaries
+        :param dict aggregate_conf: Aggregation configuration from the
+            digital twin
+        :param codec: Codec to serialize the summaries, defaults to JSON
+        :param eab.codec.Compressor compressor: Optional compressor for the
+            summaries
+        :return: WindowAggregator
+        :raises ValueError: If the configuration is invalid
+        """
+        reducers = [Reducer.from_config(r)
+                    for r in aggregate_conf.get('reducers', [])]
+        names = [r.name for r in reducers]
+        if len(set(names)) != len(names):
+            raise ValueError('Reducer names must be unique')
+        reserved = set(names).intersection(SUMMARY_KEYS)
+        if reserved:
+            raise ValueError(f'Reserved reducer names: {sorted(reserved)}')
+        return cls(send, topic, aggregate_conf['az_output_topic'], reducers,
+                   aggregate_conf.get('window_ms', DEFAULT_WINDOW_MS),
+                   aggregate_conf.get('slide_ms'), codec, compressor)
+
+    def _pane_start(self, t_ms):
+        """Get the start of the pane which the given time in milliseconds is
+        in.
+        """
+        return t_ms - t_ms % self.slide_ms
+
+    def add(self, meta_data):
+        """Add a frame's meta-data to the current pane.
+
+        :param dict meta_data: Meta-data of the frame
+        """
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+
+        start = self._pane_start(self.clock())
+        if not self._panes or self._panes[-1][0] != start:
+            self._panes.append([start, 0, [r.new() for r in self.reducers]])
+        pane = self._panes[-1]
+        pane[1] += 1
+        partials = pane[2]
+        for i, reducer in enumerate(self.reducers):
+            partials[i] = reducer.add(partials[i], meta_data)
+
+    def summarize(self, end_ms):
+        """Summarize the window ending at the given time and drop the panes
+        which are not in any later window.
+
+        :param int end_ms: End of the window in milliseconds since the epoch
+        :return: Summary, or None if the window has no frames
+        :rtype: dict
+        """
+        start_ms = end_ms - self.window_ms
+        panes = [p for p in self._panes if start_ms <= p[0] < end_ms]
+
+        keep_from = start_ms + self.slide_ms
+        while self._panes and self._panes[0][0] < keep_from:
+            self._panes.popleft()
+
+        frames = sum(p[1] for p in panes)
+        if frames == 0:
+            return None
+
+        summary = {
+            'topic': self.topic,
+            'window_start_ms': start_ms,
+            'window_end_ms': end_ms,
+            'frames': frames,
+        }
+        for i, reducer in enumerate(self.reducers):
+            partial = reducer.merge([p[2][i] for p in panes])
+            summary[reducer.name] = reducer.result(partial)
+        return summary
+
+    async def _run(self):
+        """Send a summary at the end of every slide.
+        """
+        while True:
+            now_ms = self.clock()
+            end_ms = self._pane_start(now_ms) + self.slide_ms
+            await asyncio.sleep((end_ms - now_ms) / 1000.0)
+            summary = self.summarize(end_ms)
+            if summary is None:
+                continue
+            msg = make_message(self.codec, self.codec.encode(summary),
+                               self.compressor)
+            msg.custom_properties[AGGREGATE_PROPERTY] = AGGREGATE_FORMAT
+            try:
+                await self.send(msg, self.output_name)
+            except asyncio.CancelledError:
+                raise
+            except Exception as ex:
+                self.log.error(f'Failed to send summary: {ex}')
+
+    def stop(self):
+        """Stop sending summaries.
+        """
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
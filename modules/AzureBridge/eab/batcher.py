@@ -0,0 +1,160 @@
+# Copyright (c) 2020 Intel Corporation.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM,OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+"""Azure Bridge batching of messages sent over the IoT Edge Runtime bus.
+"""
+import asyncio
+import logging
+
+from eab.codec import JsonCodec, make_message
+
+# Custom property set on batched messages, tells consumers that the body of
+# the message is an array of meta-data objects. Its value is the codec's
+# batch format, e.g. json-array.
+BATCH_PROPERTY = 'eab_batch'
+BATCH_FORMAT = JsonCodec.batch_format
+
+# Default batching limits, the byte limit is also the largest allowed by the
+# schema and leaves room under the 256 KB IoT Hub message size limit for the
+# message's properties and system headers
+DEFAULT_BATCH_MAX_COUNT = 100
+DEFAULT_BATCH_MAX_BYTES = 240 * 1024
+DEFAULT_BATCH_MAX_LINGER_MS = 100
+
+
+class OutputBatcher:
+    """Packs serialized meta-data objects into a single array message before
+    sending it over the IoT Edge Runtime bus.
+
+    A batch is sent once it holds the maximum number of objects, once adding
+    another object would take it over the maximum size, or once the oldest
+    object in it has waited for the maximum linger time.
+    """
+    def __init__(self, send, output_name, max_count, max_bytes,
+                 max_linger_ms, codec=None, compressor=None):
+        """Constructor.
+
+        :param send: Coroutine function called with the message and output
+            name to send a batch
+        :param str output_name: Output stream name
+        :param int max_count: Maximum number of objects in a batch
+        :param int max_bytes: Maximum size of a batch's body in bytes
+        :param max_linger_ms: Maximum time in milliseconds to wait for a
+            batch to fill up
+        :param codec: Codec which serialized the objects, defaults to JSON
+        :param eab.codec.Compressor compressor: Optional compressor for the
+            batches
+        """
+        self.log = logging.getLogger(output_name)
+        self.send = send
+        self.output_name = output_name
+        self.max_count = max_count
+        self.max_bytes = max_bytes
+        self.max_linger = max_linger_ms / 1000.0
+        self.codec = codec if codec is not None else JsonCodec()
+        self.compressor = compressor
+        self._items = []
+        self._size = 0
+        self._stamp = None
+        self._timer = None
+        self._send_lock = asyncio.Lock()
+
+    @classmethod
+    def from_config(cls, send, output_name, batch_conf, codec=None,
+                    compressor=None):
+        """Create a batcher from a topic's :code:`batch` configuration.
+
+        :param send: Coroutine function called with the message and output
+            name to send a batch
+        :param str output_name: Output stream name
+        :param dict batch_conf: Batch configuration from the digital twin
+        :param codec: Codec which serialized the objects, defaults to JSON
+        :param eab.codec.Compressor compressor: Optional compressor for the
+            batches
+        :return: OutputBatcher
+        """
+        return cls(send, output_name,
+                   batch_conf.get('max_count', DEFAULT_BATCH_MAX_COUNT),
+                   batch_conf.get('max_bytes', DEFAULT_BATCH_MAX_BYTES),
+                   batch_conf.get('max_linger_ms',
+                                  DEFAULT_BATCH_MAX_LINGER_MS),
+                   codec, compressor)
+
+    async def add(self, payload, stamp=None):
+        """Add a serialized object to the current batch.
+
+        :param payload: Object serialized by the batcher's codec
+        :param stamp: Function called with the batch's message before it is
+            sent, e.g. to add trace properties. Only the one given with the
+            first object of a batch is used.
+        """
+        # JSON payloads are ASCII, because json.dumps() escapes non-ASCII
+        # characters by default. Each item also takes a separator, which
+        # also leaves room for the array header of binary codecs.
+        size = len(payload) + 1
+
+        if self._items and self._size + size + 1 > self.max_bytes:
+            await self.flush()
+
+        if not self._items:
+            self._stamp = stamp
+        self._items.append(payload)
+        self._size += size
+
+        if len(self._items) >= self.max_count or \
+                self._size + 1 >= self.max_bytes:
+            await self.flush()
+        elif self._timer is None:
+            self._timer = asyncio.ensure_future(self._linger())
+
+    async def _linger(self):
+        """Send the current batch once it has waited for the linger time.
+        """
+        await asyncio.sleep(self.max_linger)
+        self._timer = None
+        try:
+            await self.flush()
+        except Exception as ex:
+            self.log.error(f'Failed to send batch: {ex}')
+
+    async def flush(self):
+        """Send the current batch, if it contains any objects.
+        """
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        if not self._items:
+            return
+
+        items = self._items
+        stamp = self._stamp
+        self._items = []
+        self._size = 0
+        self._stamp = None
+
+        msg = make_message(self.codec, self.codec.encode_batch(items),
+                           self.compressor)
+        msg.custom_properties[BATCH_PROPERTY] = self.codec.batch_format
+
+        self.log.debug(f'Sending batch of {len(items)} messages')
+        async with self._send_lock:
+            if stamp is not None:
+                stamp(msg)
+            await self.send(msg, self.output_name)
@@ -24,10 +24,26 @@ import json
 import asyncio
 import logging
 import time
-import etcd3
 from distutils.util import strtobool
 from jsonschema import validate
-from eab.subscriber import emb_subscriber_listener
+from eab.aggregator import WindowAggregator
+from eab.codec import Compressor, get_codec
+from eab.encoder import FrameEncoder, check_encoding
+from eab.etcd_client import (
+    EtcdClient, DEFAULT_MAX_TXN_OPS, DEFAULT_MAX_TXN_BYTES)
+from eab.metrics import BridgeMetrics, MetricsServer, DEFAULT_METRICS_HOST
+from eab.msgbus import MsgbusContextPool
+from eab.projection import MetadataSpec
+from eab.spool import (
+    Spool, StoreAndForward, BLOB_SPOOL_DIR, EVICT_OLDEST,
+    DEFAULT_SPOOL_MAX_BYTES,
+    DEFAULT_SPOOL_SEGMENT_BYTES, DEFAULT_SPOOL_DRAIN_RATE,
+    DEFAULT_SPOOL_SEND_TIMEOUT_MS)
+from eab.telemetry import TelemetryReporter, DEFAULT_TELEMETRY_DETAIL
+from eab.topic import Topic
+from eab.trace import Tracer
+from eab.upload import (
+    UploadPool, AsyncBlobUploader, UPLOAD_MODE_THREAD, UPLOAD_MODE_ASYNC)
 from eab.config import *
 
 # Azure Imports
@@ -38,7 +54,6 @@ from azure.storage.blob import BlobServiceClient
 import eii.msgbus as emb
 import cfgmgr.config_manager as cfg
 from util.log import configure_logging
-from util.util import Util
 
 
 class BridgeState:
@@ -84,32 +99,201 @@ class BridgeState:
 
         # Assign initial state values
         self.loop = asyncio.get_event_loop()
-        self.ipc_msgbus_ctxs = {}
-        self.tcp_msgbus_ctxs = {}
+        # Topics on the same endpoint share a message bus context
+        self.msgbus_ctxs = MsgbusContextPool(emb.MsgbusContext)
+        self.msgbus_configs = {}
         self.config_listener = None
-        self.subscriber_listeners = None
-        self.subscribers = []
+        self.topics = {}
         self.config = None  # Saved digital twin
+        self.config_hash = None  # Hash of the applied digital twin
+        # Seconds taken by each startup phase, the phases of the IoT Hub
+        # and EII setup overlap since they run concurrently
+        self.startup_timings = {}
 
         # Setup Azure Blob connection
         conn_str = os.getenv('AZURE_STORAGE_CONNECTION_STRING')
         if conn_str is not None:
             self.log.info('Azure blob storage ENABLED in Azure bridge')
             self.bsc = BlobServiceClient.from_connection_string(conn_str)
+
+            # Pool of worker threads shared by all subscribers for uploads
+            upload_workers = int(os.getenv('AZ_BLOB_UPLOAD_WORKERS', '4'))
+            max_inflight_uploads = int(
+                os.getenv('AZ_BLOB_MAX_INFLIGHT_UPLOADS', '32'))
+            max_inflight_bytes = int(
+                os.getenv('AZ_BLOB_MAX_INFLIGHT_BYTES', str(128 * 1024 ** 2)))
+            self.log.info(
+                f'Blob upload pool: {upload_workers} workers, '
+                f'{max_inflight_uploads} uploads / {max_inflight_bytes} '
+                'bytes max in-flight')
+            self.upload_pool = UploadPool(
+                upload_workers, max_inflight_bytes, max_inflight_uploads)
+
+            upload_mode = os.getenv('AZ_BLOB_UPLOAD_MODE', UPLOAD_MODE_THREAD)
+            if upload_mode == UPLOAD_MODE_ASYNC:
+                # Connection pool sized to the number of in-flight uploads
+                self.log.info('Using async blob uploads')
+                self.async_uploader = AsyncBlobUploader(
+                    conn_str, max_inflight_uploads)
+            elif upload_mode == UPLOAD_MODE_THREAD:
+                self.async_uploader = None
+            else:
+                raise ValueError(
+                    f'Unknown AZ_BLOB_UPLOAD_MODE: {upload_mode}')
+
+            # Pool of worker processes for topics which encode raw frames
+            encode_workers = int(
+                os.getenv('FRAME_ENCODE_WORKERS', str(os.cpu_count() or 1)))
+            self.frame_encoder = FrameEncoder(encode_workers)
         else:
             self.log.warn('Azure blob storage DISABLED')
             self.bsc = None
+            self.upload_pool = None
+            self.async_uploader = None
+            self.frame_encoder = None
+
+        # Setup the store-and-forward spool
+        spool_dir = os.getenv('SPOOL_DIR')
+        self.spool_drainer = None
+        if spool_dir:
+            self.log.info(f'Store-and-forward spool ENABLED in {spool_dir}')
+            spool_max_bytes = int(os.getenv(
+                'SPOOL_MAX_BYTES', str(DEFAULT_SPOOL_MAX_BYTES)))
+            spool_segment_bytes = int(os.getenv(
+                'SPOOL_SEGMENT_BYTES', str(DEFAULT_SPOOL_SEGMENT_BYTES)))
+            spool_eviction = os.getenv('SPOOL_EVICTION', EVICT_OLDEST)
+            # Messages and frames share the size cap of the spool evenly
+            spools = [
+                Spool(directory, spool_max_bytes // 2, spool_segment_bytes,
+                      spool_eviction)
+                for directory in (spool_dir,
+                                  os.path.join(spool_dir, BLOB_SPOOL_DIR))]
+            self.store_forward = StoreAndForward(
+                *spools,
+                float(os.getenv('SPOOL_DRAIN_RATE',
+                                str(DEFAULT_SPOOL_DRAIN_RATE))),
+                float(os.getenv('SPOOL_SEND_TIMEOUT_MS',
+                                str(DEFAULT_SPOOL_SEND_TIMEOUT_MS))))
+        else:
+            self.store_forward = None
+
+        # Metrics are only recorded for the metrics endpoint and the twin
+        # telemetry
+        metrics_port = os.getenv('METRICS_PORT')
+        telemetry_interval = float(os.getenv('TELEMETRY_INTERVAL_S', '0'))
+        if metrics_port or telemetry_interval > 0:
+            self.metrics = BridgeMetrics(self)
+        else:
+            self.metrics = None
+
+        if metrics_port:
+            self.metrics_server = MetricsServer(
+                self.metrics, int(metrics_port),
+                os.getenv('METRICS_HOST', DEFAULT_METRICS_HOST))
+            self.loop.run_until_complete(self.metrics_server.start())
+        else:
+            self.metrics_server = None
+
+        self.telemetry = None
+        self.telemetry_reporter = None
+        if telemetry_interval > 0:
+            self.telemetry = TelemetryReporter(
+                self, telemetry_interval,
+                os.getenv('TELEMETRY_DETAIL', DEFAULT_TELEMETRY_DETAIL))
+
+        self.module_client = None
+        self.loop.run_until_complete(self._start())
+
+        # Start reporting the telemetry in the module twin
+        if self.telemetry is not None:
+            self.telemetry_reporter = asyncio.ensure_future(
+                    self.telemetry.run())
+
+        # Start replaying whatever is left in the spool
+        if self.store_forward is not None:
+            self.spool_drainer = asyncio.ensure_future(
+                    self.store_forward.drain(self))
+
+        # Setup twin listener
+        debounce_ms = float(os.getenv(
+            'CONFIG_DEBOUNCE_MS', str(DEFAULT_CONFIG_DEBOUNCE_MS)))
+        self.config_listener = asyncio.gather(
+                config_listener(self, debounce_ms))
+
+    async def _start(self):
+        """Helper function to connect to the Azure IoT Hub and the EII
+        services, and configure the bridge with the initial digital twin.
+
+        The IoT Hub connection and the EII setup do not depend on each
+        other, so they run concurrently. The time taken by each phase is
+        logged and kept in :code:`startup_timings`.
+        """
+        start = time.monotonic()
+        twin, _ = await asyncio.gather(self._init_module_client(),
+                                       self._init_eii())
+
+        # Configure the Azure bridge state with its initial state
+        await self._timed('configure', self.configure(twin['desired']))
+
+        self.startup_timings['total'] = time.monotonic() - start
+        self.log.info('Azure Bridge started in {:.3f}s ({})'.format(
+            self.startup_timings['total'],
+            ', '.join(f'{phase}: {elapsed:.3f}s' for phase, elapsed
+                      in self.startup_timings.items() if phase != 'total')))
 
+    async def _timed(self, phase, aw):
+        """Helper function to await a startup phase and record its time.
+
+        :param str phase: Name of the phase
+        :param aw: Awaitable of the phase
+        :return: Result of the phase
+        """
+        start = time.monotonic()
+        result = await aw
+        self.startup_timings[phase] = time.monotonic() - start
+        self.log.debug(f'Startup phase {phase} took '
+                       f'{self.startup_timings[phase]:.3f}s')
+        return result
+
+    async def _init_module_client(self):
+        """Helper function to connect the Azure IoT Hub module client and
+        get the initial digital twin.
+
+        :return: Digital twin
+        :rtype: dict
+        """
         self.log.info('Initializing Azure module client')
-        self.module_client = IoTHubModuleClient.create_from_edge_environment()
-        self.loop.run_until_complete(self.module_client.connect())
+        self.module_client = await self._timed(
+            'module_client', self.loop.run_in_executor(
+                None, IoTHubModuleClient.create_from_edge_environment))
+        await self._timed('connect', self.module_client.connect())
 
         self.log.info('Getting initial digital twin')
-        twin = self.loop.run_until_complete(self.module_client.get_twin())
+        twin = await self._timed('twin', self.module_client.get_twin())
         self.log.debug('Received initial digital twin')
+        return twin
 
+    async def _init_eii(self):
+        """Helper function to initialize the EII config manager and the
+        ETCD client in the loop's executor.
+        """
         self.log.info('Initializing EII config manager')
+        await self._timed('config_mgr', self.loop.run_in_executor(
+            None, self._init_config_mgr))
+        self.log.debug('Finished initializing config manager')
 
+        # ETCD client kept connected for applying the EII configuration
+        self.etcd = await self._timed('etcd', self.loop.run_in_executor(
+            None, EtcdClient, self.dev_mode,
+            int(os.getenv('ETCD_MAX_TXN_OPS', str(DEFAULT_MAX_TXN_OPS))),
+            int(os.getenv('ETCD_MAX_TXN_BYTES', str(DEFAULT_MAX_TXN_BYTES)))))
+
+    def _init_config_mgr(self):
+        """Helper function to initialize the EII config manager.
+
+        .. warning:: This function blocks, it must not be called from the
+            asyncio loop.
+        """
         try:
             self.config_mgr = cfg.ConfigMgr()
             self.dev_mode = self.config_mgr.is_dev_mode()
@@ -118,37 +302,27 @@ class BridgeState:
             self.log.exception(f'Exception: {ex}')
             raise ex
 
-        self.log.debug('Finished initializing config manager')
-
-        # Configure the Azure bridge state with its initial state
-        self.configure(twin['desired'])
-
-        # Setup twin listener
-        self.config_listener = asyncio.gather(config_listener(self))
-
-    def configure(self, config):
+    async def configure(self, config):
         """Configure the Azure Bridge using the given Azure digital
         twin for the module.
 
-        .. warning:: This will clear out any previous state that existed (i.e.
-            all subscribers will be stopped)
+        All of the blocking work (i.e. reading the EII Message Bus
+        configuration, creating message bus contexts, and talking to ETCD)
+        is done in the loop's executor, so that the running subscribers keep
+        forwarding messages while the configuration is applied.
+
+        .. note:: Subscribers of topics whose configuration did not change
+            keep running, see :code:`_configure_topics()`.
 
         :param dict config: Azure IoT Hub digital twin for the Azure Bridge
         """
         self.log.info('Configuring the Azure Bridge')
+        start = time.monotonic()
 
         # Verify the configuration
         self.log.debug('Validating JSON schema of new configuration')
         validate(instance=config, schema=self.schema)
 
-        # Reset message bus state if needed
-        if self.ipc_msgbus_ctxs or self.tcp_msgbus_ctxs:
-            # Stop all subscribers
-            self.log.debug('Stopping previous subscribers')
-
-            # Clean up the message bus contexts and subscribers
-            self._cleanup_msgbus_ctxs()
-
         # Configure logging
         if 'log_level' in config:
             log_level = config['log_level'].upper()
@@ -158,54 +332,23 @@ class BridgeState:
         self.log = configure_logging(log_level, __name__, False)
 
         self.log.info('Getting EII Message Bus configuration')
-        ipc_msgbus_config, tcp_msgbus_config = get_msgbus_config(
+        ipc_msgbus_config, tcp_msgbus_config = await self.loop.run_in_executor(
+            None, get_msgbus_config,
             self.app_name, self.config_mgr, self.dev_mode)
 
         self.log.debug(f'Topic msgbus config dict: \nIPC: '
                        f'{ipc_msgbus_config}, \nTCP:{tcp_msgbus_config}')
 
-        # Initialize message bus context
-        self.log.info('Initializing EII Message Bus')
-        if ipc_msgbus_config:
-            for topic, msgbus_config in ipc_msgbus_config.items():
-                ipc_msgbus_ctx = emb.MsgbusContext(msgbus_config)
-                self.ipc_msgbus_ctxs[topic] = ipc_msgbus_ctx
-        if tcp_msgbus_config:
-            for topic, msgbus_config in tcp_msgbus_config.items():
-                tcp_msgbus_ctx = emb.MsgbusContext(msgbus_config)
-                self.tcp_msgbus_ctxs[topic] = tcp_msgbus_ctx
+        # IPC configurations take precedence if a topic is in both
+        msgbus_configs = dict(tcp_msgbus_config)
+        msgbus_configs.update(ipc_msgbus_config)
 
-        # Initialize subscribers
-        listener_coroutines = []
+        # Verify the topics before changing any state, so that an invalid
+        # topic leaves the running subscribers untouched
+        self._verify_topics(config['topics'], msgbus_configs)
 
         try:
-            for (in_topic, topic_conf) in config['topics'].items():
-                self.log.info(f'Creating subscriber {in_topic}')
-                self.log.debug(f'{in_topic} config: {topic_conf}')
-                if 'az_output_topic' not in topic_conf:
-                    raise AssertionError('Missing az_output_topic')
-
-                if self.bsc is not None and \
-                        'az_blob_container_name' in topic_conf:
-                    cn = topic_conf['az_blob_container_name']
-                else:
-                    cn = None
-
-                msgbus_ctx = None
-                if in_topic in self.ipc_msgbus_ctxs:
-                    msgbus_ctx = self.ipc_msgbus_ctxs[in_topic]
-                elif in_topic in self.tcp_msgbus_ctxs:
-                    msgbus_ctx = self.tcp_msgbus_ctxs[in_topic]
-                else:
-                    raise RuntimeError(
-                        f'Cannot find {in_topic} msgbus context')
-
-                # Initialize the subcsriber
-                subscriber = msgbus_ctx.new_subscriber(in_topic)
-
-                self.subscribers.append(subscriber)
-                listener_coroutines.append(emb_subscriber_listener(
-                    self, subscriber, topic_conf['az_output_topic'], cn))
+            await self._configure_topics(config['topics'], msgbus_configs)
         except Exception as ex:
             # Clean up the message bus contexts
             self._cleanup_msgbus_ctxs()
@@ -214,77 +357,166 @@ class BridgeState:
             # Re-raise whatever exception just occurred
             raise
 
-        # Schedule task for C2D Listener
-        self.subscriber_listeners = asyncio.gather(*listener_coroutines)
-
         # Configure EII
-        self.log.info('Getting ETCD configuration')
+        await self.loop.run_in_executor(None, self._apply_eii_config, config)
 
-        # NOTE: THIS IS A HACK, AND NEEDS TO BE FIXED IN THE FUTURE
-        hostname = 'localhost'
+        # Save configuration for future comparisons
+        self.config = config
+        # Twin meta-data, e.g. $version, is not part of the configuration
+        self.config_hash = config_hash(
+            {k: v for k, v in config.items() if not k.startswith('$')})
 
-        # This change will be moved to an argument to the function in 2.3
-        # This is done now for backward compatibility
-        etcd_host = os.getenv('ETCD_HOST')
-        if etcd_host is not None and etcd_host != '':
-            hostname = etcd_host
+        if self.metrics is not None:
+            self.metrics.configure_duration.labels().observe(
+                time.monotonic() - start)
 
-        port = os.getenv('ETCD_CLIENT_PORT', '2379')
-        if not Util.check_port_availability(hostname, port):
-            raise RuntimeError(f'etcd service port: {port} is not up!')
+    def _apply_eii_config(self, config):
+        """Helper function to apply the EII configuration from the digital
+        twin into ETCD.
 
-        try:
-            if self.dev_mode:
-                etcd = etcd3.client(host=hostname, port=port)
-            else:
-                etcd = etcd3.client(host=hostname, port=port,
-                                    ca_cert='/run/secrets/rootca/cacert.pem',
-                                    cert_key='/run/secrets/root/root_client_key.pem',
-                                    cert_cert='/run/secrets/root/root_client_certificate.pem')
-        except Exception as e:
-            self.log.exception(f'Exception raised when creating etcd'
-                               f'client instance with error: {e}')
-            raise e
-        resp = etcd.get_all()
-        eii_config = {}
-        for value, meta in resp:
-            try:
-                value = json.loads(value.decode('utf-8'))
-                key = meta.key.decode('utf-8')
-                eii_config[key] = value
-            except Exception as e:
-                # NOTE: Errors may happen if security is enabled, because the
-                # first part is the request's key
-                self.log.error(f'{e}')
+        .. warning:: This function blocks, it must not be called from the
+            asyncio loop.
+
+        :param dict config: Azure IoT Hub digital twin for the Azure Bridge
+        """
+        self.log.info('Getting ETCD configuration')
+        eii_config_hashes = self.etcd.get_config_hashes()
 
         self.log.debug('Finding changes in EII configuration')
         new_eii_config = json.loads(config['eii_config'])
-        changed_keys, removed_keys = find_root_changes(
-            eii_config, new_eii_config)
+        changed_keys, removed_keys = find_hash_changes(
+            eii_config_hashes, config_hashes(new_eii_config))
 
         self.log.debug(f'Changed service configs: {changed_keys}')
         self.log.debug(f'Removed service configs: {removed_keys}')
 
         self.log.info('Applying EII configuration')
+        puts = {key: new_eii_config[key] for key in changed_keys}
+        num_txns = self.etcd.apply(puts, removed_keys)
+        self.log.debug(f'Pushed {len(puts)} and removed {len(removed_keys)} '
+                       f'service configs in {num_txns} transaction(s)')
 
-        self.log.debug('Applying changes to the changed configs')
-        for key in changed_keys:
-            self.log.debug(f'Pushing config for {key}')
-            etcd.put(
-                key, json.dumps(new_eii_config[key], indent=4))
-            self.log.debug(f'Successfully pushed config for {key}')
+        self.log.info('EII configuration update applied')
 
-        self.log.debug('Deleting removed service configs')
-        for key in removed_keys:
-            # NOTE: THIS IS A HACK, AND NEEDS TO BE FIXED IN THE FUTURE
-            self.log.debug(f'Removing config for {key}')
-            etcd.delete(key)
-            self.log.debug(f'Successfully removed config for {key}')
+    def _verify_topics(self, topics, msgbus_configs):
+        """Helper function to verify the given topics configuration without
+        changing any state.
 
-        self.log.info('EII configuration update applied')
+        :param dict topics: Topics configuration from the digital twin
+        :param dict msgbus_configs: Topic->msgbus config dict
+        :raises AssertionError: If a topic has no output name
+        :raises RuntimeError: If a topic has no message bus configuration
+        :raises ValueError: If a topic has invalid settings
+        """
+        for (in_topic, topic_conf) in topics.items():
+            if 'az_output_topic' not in topic_conf:
+                raise AssertionError('Missing az_output_topic')
+            if in_topic not in msgbus_configs:
+                raise RuntimeError(f'Cannot find {in_topic} msgbus context')
+            if 'codec' in topic_conf:
+                get_codec(topic_conf['codec'])
+            if 'compression' in topic_conf:
+                Compressor.from_config(topic_conf['compression'])
+            if 'metadata' in topic_conf:
+                # Compiled again by the topic, this only checks it is valid
+                MetadataSpec.from_config(topic_conf['metadata'])
+            if 'encode' in topic_conf:
+                encode_conf = topic_conf['encode']
+                check_encoding(
+                    encode_conf['format'], encode_conf.get('level'))
+            if 'aggregate' in topic_conf:
+                WindowAggregator.from_config(
+                    None, in_topic, topic_conf['aggregate'])
+            if 'trace' in topic_conf:
+                Tracer.from_config(topic_conf['trace'])
+
+    async def _configure_topics(self, topics, msgbus_configs):
+        """Helper function to bring the running subscribers in line with the
+        given topics configuration.
+
+        Subscribers of topics which are unchanged keep running. Subscribers
+        of topics whose configuration only changed in settings which do not
+        affect the EII Message Bus subscription are updated in place. Only
+        the subscribers of removed topics, new topics, and topics with a new
+        message bus configuration are closed or created.
+
+        .. note:: The topics must have been verified with
+            :code:`_verify_topics()`.
+
+        :param dict topics: Topics configuration from the digital twin
+        :param dict msgbus_configs: Topic->msgbus config dict
+        """
+        # Stop the subscribers which cannot be kept running
+        for in_topic, topic in list(self.topics.items()):
+            if in_topic not in topics:
+                self.log.info(f'Stopping subscriber {in_topic}')
+                if self.metrics is not None:
+                    self.metrics.remove_topic(in_topic)
+            elif msgbus_configs[in_topic] != self.msgbus_configs[in_topic]:
+                self.log.info(f'{in_topic} msgbus config changed')
+            elif topic.requires_restart(topics[in_topic]):
+                self.log.info(f'{in_topic} subscriber settings changed')
+            else:
+                continue
+            self._stop_topic(in_topic)
+
+        new_topics = []
+        for (in_topic, topic_conf) in topics.items():
+            topic = self.topics.get(in_topic)
+            if topic is None:
+                new_topics.append(in_topic)
+            elif topic.conf != topic_conf:
+                self.log.info(f'Updating subscriber {in_topic}')
+                self.log.debug(f'{in_topic} config: {topic_conf}')
+                topic.update(topic_conf)
+
+        # Create the new subscribers concurrently, each starts forwarding as
+        # soon as its own message bus context is ready
+        results = await asyncio.gather(
+            *(self._start_topic(in_topic, topics[in_topic],
+                                msgbus_configs[in_topic])
+              for in_topic in new_topics),
+            return_exceptions=True)
+        for result in results:
+            if isinstance(result, Exception):
+                raise result
+
+        self.log.debug(f'{len(self.topics)} subscriber(s) on '
+                       f'{len(self.msgbus_ctxs)} msgbus context(s)')
+
+    async def _start_topic(self, in_topic, topic_conf, msgbus_config):
+        """Helper function to create the subscriber of a new topic and start
+        forwarding its messages.
+
+        :param str in_topic: EII Message Bus topic
+        :param dict topic_conf: Topic configuration from the digital twin
+        :param dict msgbus_config: Message bus configuration for the topic
+        """
+        self.log.info(f'Creating subscriber {in_topic}')
+        self.log.debug(f'{in_topic} config: {topic_conf}')
 
-        # Save configuration for future comparisons
-        self.config = config
+        # Subscribe on the message bus context shared by the topics on the
+        # same endpoint, which is created if this is its first topic
+        subscriber = await self.loop.run_in_executor(
+                None, self.msgbus_ctxs.new_subscriber, msgbus_config,
+                in_topic)
+        self.msgbus_configs[in_topic] = msgbus_config
+
+        topic = Topic(self, in_topic, subscriber, topic_conf)
+        self.topics[in_topic] = topic
+        topic.start()
+
+    def _stop_topic(self, in_topic):
+        """Helper function to stop the subscriber of a topic and release its
+        message bus context, which is cleaned up once no other topic uses it.
+
+        :param str in_topic: EII Message Bus topic
+        """
+        self.topics.pop(in_topic).stop()
+        msgbus_config = self.msgbus_configs.pop(in_topic, None)
+        if msgbus_config is not None and \
+                self.msgbus_ctxs.release(msgbus_config):
+            self.log.debug(f'Cleaned up msgbus context of {in_topic}')
 
     def stop(self):
         """Fully stop the bridge including the configuration listener and all
@@ -298,8 +530,46 @@ class BridgeState:
             self.log.debug('Stopping the config listener')
             self.config_listener.cancel()
 
-        # Clean up the message bus contexts
-        self._cleanup_msgbus_ctxs()
+        if self.spool_drainer is not None:
+            self.log.debug('Stopping the spool drainer')
+            self.spool_drainer.cancel()
+
+        if self.telemetry_reporter is not None:
+            self.log.debug('Stopping the telemetry reporter')
+            self.telemetry_reporter.cancel()
+
+        if self.metrics_server is not None:
+            self.log.debug('Stopping the metrics endpoint')
+            self.metrics_server.close()
+
+        # Clean up the message bus contexts, and let the listeners send their
+        # last batches and packs before the pools, the spool and the IoT Hub
+        # connection are shut down
+        tasks = self._cleanup_msgbus_ctxs()
+        if tasks:
+            self.log.debug('Waiting for the listeners to finish')
+            self.loop.run_until_complete(
+                    asyncio.gather(*tasks, return_exceptions=True))
+
+        if self.frame_encoder is not None:
+            self.log.debug('Stopping the frame encoder')
+            self.frame_encoder.shutdown()
+
+        if self.upload_pool is not None:
+            self.log.debug('Waiting for pending blob uploads to finish')
+            self.upload_pool.shutdown()
+
+        if self.async_uploader is not None:
+            self.log.debug('Closing the async blob uploader')
+            self.loop.run_until_complete(self.upload_pool.join_tasks())
+            self.loop.run_until_complete(self.async_uploader.close())
+
+        if self.store_forward is not None:
+            self.log.debug('Closing the spool')
+            self.store_forward.close()
+
+        self.log.debug('Closing ETCD client')
+        self.etcd.close()
 
         self.log.debug('Disconnecting from Azure IoT Hub client')
         self.loop.run_until_complete(self.module_client.disconnect())
@@ -307,27 +577,22 @@ class BridgeState:
     def _cleanup_msgbus_ctxs(self):
         """Helper function to clean up the message bus contexts stored within
         the bridge state.
+
+        :return: Tasks of the stopped listeners which are still finishing,
+            see :code:`eab.topic.Topic.stop()`
+        :rtype: list
         """
-        # If the subscriber listeners are running in the asyncio loop stop them
-        if self.subscriber_listeners is not None:
-            self.log.debug('Stopping all EII subscriber listeners')
-            self.subscriber_listeners.cancel()
-
-        # Close existing subscribers
-        self.log.debug('Closing all EII subscribers')
-        for sub in self.subscribers:
-            sub.close()
-
-        # Loop over the IPC and TCP message bus contexts and force their
-        # their deletion so any internal state can be cleanup immediately
-        if self.ipc_msgbus_ctxs:
-            self.log.debug('Cleaning up IPC msgbus context')
-            for topic, msgbus_ctx in self.ipc_msgbus_ctxs.items():
-                del msgbus_ctx
-            self.ipc_msgbus_ctxs = {}
-
-        if self.tcp_msgbus_ctxs:
-            self.log.debug('Cleaning up TCP msgbus context')
-            for topic, msgbus_ctx in self.tcp_msgbus_ctxs.items():
-                del msgbus_ctx
-            self.tcp_msgbus_ctxs = {}
+        # Stop all listeners and close their subscribers
+        self.log.debug('Stopping all EII subscribers')
+        tasks = []
+        for topic in self.topics.values():
+            tasks.extend(topic.stop())
+        self.topics = {}
+        self.msgbus_configs = {}
+
+        # Drop the shared message bus contexts so any internal state can be
+        # cleaned up immediately
+        if len(self.msgbus_ctxs) > 0:
+            self.log.debug('Cleaning up msgbus contexts')
+            self.msgbus_ctxs.clear()
+        return tasks
@@ -0,0 +1,245 @@
+# Copyright (c) 2020 Intel Corporation.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM,OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+"""Azure Bridge codecs for serializing meta-data sent over the IoT Edge
+Runtime bus.
+
+The codec of a message is given by its :code:`content_type`, so that
+consumers know how to decode it. Messages may also be compressed, which is
+given by their :code:`content_encoding`.
+
+.. note:: The :code:`msgpack` codec uses the :code:`msgpack` package and the
+    :code:`cbor` codec uses the :code:`cbor2` package, which are in the
+    bridge's requirements. They are imported when the codec is first used,
+    and :code:`get_codec()` rejects a codec whose package is missing, e.g.
+    when running outside of the container image.
+"""
+import gzip
+import json
+import zlib
+import struct
+
+# Azure Imports
+from azure.iot.device import Message
+
+# Default codec, which is also the only one edgeHub routes can query
+DEFAULT_CODEC = 'json'
+
+# Compression algorithms, these are also the content encoding of compressed
+# messages
+COMPRESS_GZIP = 'gzip'
+COMPRESS_DEFLATE = 'deflate'
+
+# Default compression settings
+DEFAULT_COMPRESS_LEVEL = 6
+DEFAULT_COMPRESS_MIN_BYTES = 1024
+
+
+class JsonCodec:
+    """JSON codec, the serialized objects are ASCII strings.
+    """
+    name = 'json'
+    content_type = 'application/json'
+    content_encoding = 'utf-8'
+    batch_format = 'json-array'
+
+    def encode(self, obj):
+        """Serialize an object.
+
+        :param obj: Object to serialize
+        :rtype: str
+        """
+        return json.dumps(obj)
+
+    def encode_batch(self, items):
+        """Join serialized objects into an array.
+
+        :param list items: Objects serialized by :code:`encode()`
+        :rtype: str
+        """
+        return '[' + ','.join(items) + ']'
+
+
+class MsgpackCodec:
+    """MessagePack codec.
+    """
+    name = 'msgpack'
+    content_type = 'application/x-msgpack'
+    # No content encoding applies to a binary body
+    content_encoding = None
+    batch_format = 'msgpack-array'
+
+    def __init__(self):
+        import msgpack
+        self._packer = msgpack.Packer()
+
+    def encode(self, obj):
+        """Serialize an object.
+
+        :param obj: Object to serialize
+        :rtype: bytes
+        """
+        return self._packer.pack(obj)
+
+    def encode_batch(self, items):
+        """Join serialized objects into an array.
+
+        :param list items: Objects serialized by :code:`encode()`
+        :rtype: bytes
+        """
+        return self._packer.pack_array_header(len(items)) + b''.join(items)
+
+
+class CborCodec:
+    """CBOR codec.
+    """
+    name = 'cbor'
+    content_type = 'application/cbor'
+    # No content encoding applies to a binary body
+    content_encoding = None
+    batch_format = 'cbor-array'
+
+    def __init__(self):
+        import cbor2
+        self._dumps = cbor2.dumps
+
+    def encode(self, obj):
+        """Serialize an object.
+
+        :param obj: Object to serialize
+        :rtype: bytes
+        """
+        return self._dumps(obj)
+
+    def encode_batch(self, items):
+        """Join serialized objects into an array.
+
+        :param list items: Objects serialized by :code:`encode()`
+        :rtype: bytes
+        """
+        # Header of a definite length array, i.e. major type 4
+        n = len(items)
+        if n < 24:
+            header = struct.pack('>B', 0x80 | n)
+        elif n < 0x100:
+            header = struct.pack('>BB', 0x98, n)
+        elif n < 0x10000:
+            header = struct.pack('>BH', 0x99, n)
+        else:
+            header = struct.pack('>BI', 0x9a, n)
+        return header + b''.join(items)
+
+
+CODECS = {
+    JsonCodec.name: JsonCodec,
+    MsgpackCodec.name: MsgpackCodec,
+    CborCodec.name: CborCodec,
+}
+
+
+class Compressor:
+    """Compresses message bodies which are at least a minimum size.
+    """
+    def __init__(self, algorithm, level=DEFAULT_COMPRESS_LEVEL,
+                 min_bytes=DEFAULT_COMPRESS_MIN_BYTES):
+        """Constructor.
+
+        :param str algorithm: :code:`gzip` or :code:`deflate`, where
+            deflate is the zlib format
+        :param int level: Compression level from 1 to 9
+        :param int min_bytes: Bodies smaller than this are not compressed
+        """
+        if algorithm == COMPRESS_GZIP:
+            self._compress = \
+                lambda data: gzip.compress(data, level, mtime=0)
+        elif algorithm == COMPRESS_DEFLATE:
+            self._compress = lambda data: zlib.compress(data, level)
+        else:
+            raise ValueError(f'Unknown compression algorithm: {algorithm}')
+        self.algorithm = algorithm
+        self.level = level
+        self.min_bytes = min_bytes
+
+    @classmethod
+    def from_config(cls, compression_conf):
+        """Create a compressor from a topic's :code:`compression`
+        configuration.
+
+        :param dict compression_conf: Compression configuration from the
+            digital twin
+        :return: Compressor
+        """
+        return cls(compression_conf['algorithm'],
+                   compression_conf.get('level', DEFAULT_COMPRESS_LEVEL),
+                   compression_conf.get('min_bytes',
+                                        DEFAULT_COMPRESS_MIN_BYTES))
+
+    def compress(self, body):
+        """Compress a message body if it is large enough.
+
+        :param body: Serialized body
+        :return: Tuple of the body and the algorithm, which is None if the
+            body was not compressed
+        :rtype: tuple
+        """
+        if len(body) < self.min_bytes:
+            return body, None
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        return self._compress(body), self.algorithm
+
+
+def make_message(codec, body, compressor=None):
+    """Create a message to send over the IoT Edge Runtime bus, with the
+    content type and encoding of the codec.
+
+    If the body is compressed, the content encoding is the compression
+    algorithm instead.
+
+    :param codec: Codec which serialized the body
+    :param body: Serialized body
+    :param Compressor compressor: Optional compressor for the body
+    :rtype: azure.iot.device.Message
+    """
+    content_encoding = codec.content_encoding
+    if compressor is not None:
+        body, algorithm = compressor.compress(body)
+        if algorithm is not None:
+            content_encoding = algorithm
+    msg = Message(body)
+    msg.content_type = codec.content_type
+    if content_encoding is not None:
+        msg.content_encoding = content_encoding
+    return msg
+
+
+def get_codec(name):
+    """Get the codec with the given name.
+
+    :param str name: Codec name
+    :return: Codec
+    :raises ValueError: If the codec is unknown or the package it requires
+        is missing
+    """
+    if name not in CODECS:
+        raise ValueError(f'Unknown codec: {name}')
+    try:
+        return CODECS[name]()
+    except ImportError as ex:
+        raise ValueError(f'Codec {name} is not available: {ex}')
@@ -21,17 +21,124 @@
 """
 import os
 import json
+import asyncio
+import hashlib
 import logging
 import traceback as tb
-from dictdiffer import diff, patch, swap, revert
 from util.util import Util
 
+# Default number of received messages per topic which can be waiting to be
+# forwarded before the bridge stops reading from the EII Message Bus
+DEFAULT_QUEUE_DEPTH = 16
 
-async def config_listener(bs):
-    """Listener for changes in the Azure Bridge Azure IoT Edge runtime
-    module digital twin changes.
+# Default time to wait for more digital twin patches before applying them
+DEFAULT_CONFIG_DEBOUNCE_MS = 500
+
+# Keys required by the configuration schema, a patch with all of them holds
+# the full desired state
+FULL_CONFIG_KEYS = ('topics', 'eii_config')
+
+
+class PatchCoalescer:
+    """Coalesces digital twin desired properties patches which arrive close
+    together into a single patch.
+
+    A patch holding the full desired state (see :code:`is_full_config()`)
+    replaces whatever is waiting, so that keys it no longer has, e.g. a
+    removed topic, are deleted. Partial patches are merged into the waiting
+    one with :code:`merge_patches()`. Either way only the final state is
+    applied. A patch is handed out once no other patch has arrived for the
+    debounce window, and a patch which arrives while a previous one is still
+    being applied replaces whatever is waiting instead of queueing behind it.
+    """
+    def __init__(self, window_ms):
+        """Constructor.
+
+        :param window_ms: Time in milliseconds to wait for more patches
+        """
+        self.window = window_ms / 1000.0
+        self.pending = None
+        self.count = 0
+        self._last = 0
+        self._event = asyncio.Event()
+
+    def add(self, patch):
+        """Add a newly received patch.
+
+        :param dict patch: Desired properties patch
+        """
+        loop = asyncio.get_event_loop()
+        if self.pending is None or is_full_config(patch):
+            self.pending = patch
+        else:
+            self.pending = merge_patches(self.pending, patch)
+        self.count += 1
+        self._last = loop.time()
+        self._event.set()
+
+    async def get(self):
+        """Wait for the next coalesced patch.
+
+        :return: Tuple of (merged patch, number of patches merged into it)
+        :rtype: tuple
+        """
+        loop = asyncio.get_event_loop()
+        while True:
+            await self._event.wait()
+            remaining = self._last + self.window - loop.time()
+            if remaining <= 0:
+                break
+            await asyncio.sleep(remaining)
+
+        patch, count = self.pending, self.count
+        self.pending = None
+        self.count = 0
+        self._event.clear()
+        return patch, count
+
+
+def is_full_config(patch):
+    """Check if a desired properties patch holds the full desired state,
+    rather than only the properties which changed.
+
+    :param dict patch: Desired properties patch
+    :rtype: bool
+    """
+    return all(key in patch for key in FULL_CONFIG_KEYS)
+
+
+def merge_patches(orig, new):
+    """Merge two digital twin desired properties patches, such that applying
+    the result is the same as applying both patches in order.
+
+    .. note:: Keys missing from the new patch are kept, so this must only be
+        used for partial patches, a full configuration replaces the earlier
+        patch instead (see :code:`PatchCoalescer`).
+
+    Nested objects are merged recursively, any other value in the new patch
+    replaces the original. A :code:`None` value marks a deleted property and
+    is kept in the result.
+
+    :param dict orig: Earlier patch
+    :param dict new: Later patch
+    :return: Merged patch
+    :rtype: dict
+    """
+    merged = dict(orig)
+    for key, value in new.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = merge_patches(merged[key], value)
+        else:
+            merged[key] = value
+    return merged
+
+
+async def receive_twin_patches(bs, coalescer):
+    """Receive digital twin desired properties patches and hand them to the
+    given coalescer.
 
     :param eab.bridge_state.BridgeState bs: Bridge state instance
+    :param PatchCoalescer coalescer: Coalescer for the received patches
     """
     log = logging.getLogger(__name__)
 
@@ -41,53 +148,90 @@ async def config_listener(bs):
             data = \
                 await bs.module_client.receive_twin_desired_properties_patch()
             log.debug(f'Updated Twin: {json.dumps(data, indent=4)}')
-
-            log.info('Received updated configuration, applying now...')
-            bs.configure(data)
-        except AssertionError as ex:
-            log.error(f'Invalid twin: {ex}')
+            coalescer.add(data)
+        except asyncio.CancelledError:
+            raise
         except Exception as ex:
             log.error(f'Unexpected error: {ex},\n{tb.format_exc()}')
 
 
+async def config_listener(bs, debounce_ms=DEFAULT_CONFIG_DEBOUNCE_MS):
+    """Listener for changes in the Azure Bridge Azure IoT Edge runtime
+    module digital twin changes.
+
+    Patches which arrive within the debounce window of each other, or while
+    a previous patch is being applied, are merged and applied once.
+
+    :param eab.bridge_state.BridgeState bs: Bridge state instance
+    :param debounce_ms: Time in milliseconds to wait for more patches
+        before applying them
+    """
+    log = logging.getLogger(__name__)
+    coalescer = PatchCoalescer(debounce_ms)
+    receiver = asyncio.ensure_future(receive_twin_patches(bs, coalescer))
+
+    try:
+        while True:
+            data, count = await coalescer.get()
+            try:
+                log.info(f'Received updated configuration ({count} '
+                         'patch(es)), applying now...')
+                await bs.configure(data)
+            except AssertionError as ex:
+                log.error(f'Invalid twin: {ex}')
+            except Exception as ex:
+                log.error(f'Unexpected error: {ex},\n{tb.format_exc()}')
+    finally:
+        receiver.cancel()
+
+
 def find_root_changes(orig, new):
     """Discover all of the root keys which have underlying changes.
 
+    Each root key's value is compared by the hash of its canonical JSON
+    serialization, so the cost is linear in the size of the configurations.
+
     :param dict orig: Original version of the dictionary
     :param dict new: New version of the dictionary
     :return: 2-tuple of two lists with (changed root keys, removed root keys)
     :rtype: tuple
     """
-    # Take changes between the two dictionaries
-    changes = diff(orig, new)
-    changed_keys = []
-    removed_keys = []
-
-    # Find unique list of root keys which have underlying changes
-    for change_type, key_info, mod in changes:
-        if change_type == 'change' or change_type == 'add':
-            if isinstance(key_info, (list, tuple,)):
-                key = key_info[0]
-            else:
-                key = key_info
-            if key == '':
-                continue
-            base_key = key.split('.')[0]
-            if base_key not in changed_keys:
-                changed_keys.append(base_key)
-        else:
-            if key_info != '':
-                if isinstance(key_info, (list, tuple,)):
-                    key = key_info[0]
-                else:
-                    key = key_info
-                if key not in changed_keys:
-                    changed_keys.append(key)
-            else:
-                for key, value in mod:
-                    if key in orig and key not in removed_keys:
-                        removed_keys.append(key)
+    return find_hash_changes(config_hashes(orig), config_hashes(new))
 
+
+def config_hash(value):
+    """Hash the canonical JSON serialization of a configuration value.
+
+    :param value: JSON serializable configuration value
+    :return: Hex digest of the value
+    :rtype: str
+    """
+    canonical = json.dumps(value, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+def config_hashes(config):
+    """Hash each root key of a configuration dictionary.
+
+    :param dict config: Configuration dictionary
+    :return: Dictionary of root key->hash of its value
+    :rtype: dict
+    """
+    return {key: config_hash(value) for key, value in config.items()}
+
+
+def find_hash_changes(orig_hashes, new_hashes):
+    """Discover the root keys which changed between two configurations using
+    the hashes of their values (see :code:`config_hashes()`).
+
+    :param dict orig_hashes: Root key->hash of the original configuration
+    :param dict new_hashes: Root key->hash of the new configuration
+    :return: 2-tuple of two lists with (changed root keys, removed root keys)
+    :rtype: tuple
+    """
+    changed_keys = [key for key, h in new_hashes.items()
+                    if orig_hashes.get(key) != h]
+    removed_keys = [key for key in orig_hashes if key not in new_hashes]
     return (changed_keys, removed_keys,)
 
 
@@ -0,0 +1,207 @@
+# Copyright (c) 2020 Intel Corporation.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM,OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+"""Azure Bridge encoding of raw frames before they are uploaded.
+
+Frames are encoded in a pool of worker processes, so that encoding does not
+hold the GIL of the process running the asyncio loop.
+
+.. note:: Encoding into JPEG or PNG uses the :code:`cv2` and :code:`numpy`
+    packages, zstd compression uses the :code:`zstandard` package. These are
+    in the bridge's requirements, but are only imported by the worker
+    processes when a frame is encoded. :code:`check_encoding()` rejects an
+    encoding whose packages are missing, e.g. when running outside of the
+    container image or in an image built without them.
+"""
+import asyncio
+import logging
+import importlib
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
+
+# Supported encodings, these become the frame's encoding_type and extension
+ENCODE_JPEG = 'jpeg'
+ENCODE_PNG = 'png'
+ENCODE_ZSTD = 'zstd'
+
+# Default level of each encoding, i.e. the JPEG quality, PNG compression
+# level and zstd compression level
+DEFAULT_ENCODE_LEVELS = {
+    ENCODE_JPEG: 95,
+    ENCODE_PNG: 3,
+    ENCODE_ZSTD: 3,
+}
+
+# Range of the level of each encoding
+ENCODE_LEVEL_RANGES = {
+    ENCODE_JPEG: (0, 100),
+    ENCODE_PNG: (0, 9),
+    ENCODE_ZSTD: (1, 22),
+}
+
+# Modules required by each encoding
+ENCODE_MODULES = {
+    ENCODE_JPEG: ('cv2', 'numpy'),
+    ENCODE_PNG: ('cv2', 'numpy'),
+    ENCODE_ZSTD: ('zstandard',),
+}
+
+
+def check_encoding(encoding, level=None):
+    """Check that the given encoding and level are supported and that the
+    packages the encoding requires are installed.
+
+    :param str encoding: Encoding
+    :param int level: Level of the encoding, None for its default
+    :raises ValueError: If the encoding or level is not supported or the
+        packages the encoding requires are missing
+    """
+    if encoding not in ENCODE_MODULES:
+        raise ValueError(f'Unknown frame encoding: {encoding}')
+    if level is not None:
+        low, high = ENCODE_LEVEL_RANGES[encoding]
+        if not low <= level <= high:
+            raise ValueError(f'{encoding} level must be in [{low}, {high}]')
+    for name in ENCODE_MODULES[encoding]:
+        try:
+            importlib.import_module(name)
+        except ImportError:
+            raise ValueError(
+                f'Frame encoding {encoding} requires the {name} package')
+
+
+def encode_frame(blob, width, height, channels, encoding, level):
+    """Encode a raw frame.
+
+    .. warning:: This function is CPU bound, it is run in the encode pool's
+        worker processes.
+
+    :param bytes blob: Raw frame
+    :param int width: Width of the frame in pixels
+    :param int height: Height of the frame in pixels
+    :param int channels: Number of channels of the frame
+    :param str encoding: Encoding
+    :param int level: Level of the encoding
+    :return: Encoded frame
+    :rtype: bytes
+    """
+    if encoding == ENCODE_ZSTD:
+        import zstandard
+        return zstandard.ZstdCompressor(level=level).compress(blob)
+
+    import cv2
+    import numpy as np
+
+    frame = np.frombuffer(blob, dtype=np.uint8)
+    if channels == 1:
+        frame = frame.reshape((height, width))
+    else:
+        frame = frame.reshape((height, width, channels))
+
+    if encoding == ENCODE_JPEG:
+        params = [cv2.IMWRITE_JPEG_QUALITY, level]
+    else:
+        params = [cv2.IMWRITE_PNG_COMPRESSION, level]
+
+    ok, encoded = cv2.imencode(f'.{encoding}', frame, params)
+    if not ok:
+        raise RuntimeError(f'Failed to encode frame as {encoding}')
+    return encoded.tobytes()
+
+
+class FrameEncoder:
+    """Pool of worker processes for encoding raw frames.
+
+    The worker processes are only started once the first frame is encoded.
+    """
+    def __init__(self, max_workers):
+        """Constructor.
+
+        :param int max_workers: Number of encoding worker processes
+        """
+        if max_workers < 1:
+            raise ValueError('Encode pool must have at least one worker')
+        self.log = logging.getLogger(__name__)
+        self.max_workers = max_workers
+        # Workers are not forked, since the bridge runs other threads
+        self.executor = ProcessPoolExecutor(
+            max_workers=max_workers, mp_context=mp.get_context('spawn'))
+
+    async def encode(self, meta_data, blob, encoding, level=None):
+        """Encode a raw frame, updating its meta-data to match.
+
+        Frames which are already encoded, i.e. whose meta-data has an
+        :code:`encoding_type`, are returned as they are.
+
+        :param dict meta_data: EII meta-data for the frame
+        :param bytes blob: Frame
+        :param str encoding: Encoding
+        :param int level: Level of the encoding, None for its default
+        :return: Frame to upload
+        :rtype: bytes
+        """
+        if 'encoding_type' in meta_data:
+            return blob
+        if level is None:
+            level = DEFAULT_ENCODE_LEVELS[encoding]
+
+        loop = asyncio.get_event_loop()
+        encoded = await loop.run_in_executor(
+            self.executor, encode_frame, blob, meta_data.get('width'),
+            meta_data.get('height'), meta_data.get('channels', 3), encoding,
+            level)
+
+        meta_data['encoding_type'] = encoding
+        meta_data['encoding_level'] = level
+        return encoded
+
+    async def encode_all(self, frames, encoding, level=None):
+        """Encode the raw frames of a list of messages concurrently.
+
+        A frame which fails to encode is uploaded raw.
+
+        :param list frames: List of (meta-data, blob) tuples
+        :param str encoding: Encoding
+        :param int level: Level of the encoding, None for its default
+        :return: List of (meta-data, blob) tuples with the encoded frames
+        :rtype: list
+        """
+        async def encode(meta_data, blob):
+            if meta_data is None or blob is None:
+                return blob
+            try:
+                return await self.encode(meta_data, blob, encoding, level)
+            except asyncio.CancelledError:
+                raise
+            except Exception as ex:
+                self.log.error(
+                    f'Failed to encode {meta_data.get("img_handle")}: {ex}')
+                return blob
+
+        blobs = await asyncio.gather(
+            *(encode(meta_data, blob) for meta_data, blob in frames))
+        return [(meta_data, blob)
+                for (meta_data, _), blob in zip(frames, blobs)]
+
+    def shutdown(self, wait=True):
+        """Stop the encoding worker processes.
+
+        :param bool wait: Wait for pending frames to finish encoding
+        """
+        self.executor.shutdown(wait=wait)
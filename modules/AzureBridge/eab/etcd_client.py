@@ -0,0 +1,293 @@
+# Copyright (c) 2020 Intel Corporation.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM,OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+"""Azure Bridge persistent ETCD client.
+"""
+import os
+import json
+import logging
+import threading
+import etcd3
+from etcd3.events import PutEvent, DeleteEvent
+from eab.config import config_hash
+from util.util import Util
+
+# Default limits for a single ETCD transaction, these stay under the ETCD
+# server defaults of 128 operations (--max-txn-ops) and 1.5 MiB per request
+# (--max-request-bytes)
+DEFAULT_MAX_TXN_OPS = 128
+DEFAULT_MAX_TXN_BYTES = 1024 * 1024
+
+
+class EtcdClient:
+    """ETCD client which is kept connected across configurations of the
+    bridge.
+
+    The underlying connection is created on first use and checked before
+    every configuration, if the check fails the client reconnects.
+
+    The client only reads the keys under the EII configuration prefix
+    (:code:`ETCD_PREFIX`). It keeps a cache of the hash of each key's value,
+    which is read once and then kept up to date with the bridge's own writes
+    and an ETCD watch on the prefix, so that later configurations do not need
+    to fetch and parse the configuration again.
+    """
+    def __init__(self, dev_mode, max_txn_ops=DEFAULT_MAX_TXN_OPS,
+                 max_txn_bytes=DEFAULT_MAX_TXN_BYTES):
+        """Constructor.
+
+        :param bool dev_mode: Flag for whether or not execution is in dev
+            mode, if not then TLS is used
+        :param int max_txn_ops: Maximum number of operations per transaction
+        :param int max_txn_bytes: Maximum size of the keys and values in a
+            transaction
+        """
+        self.log = logging.getLogger(__name__)
+        self.dev_mode = dev_mode
+        self.max_txn_ops = max_txn_ops
+        self.max_txn_bytes = max_txn_bytes
+        self._client = None
+
+        # NOTE: THIS IS A HACK, AND NEEDS TO BE FIXED IN THE FUTURE
+        self.hostname = 'localhost'
+
+        # This change will be moved to an argument to the function in 2.3
+        # This is done now for backward compatibility
+        etcd_host = os.getenv('ETCD_HOST')
+        if etcd_host is not None and etcd_host != '':
+            self.hostname = etcd_host
+
+        self.port = os.getenv('ETCD_CLIENT_PORT', '2379')
+
+        # Keys in the EII configuration are relative to this prefix
+        self.prefix = os.getenv('ETCD_PREFIX', '')
+        self._range = (self.prefix + '/').encode('utf-8')
+
+        # Hash cache state, guarded by the lock since the watch callback is
+        # called from the ETCD client's watch thread
+        self._lock = threading.Lock()
+        self._hashes = None
+        self._dirty = None
+        self._watch_id = None
+
+    def _connect(self):
+        """Helper function to create the underlying ETCD client.
+        """
+        if not Util.check_port_availability(self.hostname, self.port):
+            raise RuntimeError(f'etcd service port: {self.port} is not up!')
+
+        self.log.info(f'Connecting to ETCD at {self.hostname}:{self.port}')
+        try:
+            if self.dev_mode:
+                return etcd3.client(host=self.hostname, port=self.port)
+            else:
+                return etcd3.client(
+                    host=self.hostname, port=self.port,
+                    ca_cert='/run/secrets/rootca/cacert.pem',
+                    cert_key='/run/secrets/root/root_client_key.pem',
+                    cert_cert='/run/secrets/root/root_client_certificate.pem')
+        except Exception as e:
+            self.log.exception(f'Exception raised when creating etcd'
+                               f'client instance with error: {e}')
+            raise e
+
+    def get_client(self):
+        """Get a connected ETCD client, reconnecting if the existing
+        connection is no longer healthy.
+
+        .. warning:: This function blocks, it must not be called from the
+            asyncio loop.
+
+        :return: ETCD client
+        :rtype: etcd3.Etcd3Client
+        """
+        if self._client is not None:
+            try:
+                self._client.status()
+                return self._client
+            except Exception as e:
+                self.log.warning(f'ETCD connection unhealthy ({e}), '
+                                 'reconnecting')
+                self.close()
+
+        self._client = self._connect()
+        return self._client
+
+    def _invalidate(self):
+        """Helper function to drop the hash cache, forcing it to be read from
+        ETCD again on the next configuration.
+        """
+        with self._lock:
+            self._hashes = None
+            self._dirty = None
+
+    def _on_watch(self, resp):
+        """ETCD watch callback keeping the hash cache up to date with changes
+        made by other writers.
+
+        :param resp: Watch response, or an exception if the watch failed
+        """
+        if isinstance(resp, Exception):
+            self.log.warning(f'ETCD watch failed ({resp}), dropping cache')
+            self._watch_id = None
+            self._invalidate()
+            return
+
+        with self._lock:
+            for event in resp.events:
+                if not event.key.startswith(self._range):
+                    continue
+                key = event.key.decode('utf-8')[len(self.prefix):]
+                if self._dirty is not None:
+                    # The cache is still being read
+                    self._dirty.add(key)
+                if self._hashes is None:
+                    continue
+                if isinstance(event, DeleteEvent):
+                    self._hashes.pop(key, None)
+                elif isinstance(event, PutEvent):
+                    try:
+                        value = json.loads(event.value.decode('utf-8'))
+                        self._hashes[key] = config_hash(value)
+                    except Exception:
+                        self._hashes.pop(key, None)
+
+    def get_config_hashes(self):
+        """Get the hash of the value of each key in the EII configuration.
+
+        .. warning:: This function blocks, it must not be called from the
+            asyncio loop.
+
+        :return: Dictionary of key->hash of its value
+        :rtype: dict
+        """
+        client = self.get_client()
+
+        with self._lock:
+            if self._hashes is not None:
+                return dict(self._hashes)
+            self._dirty = set()
+
+        if self._watch_id is None:
+            # Start watching before reading, so no change is missed
+            self._watch_id = client.add_watch_callback(
+                    self._range, self._on_watch,
+                    range_end=etcd3.utils.increment_last_byte(self._range))
+
+        self.log.debug(f'Reading EII configuration under "{self.prefix}/"')
+        hashes = {}
+        for value, meta in client.get_prefix(self._range):
+            try:
+                key = meta.key.decode('utf-8')[len(self.prefix):]
+                hashes[key] = config_hash(json.loads(value.decode('utf-8')))
+            except Exception as e:
+                # NOTE: Errors may happen if security is enabled, because the
+                # first part is the request's key
+                self.log.error(f'{e}')
+
+        with self._lock:
+            # Keys changed while reading may be stale, so they are left out
+            # of the cache and will be written again if needed
+            for key in self._dirty:
+                hashes.pop(key, None)
+            self._dirty = None
+            self._hashes = hashes
+            return dict(hashes)
+
+    def apply(self, puts, deletes):
+        """Write and delete the given EII configuration keys using as few
+        transactions as possible.
+
+        The operations are split into transactions which stay under the
+        configured operation count and size limits. Each transaction is
+        applied atomically; if the changes fit into a single transaction,
+        then the whole update is atomic.
+
+        .. warning:: This function blocks, it must not be called from the
+            asyncio loop.
+
+        :param dict puts: Key->configuration value to write
+        :param list deletes: Keys to delete
+        :return: Number of transactions used
+        :rtype: int
+        """
+        client = self.get_client()
+        ops = []
+        size = 0
+        num_txns = 0
+
+        def commit():
+            self.log.debug(f'Committing ETCD transaction of {len(ops)} ops')
+            client.transaction(compare=[], success=ops, failure=[])
+
+        requests = []
+        for key, value in puts.items():
+            key = self.prefix + key
+            value = json.dumps(value, indent=4)
+            requests.append(
+                (client.transactions.put(key, value), len(key) + len(value)))
+        for key in deletes:
+            key = self.prefix + key
+            requests.append((client.transactions.delete(key), len(key)))
+
+        try:
+            for op, op_size in requests:
+                if ops and (len(ops) >= self.max_txn_ops or
+                            size + op_size > self.max_txn_bytes):
+                    commit()
+                    num_txns += 1
+                    ops = []
+                    size = 0
+                ops.append(op)
+                size += op_size
+
+            if ops:
+                commit()
+                num_txns += 1
+        except Exception:
+            # Some of the transactions may have been applied
+            self._invalidate()
+            raise
+
+        with self._lock:
+            if self._hashes is not None:
+                for key, value in puts.items():
+                    self._hashes[key] = config_hash(value)
+                for key in deletes:
+                    self._hashes.pop(key, None)
+
+        return num_txns
+
+    def close(self):
+        """Close the underlying ETCD connection.
+        """
+        if self._client is not None:
+            # The cache is no longer kept up to date without the watch
+            if self._watch_id is not None:
+                try:
+                    self._client.cancel_watch(self._watch_id)
+                except Exception as e:
+                    self.log.debug(f'Error cancelling ETCD watch: {e}')
+                self._watch_id = None
+            self._invalidate()
+            try:
+                self._client.close()
+            except Exception as e:
+                self.log.debug(f'Error closing ETCD client: {e}')
+            self._client = None
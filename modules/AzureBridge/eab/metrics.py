@@ -0,0 +1,449 @@
+# Copyright (c) 2020 Intel Corporation.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM,OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+"""Azure Bridge metrics served in the Prometheus text exposition format.
+
+Metrics are only recorded when the metrics endpoint is enabled. Otherwise
+the bridge and its topics have no metrics object at all, like the other
+optional parts of a topic, so the listeners skip recording them.
+"""
+import time
+import asyncio
+import bisect
+import logging
+
+# Content type of the Prometheus text exposition format
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Histogram buckets in seconds, from 1 ms to 10 s
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0)
+
+DEFAULT_METRICS_HOST = '127.0.0.1'
+
+
+def _escape(value):
+    """Escape a label value.
+    """
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n') \
+        .replace('"', '\\"')
+
+
+def _labels(names, values, extra=''):
+    """Format the labels of a sample.
+    """
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _value(value):
+    """Format a sample value.
+    """
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+class _Family:
+    """Metric with a value per combination of its label values.
+    """
+    TYPE = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        """Constructor.
+
+        :param str name: Metric name
+        :param str documentation: Help text of the metric
+        :param tuple labelnames: Names of the metric's labels
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+
+    def labels(self, *values):
+        """Get the child of the metric for the given label values, which
+        should be kept by callers recording it often.
+        """
+        values = tuple(str(v) for v in values)
+        if len(values) != len(self.labelnames):
+            raise ValueError(f'{self.name} takes labels {self.labelnames}')
+        child = self._children.get(values)
+        if child is None:
+            child = self._new_child()
+            self._children[values] = child
+        return child
+
+    def remove(self, *values):
+        """Remove the child of the metric for the given label values.
+        """
+        self._children.pop(tuple(str(v) for v in values), None)
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def render(self):
+        """Render the metric in the text exposition format.
+
+        :rtype: list
+        """
+        lines = [f'# HELP {self.name} {self.documentation}',
+                 f'# TYPE {self.name} {self.TYPE}']
+        for values, child in sorted(self._children.items()):
+            lines.extend(self._render_child(values, child))
+        return lines
+
+    def _render_child(self, values, child):
+        return [f'{self.name}{_labels(self.labelnames, values)} '
+                f'{_value(child.value)}']
+
+
+class _Value:
+    """Value of a counter or gauge child.
+    """
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        """Increase the value.
+        """
+        self.value += amount
+
+    def dec(self, amount=1):
+        """Decrease the value.
+        """
+        self.value -= amount
+
+    def set(self, value):
+        """Set the value.
+        """
+        self.value = value
+
+
+class Counter(_Family):
+    """Metric whose values only go up.
+    """
+    TYPE = 'counter'
+
+    def _new_child(self):
+        return _Value()
+
+
+class Gauge(_Family):
+    """Metric whose values can go up and down.
+    """
+    TYPE = 'gauge'
+
+    def _new_child(self):
+        return _Value()
+
+
+class _Buckets:
+    """Observations of a histogram child.
+    """
+    __slots__ = ('bounds', 'counts', 'count', 'sum')
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        # The last count is of the +Inf bucket
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        """Record an observation.
+        """
+        self.count += 1
+        self.sum += value
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+
+
+class Histogram(_Family):
+    """Metric counting observations into buckets.
+    """
+    TYPE = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(),
+                 buckets=DEFAULT_BUCKETS):
+        """Constructor.
+
+        :param str name: Metric name
+        :param str documentation: Help text of the metric
+        :param tuple labelnames: Names of the metric's labels
+        :param tuple buckets: Upper bounds of the buckets
+        """
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _Buckets(self.buckets)
+
+    def _render_child(self, values, child):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),),
+                                child.counts):
+            cumulative += count
+            le = 'le="{}"'.format(_value(float(bound)))
+            lines.append(f'{self.name}_bucket'
+                         f'{_labels(self.labelnames, values, le)} '
+                         f'{cumulative}')
+        labels = _labels(self.labelnames, values)
+        lines.append(f'{self.name}_sum{labels} {_value(child.sum)}')
+        lines.append(f'{self.name}_count{labels} {child.count}')
+        return lines
+
+
+class TopicMetrics:
+    """Metrics of a single topic, bound to its label so that recording them
+    is cheap.
+    """
+    def __init__(self, metrics, topic):
+        """Constructor.
+
+        :param BridgeMetrics metrics: Metrics of the bridge
+        :param str topic: EII Message Bus topic
+        """
+        self.topic = topic
+        self.errors = metrics.errors
+        self.error_count = 0
+        # Dictionary of the kind, message and time of the last error
+        self.last_error = None
+        self.received = metrics.received.labels(topic)
+        self.forwarded = metrics.forwarded.labels(topic)
+        self.filtered = metrics.dropped.labels(topic, 'filter')
+        self.sampled = metrics.dropped.labels(topic, 'sample')
+        self.uploaded = metrics.uploads.labels(topic)
+        self.uploaded_bytes = metrics.uploaded_bytes.labels(topic)
+        self.forward_latency = metrics.forward_latency.labels(topic)
+        self.upload_latency = metrics.upload_latency.labels(topic)
+
+    def record_error(self, kind, ex):
+        """Record a failure.
+
+        :param str kind: Kind of failure, e.g. upload or send
+        :param Exception ex: Exception of the failure
+        """
+        self.errors.labels(self.topic, kind).inc()
+        self.error_count += 1
+        self.last_error = {'kind': kind, 'message': str(ex)[:200],
+                           'time': time.time()}
+
+    def upload_done(self, nbytes, start, fut):
+        """Record a finished upload, as a done callback of its future.
+
+        :param int nbytes: Size of the uploaded blob
+        :param float start: Monotonic time the upload was submitted
+        :param asyncio.Future fut: Future for the upload, whose result is
+            False if the blob was stored in the spool instead
+        """
+        if fut.cancelled():
+            return
+        ex = fut.exception()
+        if ex is not None:
+            self.record_error('upload', ex)
+            return
+        if not fut.result():
+            return
+        self.uploaded.inc()
+        self.uploaded_bytes.inc(nbytes)
+        self.upload_latency.observe(time.monotonic() - start)
+
+
+class BridgeMetrics:
+    """Metrics of the Azure Bridge and its topics.
+
+    Gauges of the bridge's state, e.g. the queue depth of each topic, are
+    read from the bridge when the metrics are rendered.
+    """
+    def __init__(self, bs=None):
+        """Constructor.
+
+        :param eab.bridge_state.BridgeState bs: Bridge state whose gauges
+            are read when rendering the metrics
+        """
+        self.bs = bs
+        self.received = Counter(
+            'eab_messages_received_total',
+            'Messages received from the EII Message Bus', ('topic',))
+        self.forwarded = Counter(
+            'eab_messages_forwarded_total',
+            'Messages forwarded over the Azure IoT Edge Runtime', ('topic',))
+        self.dropped = Counter(
+            'eab_messages_dropped_total',
+            'Messages dropped by the meta-data filter or the sampling',
+            ('topic', 'reason'))
+        self.uploads = Counter(
+            'eab_blob_uploads_total',
+            'Blobs uploaded into Azure Blob Storage', ('topic',))
+        self.uploaded_bytes = Counter(
+            'eab_blob_uploaded_bytes_total',
+            'Bytes uploaded into Azure Blob Storage', ('topic',))
+        self.errors = Counter(
+            'eab_errors_total', 'Failures of uploads, sends and listeners',
+            ('topic', 'kind'))
+        self.forward_latency = Histogram(
+            'eab_forward_latency_seconds',
+            'Time from receiving a message until it is sent or batched',
+            ('topic',))
+        self.upload_latency = Histogram(
+            'eab_upload_latency_seconds',
+            'Time from submitting a blob upload until it completes',
+            ('topic',))
+        self.configure_duration = Histogram(
+            'eab_configure_duration_seconds',
+            'Time taken to apply a digital twin configuration')
+        self.queue_depth = Gauge(
+            'eab_queue_depth',
+            'Received messages waiting to be forwarded', ('topic',))
+        self.inflight_uploads = Gauge(
+            'eab_inflight_uploads', 'Blob uploads in flight')
+        self.inflight_bytes = Gauge(
+            'eab_inflight_upload_bytes', 'Bytes of the blob uploads in flight')
+        self.startup = Gauge(
+            'eab_startup_phase_seconds',
+            'Time taken by each phase of the bridge startup', ('phase',))
+        self._topics = {}
+
+    def topic(self, name):
+        """Get the metrics of a topic.
+
+        :param str name: EII Message Bus topic
+        :rtype: TopicMetrics
+        """
+        metrics = self._topics.get(name)
+        if metrics is None:
+            metrics = TopicMetrics(self, name)
+            self._topics[name] = metrics
+        return metrics
+
+    def remove_topic(self, name):
+        """Stop exporting the metrics of a topic which was removed.
+
+        :param str name: EII Message Bus topic
+        """
+        self._topics.pop(name, None)
+        for family in (self.received, self.forwarded, self.uploads,
+                       self.uploaded_bytes, self.forward_latency,
+                       self.upload_latency):
+            family.remove(name)
+        for reason in ('filter', 'sample'):
+            self.dropped.remove(name, reason)
+        for values in list(self.errors._children):
+            if values[0] == name:
+                self.errors.remove(*values)
+
+    def _collect(self):
+        """Read the gauges of the bridge's state.
+        """
+        bs = self.bs
+        if bs is None:
+            return
+        self.queue_depth._children.clear()
+        for name, topic in bs.topics.items():
+            self.queue_depth.labels(name).set(topic.reader.queue.qsize())
+        if bs.upload_pool is not None:
+            self.inflight_uploads.labels().set(bs.upload_pool.inflight_jobs)
+            self.inflight_bytes.labels().set(bs.upload_pool.inflight_bytes)
+        for phase, elapsed in bs.startup_timings.items():
+            self.startup.labels(phase).set(elapsed)
+
+    def render(self):
+        """Render all metrics in the text exposition format.
+
+        :rtype: str
+        """
+        self._collect()
+        lines = []
+        for family in (self.received, self.forwarded, self.dropped,
+                       self.uploads, self.uploaded_bytes, self.errors,
+                       self.forward_latency, self.upload_latency,
+                       self.configure_duration, self.queue_depth,
+                       self.inflight_uploads, self.inflight_bytes,
+                       self.startup):
+            lines.extend(family.render())
+        return '\n'.join(lines) + '\n'
+
+
+class MetricsServer:
+    """Minimal HTTP server on the asyncio loop serving the metrics on
+    :code:`GET /metrics`.
+    """
+    def __init__(self, metrics, port, host=DEFAULT_METRICS_HOST):
+        """Constructor.
+
+        :param BridgeMetrics metrics: Metrics to serve
+        :param int port: Port to listen on
+        :param str host: Address to listen on
+        """
+        self.log = logging.getLogger(__name__)
+        self.metrics = metrics
+        self.port = port
+        self.host = host
+        self._server = None
+
+    async def start(self):
+        """Start listening for scrapes.
+        """
+        self._server = await asyncio.start_server(
+            self._handle, self.host, self.port)
+        self.log.info(f'Serving metrics on {self.host}:{self.port}/metrics')
+
+    async def _handle(self, reader, writer):
+        """Answer a single HTTP request and close the connection.
+        """
+        try:
+            request = await reader.readline()
+            # Skip the request headers
+            while (await reader.readline()).strip():
+                pass
+
+            parts = request.decode('latin-1').split()
+            if len(parts) < 2 or parts[0] not in ('GET', 'HEAD'):
+                status, body = '405 Method Not Allowed', b''
+            elif parts[1].split('?')[0] != '/metrics':
+                status, body = '404 Not Found', b''
+            else:
+                status = '200 OK'
+                body = self.metrics.render().encode('utf-8')
+
+            writer.write(
+                f'HTTP/1.0 {status}\r\nContent-Type: {CONTENT_TYPE}\r\n'
+                f'Content-Length: {len(body)}\r\n'
+                'Connection: close\r\n\r\n'.encode('latin-1'))
+            if parts and parts[0] != 'HEAD':
+                writer.write(body)
+            await writer.drain()
+        except Exception as ex:
+            self.log.debug(f'Failed to serve metrics: {ex}')
+        finally:
+            writer.close()
+
+    def close(self):
+        """Stop listening for scrapes.
+        """
+        if self._server is not None:
+            self._server.close()
+            self._server = None
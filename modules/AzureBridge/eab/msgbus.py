@@ -0,0 +1,166 @@
+# Copyright (c) 2020 Intel Corporation.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM,OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+"""Azure Bridge sharing of EII Message Bus contexts between topics.
+
+The EII configuration manager gives every topic of a subscriber the same
+message bus configuration, so all topics published on one endpoint can
+subscribe through a single context instead of each creating its own, with
+its own sockets and I/O threads.
+"""
+import json
+import threading
+
+
+def msgbus_config_key(msgbus_config):
+    """Get the key identifying the endpoint of a message bus configuration.
+
+    :param dict msgbus_config: Message bus configuration
+    :rtype: str
+    """
+    return json.dumps(msgbus_config, sort_keys=True)
+
+
+class _SharedContext:
+    """Message bus context shared by the topics holding a reference to it.
+    """
+    def __init__(self):
+        self.ctx = None
+        self.refs = 0
+        # Held while the context is created, so that it is created once, and
+        # while subscribers are created from it
+        self.lock = threading.Lock()
+
+
+class MsgbusContextPool:
+    """Reference counted message bus contexts, one per distinct message bus
+    configuration.
+
+    Contexts are created and released from the loop's executor, so the pool
+    is thread-safe. Contexts for different endpoints are created in
+    parallel, while the subscribers of one context are created one at a
+    time.
+    """
+    def __init__(self, factory):
+        """Constructor.
+
+        :param factory: Function creating a message bus context from its
+            configuration, e.g. :code:`eii.msgbus.MsgbusContext`
+        """
+        self.factory = factory
+        self._lock = threading.Lock()
+        self._contexts = {}
+
+    def acquire(self, msgbus_config):
+        """Get the context for a configuration, creating it if no topic
+        holds a reference to it yet.
+
+        .. warning:: This function blocks, it must not be called from the
+            asyncio loop.
+
+        :param dict msgbus_config: Message bus configuration
+        :return: Message bus context
+        """
+        return self._acquire(msgbus_config, None)
+
+    def new_subscriber(self, msgbus_config, topic):
+        """Create a subscriber for a topic on the context for a
+        configuration, which holds a reference to the context until it is
+        released.
+
+        .. warning:: This function blocks, it must not be called from the
+            asyncio loop.
+
+        :param dict msgbus_config: Message bus configuration
+        :param str topic: Topic to subscribe to
+        :return: Subscriber
+        """
+        return self._acquire(msgbus_config, topic)
+
+    def _acquire(self, msgbus_config, topic):
+        """Get a reference to the context for a configuration, and a
+        subscriber for the topic from it if one is given.
+        """
+        key = msgbus_config_key(msgbus_config)
+        with self._lock:
+            shared = self._contexts.get(key)
+            if shared is None:
+                shared = _SharedContext()
+                self._contexts[key] = shared
+            shared.refs += 1
+
+        try:
+            with shared.lock:
+                if shared.ctx is None:
+                    shared.ctx = self.factory(msgbus_config)
+                if topic is None:
+                    return shared.ctx
+                return shared.ctx.new_subscriber(topic)
+        except Exception:
+            self.release(msgbus_config)
+            raise
+
+    def release(self, msgbus_config):
+        """Release a reference to the context of a configuration, the
+        context is dropped once no topic holds a reference to it.
+
+        The subscribers created from the context must be closed first.
+
+        :param dict msgbus_config: Message bus configuration
+        :return: True if the context was dropped
+        :rtype: bool
+        """
+        key = msgbus_config_key(msgbus_config)
+        with self._lock:
+            shared = self._contexts.get(key)
+            if shared is None:
+                return False
+            shared.refs -= 1
+            if shared.refs > 0:
+                return False
+            del self._contexts[key]
+        # Drop the reference so that any internal state of the context is
+        # cleaned up immediately
+        shared.ctx = None
+        return True
+
+    def refs(self, msgbus_config):
+        """Get the number of references to the context of a configuration.
+
+        :param dict msgbus_config: Message bus configuration
+        :rtype: int
+        """
+        with self._lock:
+            shared = self._contexts.get(msgbus_config_key(msgbus_config))
+            return shared.refs if shared is not None else 0
+
+    def clear(self):
+        """Drop all contexts, whatever their references.
+        """
+        with self._lock:
+            contexts = self._contexts
+            self._contexts = {}
+        for shared in contexts.values():
+            shared.ctx = None
+
+    def __len__(self):
+        """Get the number of contexts in the pool.
+        """
+        with self._lock:
+            return len(self._contexts)
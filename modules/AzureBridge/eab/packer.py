@@ -0,0 +1,168 @@
+# Copyright (c) 2020 Intel Corporation.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM,OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+"""Azure Bridge packing of many frames into a single blob.
+"""
+import json
+import asyncio
+import logging
+
+# Key added to the meta-data of packed frames, holds the pack blob's name and
+# the offset and length of the frame in it
+PACK_META_KEY = 'eab_pack'
+
+# Suffixes of the pack blobs and their index sidecar blobs
+PACK_SUFFIX = '.pack'
+INDEX_SUFFIX = '.idx.json'
+
+# Default packing limits
+DEFAULT_PACK_MAX_FRAMES = 100
+DEFAULT_PACK_MAX_BYTES = 64 * 1024 * 1024
+DEFAULT_PACK_MAX_LINGER_MS = 5000
+
+
+class FramePacker:
+    """Appends frames into a single pack blob instead of uploading one blob
+    per frame.
+
+    A pack is uploaded once it holds the maximum number of frames, once
+    adding another frame would take it over the maximum size, or once the
+    first frame in it has waited for the maximum linger time. Along with each
+    pack an index sidecar blob is uploaded, which is a JSON object mapping
+    the image handle of each frame to its offset and length in the pack.
+    """
+    def __init__(self, upload, container_name, max_frames, max_bytes,
+                 max_linger_ms):
+        """Constructor.
+
+        :param upload: Coroutine function called with the container name,
+            blob name and data to upload a blob, it must return a future for
+            the upload
+        :param str container_name: Name of the Azure Blob container
+        :param int max_frames: Maximum number of frames in a pack
+        :param int max_bytes: Maximum size of a pack in bytes
+        :param max_linger_ms: Maximum time in milliseconds to wait for a
+            pack to fill up
+        """
+        self.log = logging.getLogger(container_name)
+        self.upload = upload
+        self.container_name = container_name
+        self.max_frames = max_frames
+        self.max_bytes = max_bytes
+        self.max_linger = max_linger_ms / 1000.0
+        self._name = None
+        self._frames = []
+        self._index = {}
+        self._size = 0
+        self._timer = None
+        self._upload_lock = asyncio.Lock()
+
+    @classmethod
+    def from_config(cls, upload, container_name, pack_conf):
+        """Create a packer from a topic's :code:`pack` configuration.
+
+        :param upload: Coroutine function called with the container name,
+            blob name and data to upload a blob
+        :param str container_name: Name of the Azure Blob container
+        :param dict pack_conf: Pack configuration from the digital twin
+        :return: FramePacker
+        """
+        return cls(upload, container_name,
+                   pack_conf.get('max_frames', DEFAULT_PACK_MAX_FRAMES),
+                   pack_conf.get('max_bytes', DEFAULT_PACK_MAX_BYTES),
+                   pack_conf.get('max_linger_ms', DEFAULT_PACK_MAX_LINGER_MS))
+
+    async def add(self, img_handle, blob):
+        """Add a frame to the current pack.
+
+        :param str img_handle: Image handle of the frame
+        :param bytes blob: Frame data
+        :return: Pointer to the frame in its pack, to add to the frame's
+            meta-data under :code:`PACK_META_KEY`
+        :rtype: dict
+        """
+        if self._frames and self._size + len(blob) > self.max_bytes:
+            await self.flush()
+
+        if self._name is None:
+            # Packs are named after their first frame
+            self._name = f'{img_handle}{PACK_SUFFIX}'
+
+        pointer = {
+            'blob': self._name,
+            'offset': self._size,
+            'length': len(blob),
+        }
+        self._frames.append(blob)
+        self._index[img_handle] = [self._size, len(blob)]
+        self._size += len(blob)
+
+        if len(self._frames) >= self.max_frames or \
+                self._size >= self.max_bytes:
+            await self.flush()
+        elif self._timer is None:
+            self._timer = asyncio.ensure_future(self._linger())
+
+        return pointer
+
+    async def _linger(self):
+        """Upload the current pack once it has waited for the linger time.
+        """
+        await asyncio.sleep(self.max_linger)
+        self._timer = None
+        try:
+            await self.flush()
+        except Exception as ex:
+            self.log.error(f'Failed to upload pack: {ex}')
+
+    async def flush(self):
+        """Upload the current pack and its index, if it contains any frames.
+        """
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        if not self._frames:
+            return
+
+        name = self._name
+        count = len(self._frames)
+        data = b''.join(self._frames)
+        index = json.dumps(self._index, separators=(',', ':')).encode()
+        self._name = None
+        self._frames = []
+        self._index = {}
+        self._size = 0
+
+        self.log.debug(f'Uploading pack {name} with {count} frames')
+        async with self._upload_lock:
+            fut = await self.upload(self.container_name, name, data)
+            fut.add_done_callback(self._upload_done)
+            fut = await self.upload(
+                    self.container_name, f'{name}{INDEX_SUFFIX}', index)
+            fut.add_done_callback(self._upload_done)
+
+    def _upload_done(self, fut):
+        """Log the result of a pack or index upload.
+        """
+        if fut.cancelled():
+            return
+        ex = fut.exception()
+        if ex is not None:
+            self.log.error(f'Failed to upload pack: {ex}')
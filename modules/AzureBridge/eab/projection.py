@@ -0,0 +1,254 @@
+# Copyright (c) 2020 Intel Corporation.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM,OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+"""Azure Bridge per-topic projection and filtering of EII meta-data.
+
+A topic's :code:`metadata` configuration is compiled once into functions when
+the configuration is applied, so that the per-message work is only the
+projection and the predicates themselves.
+
+Field paths are dot separated keys into the meta-data, e.g.
+:code:`defects.tl`. A path which runs into a list applies to every element of
+the list.
+"""
+import operator
+
+# Comparison operators supported in filter predicates
+COMPARISONS = {
+    'eq': operator.eq,
+    'ne': operator.ne,
+    'gt': operator.gt,
+    'ge': operator.ge,
+    'lt': operator.lt,
+    'le': operator.le,
+    'in': lambda value, values: value in values,
+}
+
+# Operators which do not take a value
+UNARY_OPS = ('exists', 'non_empty')
+
+# Returned when a field path does not exist in the meta-data
+_MISSING = object()
+
+
+def _path_tree(paths):
+    """Build a tree of nested dicts from a list of field paths, where
+    :code:`None` marks the end of a path.
+    """
+    tree = {}
+    for path in paths:
+        keys = path.split('.')
+        if not all(keys):
+            raise ValueError(f'Invalid field path: {path}')
+        node = tree
+        for key in keys[:-1]:
+            child = node.get(key, {})
+            if child is None:
+                # A shorter path already covers the whole field
+                break
+            node = node.setdefault(key, child)
+        else:
+            node[keys[-1]] = None
+    return tree
+
+
+def _compile_include(tree):
+    """Compile a path tree into a function which keeps only those fields.
+    """
+    fields = [(key, None if sub is None else _compile_include(sub))
+              for key, sub in tree.items()]
+
+    def include(value):
+        if isinstance(value, list):
+            return [include(v) for v in value]
+        if not isinstance(value, dict):
+            return value
+        result = {}
+        for key, sub in fields:
+            if key in value:
+                result[key] = value[key] if sub is None else sub(value[key])
+        return result
+
+    return include
+
+
+def _compile_exclude(tree):
+    """Compile a path tree into a function which removes those fields.
+    """
+    removed = [key for key, sub in tree.items() if sub is None]
+    nested = [(key, _compile_exclude(sub))
+              for key, sub in tree.items() if sub is not None]
+
+    def exclude(value):
+        if isinstance(value, list):
+            return [exclude(v) for v in value]
+        if not isinstance(value, dict):
+            return value
+        result = dict(value)
+        for key in removed:
+            result.pop(key, None)
+        for key, sub in nested:
+            if key in result:
+                result[key] = sub(result[key])
+        return result
+
+    return exclude
+
+
+def _compile_getter(path):
+    """Compile a field path into a function which gets the field's value.
+    """
+    keys = path.split('.')
+    if not all(keys):
+        raise ValueError(f'Invalid field path: {path}')
+
+    def get(meta_data):
+        value = meta_data
+        for key in keys:
+            if not isinstance(value, dict) or key not in value:
+                return _MISSING
+            value = value[key]
+        return value
+
+    return get
+
+
+def compile_values(path):
+    """Compile a field path into a function which gets all values of the
+    field, following the path into every element of the lists it runs into.
+
+    :param str path: Dot separated field path
+    :return: Function taking the meta-data and returning a list of values
+    :raises ValueError: If the path is invalid
+    """
+    keys = path.split('.')
+    if not all(keys):
+        raise ValueError(f'Invalid field path: {path}')
+
+    def values(meta_data):
+        found = [meta_data]
+        for key in keys:
+            found = [v[key] for v in _flatten(found)
+                     if isinstance(v, dict) and key in v]
+        return list(_flatten(found))
+
+    return values
+
+
+def _flatten(values):
+    """Iterate over the values, and the elements of those which are lists.
+    """
+    for value in values:
+        if isinstance(value, list):
+            yield from value
+        else:
+            yield value
+
+
+def _compile_predicate(pred):
+    """Compile a filter predicate into a function returning whether the
+    meta-data matches it.
+    """
+    try:
+        get = _compile_getter(pred['field'])
+        op = pred['op']
+    except KeyError as ex:
+        raise ValueError(f'Filter predicate is missing {ex}')
+
+    if op == 'exists':
+        return lambda meta_data: get(meta_data) is not _MISSING
+
+    if op == 'non_empty':
+        def non_empty(meta_data):
+            value = get(meta_data)
+            if value is _MISSING or value is None:
+                return False
+            if hasattr(value, '__len__'):
+                return len(value) > 0
+            return True
+        return non_empty
+
+    if op not in COMPARISONS:
+        raise ValueError(f'Unknown filter operator: {op}')
+    if 'value' not in pred:
+        raise ValueError(f'Filter operator {op} requires a value')
+    compare = COMPARISONS[op]
+    expected = pred['value']
+
+    def matches(meta_data):
+        value = get(meta_data)
+        if value is _MISSING:
+            return False
+        try:
+            return bool(compare(value, expected))
+        except TypeError:
+            return False
+
+    return matches
+
+
+class MetadataSpec:
+    """Compiled projection and filter of a topic's meta-data.
+
+    :code:`matches()` checks if a message is forwarded at all, which is the
+    case if its meta-data matches every filter predicate.
+    :code:`project()` returns the meta-data to send, with only the included
+    fields and without the excluded fields.
+    """
+    def __init__(self, include=None, exclude=None, filters=None):
+        """Constructor.
+
+        :param list include: Field paths to keep, None to keep all fields
+        :param list exclude: Field paths to remove
+        :param list filters: Filter predicates, each is a dict with a
+            :code:`field` path, an :code:`op` and for comparisons a
+            :code:`value`
+        :raises ValueError: If the spec is invalid
+        """
+        steps = []
+        if include is not None:
+            steps.append(_compile_include(_path_tree(include)))
+        if exclude:
+            steps.append(_compile_exclude(_path_tree(exclude)))
+        predicates = [_compile_predicate(p) for p in filters or []]
+
+        if not steps:
+            self.project = lambda meta_data: meta_data
+        elif len(steps) == 1:
+            self.project = steps[0]
+        else:
+            include_step, exclude_step = steps
+            self.project = \
+                lambda meta_data: exclude_step(include_step(meta_data))
+
+        if not predicates:
+            self.matches = lambda meta_data: True
+        else:
+            self.matches = \
+                lambda meta_data: all(p(meta_data) for p in predicates)
+
+    @classmethod
+    def from_config(cls, spec):
+        """Compile a topic's :code:`metadata` configuration.
+
+        :param dict spec: Meta-data configuration from the digital twin
+        :return: MetadataSpec
+        """
+        return cls(spec.get('include'), spec.get('exclude'),
+                   spec.get('filter'))
@@ -0,0 +1,138 @@
+# Copyright (c) 2020 Intel Corporation.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM,OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+"""Azure Bridge EII Message Bus receive threads.
+"""
+import time
+import asyncio
+import logging
+import threading
+
+
+class SubscriberReader:
+    """Long-lived thread which receives messages from an EII Message Bus
+    subscriber and hands them to the asyncio loop through a bounded queue.
+
+    The number of messages waiting in the queue is limited to the configured
+    queue depth. Once the queue is full the reader thread stops calling
+    :code:`recv()` until the listener has taken messages out of the queue,
+    which leaves any further messages buffered in the EII Message Bus.
+
+    The monotonic time at which each message was received is kept in
+    :code:`recv_times` for the messages last returned by :code:`recv()`.
+    """
+    def __init__(self, subscriber, topic, queue_depth, loop=None):
+        """Constructor.
+
+        .. note:: This must be called from the thread running the asyncio
+            loop which will consume the messages.
+
+        :param subscriber: EII Message Bus subscriber
+        :param str topic: Topic the subscriber is subscribed to
+        :param int queue_depth: Maximum number of received messages which
+            can be waiting to be forwarded
+        :param loop: asyncio loop consuming the messages
+        """
+        if queue_depth < 1:
+            raise ValueError('Queue depth must be positive')
+
+        self.log = logging.getLogger(__name__)
+        self.subscriber = subscriber
+        self.topic = topic
+        self.queue_depth = queue_depth
+        self.loop = loop if loop is not None else asyncio.get_event_loop()
+        self.queue = asyncio.Queue(maxsize=queue_depth)
+        self.recv_times = []
+        self._slots = threading.Semaphore(queue_depth)
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name=f'eab-recv-{topic}', daemon=True)
+
+    def start(self):
+        """Start the receive thread.
+        """
+        self._thread.start()
+
+    def stop(self):
+        """Signal the receive thread to stop.
+
+        .. note:: A thread blocked in :code:`recv()` only exits after the
+            subscriber is closed or the next message arrives.
+        """
+        self._stopped.set()
+        # Wake up the thread if it is waiting on a free queue slot
+        self._slots.release()
+
+    def _run(self):
+        """Receive thread run method.
+        """
+        self.log.debug(f'{self.topic} receive thread started')
+        while not self._stopped.is_set():
+            self._slots.acquire()
+            if self._stopped.is_set():
+                break
+
+            try:
+                item = self.subscriber.recv()
+            except Exception as ex:
+                if self._stopped.is_set():
+                    break
+                # Hand the error to the listener so that it is reported in
+                # the same way as an error from the listener itself
+                item = ex
+
+            try:
+                self.loop.call_soon_threadsafe(
+                    self.queue.put_nowait, (item, time.monotonic()))
+            except RuntimeError:
+                # The asyncio loop has been closed
+                break
+
+            if isinstance(item, Exception):
+                break
+        self.log.debug(f'{self.topic} receive thread stopped')
+
+    def _release(self, entry):
+        """Free the queue slot of a message taken out of the queue.
+        """
+        self._slots.release()
+        item, recv_time = entry
+        if isinstance(item, Exception):
+            raise item
+        self.recv_times.append(recv_time)
+        return item
+
+    async def recv(self, max_msgs=None):
+        """Wait for at least one message and return all messages which are
+        ready, up to the given maximum.
+
+        :param int max_msgs: Maximum number of messages to return, defaults
+            to the queue depth
+        :return: List of received messages
+        :rtype: list
+        """
+        if max_msgs is None:
+            max_msgs = self.queue_depth
+
+        entry = await self.queue.get()
+        self.recv_times = []
+        msgs = [self._release(entry)]
+        while len(msgs) < max_msgs and not self.queue.empty():
+            msgs.append(self._release(self.queue.get_nowait()))
+        return msgs
@@ -0,0 +1,150 @@
+# Copyright (c) 2020 Intel Corporation.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM,OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+"""Azure Bridge per-topic rate limiting and sampling of messages.
+"""
+import time
+
+
+class TokenBucket:
+    """Token bucket rate limiter.
+
+    Tokens are added at a fixed rate up to the size of the bucket, and each
+    accepted event takes one token. This allows short bursts of up to the
+    bucket size while keeping the average rate under the limit.
+    """
+    def __init__(self, rate, burst=None, clock=time.monotonic):
+        """Constructor.
+
+        :param rate: Number of tokens added per second
+        :param burst: Size of the bucket, defaults to one second of tokens
+            (but at least one)
+        :param clock: Function returning the current time in seconds
+        """
+        if rate <= 0:
+            raise ValueError('Token bucket rate must be positive')
+        self.rate = rate
+        self.burst = burst if burst is not None else max(1.0, rate)
+        self.clock = clock
+        self.tokens = self.burst
+        self.last = clock()
+
+    def take(self):
+        """Take a token if one is available.
+
+        :return: True if a token was taken
+        :rtype: bool
+        """
+        now = self.clock()
+        self.tokens = min(self.burst,
+                          self.tokens + (now - self.last) * self.rate)
+        self.last = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+class TopicSampler:
+    """Decides which messages of a topic are forwarded and which of their
+    frames are uploaded.
+
+    A message is forwarded if it is one of every N-th message and the rate
+    limit allows it. Of the forwarded messages, the given ratio also have
+    their frame uploaded. The blob ratio is applied deterministically, e.g.
+    a ratio of 0.25 uploads every fourth frame.
+    """
+    def __init__(self, max_rate=None, every_nth=1, blob_ratio=1.0,
+                 clock=time.monotonic):
+        """Constructor.
+
+        :param max_rate: Maximum number of messages forwarded per second,
+            None for no limit
+        :param int every_nth: Only forward every N-th message
+        :param blob_ratio: Ratio of forwarded frames to upload
+        :param clock: Function returning the current time in seconds
+        """
+        if every_nth < 1:
+            raise ValueError('every_nth must be at least 1')
+        if not 0 <= blob_ratio <= 1:
+            raise ValueError('blob_ratio must be between 0 and 1')
+        self.every_nth = every_nth
+        self.blob_ratio = blob_ratio
+        self.bucket = None
+        if max_rate is not None:
+            self.bucket = TokenBucket(max_rate, clock=clock)
+        self.dropped = 0
+        self._count = 0
+        self._blob_credit = 0.0
+
+    @classmethod
+    def from_config(cls, conf):
+        """Create a sampler from a topic's configuration.
+
+        :param dict conf: Topic configuration from the digital twin
+        :return: TopicSampler, or None if the topic is not sampled
+        """
+        max_rate = conf.get('max_rate')
+        every_nth = conf.get('sample_every', 1)
+        blob_ratio = conf.get('blob_sample_ratio', 1.0)
+        if max_rate is None and every_nth == 1 and blob_ratio == 1.0:
+            return None
+        return cls(max_rate, every_nth, blob_ratio)
+
+    def accept(self):
+        """Check if the next message is forwarded.
+
+        :rtype: bool
+        """
+        index = self._count
+        self._count += 1
+        if index % self.every_nth != 0 or \
+                (self.bucket is not None and not self.bucket.take()):
+            self.dropped += 1
+            return False
+        return True
+
+    def accept_blob(self):
+        """Check if the frame of the next forwarded message is uploaded.
+
+        :rtype: bool
+        """
+        self._blob_credit += self.blob_ratio
+        # Allow for rounding errors, e.g. when adding 0.1 ten times
+        if self._blob_credit < 1 - 1e-9:
+            return False
+        self._blob_credit -= 1
+        return True
+
+    def sample(self, frames):
+        """Sample a list of received messages.
+
+        :param list frames: List of (meta-data, blob) tuples
+        :return: List of the forwarded (meta-data, blob) tuples, where the
+            blob is None if the frame is not uploaded
+        :rtype: list
+        """
+        sampled = []
+        for meta_data, blob in frames:
+            if not self.accept():
+                continue
+            if blob is not None and not self.accept_blob():
+                blob = None
+            sampled.append((meta_data, blob))
+        return sampled
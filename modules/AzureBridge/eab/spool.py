@@ -0,0 +1,539 @@
+# Copyright (c) 2020 Intel Corporation.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM,OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+"""Azure Bridge disk-backed store-and-forward spool.
+
+Messages and frames which cannot be sent because the IoT Edge Runtime
+(edgeHub) or Azure Blob Storage is unreachable are appended to the spool.
+A background drainer replays them at a controlled rate once the link
+recovers.
+
+The spool is a ring of append-only segment files in a directory. Each
+segment is pre-allocated and memory-mapped, and holds a sequence of records
+with the following layout (little endian)::
+
+    magic (4 bytes) | header length (4) | body length (4) | CRC32 (4)
+    header (JSON) | body
+
+A zeroed or corrupt record header marks the end of the written part of a
+segment. The position of the next record to replay is kept in a small
+cursor file, so that the spool survives a restart of the bridge. The cursor
+is only saved every few records, so a few records may be replayed again
+after the bridge crashed.
+
+Messages and frames are kept in separate spools, so that the records of a
+link which is still down do not hold back the replay of the other one.
+"""
+import os
+import json
+import mmap
+import zlib
+import struct
+import time
+import asyncio
+import logging
+import threading
+
+# Azure Imports
+from azure.core.exceptions import HttpResponseError
+from azure.iot.device import Message
+
+RECORD_MAGIC = b'EABR'
+RECORD_HEADER = struct.Struct('<4sIII')
+SEGMENT_SUFFIX = '.seg'
+CURSOR_FILE = 'cursor'
+
+# Sub-directory of the spool directory keeping the frames
+BLOB_SPOOL_DIR = 'blobs'
+
+# The cursor is saved after this many acknowledged records, or once this
+# many seconds passed since it was last saved
+CURSOR_SAVE_RECORDS = 100
+CURSOR_SAVE_INTERVAL = 1.0
+
+# Record types
+RECORD_MESSAGE = 'message'
+RECORD_BLOB = 'blob'
+
+# Eviction policies applied once the spool reaches its size cap
+EVICT_OLDEST = 'drop-oldest'
+EVICT_NEWEST = 'drop-newest'
+
+DEFAULT_SPOOL_MAX_BYTES = 1024 ** 3
+DEFAULT_SPOOL_SEGMENT_BYTES = 64 * 1024 ** 2
+DEFAULT_SPOOL_DRAIN_RATE = 50
+DEFAULT_SPOOL_SEND_TIMEOUT_MS = 10000
+
+# Limits of the drainer's back-off while the link is still down
+DRAIN_MIN_BACKOFF = 1.0
+DRAIN_MAX_BACKOFF = 30.0
+
+# HTTP status codes of Azure Blob Storage errors which are worth retrying
+RETRY_STATUS_CODES = (408, 429)
+
+
+class Segment:
+    """Memory-mapped spool segment file.
+    """
+    def __init__(self, path, seq, size=None):
+        """Constructor.
+
+        :param str path: Path of the segment file
+        :param int seq: Sequence number of the segment
+        :param int size: Size to pre-allocate a new segment with, if None the
+            segment must already exist
+        """
+        self.path = path
+        self.seq = seq
+        if size is not None:
+            with open(path, 'wb') as f:
+                f.truncate(size)
+        self.size = os.path.getsize(path)
+        self._file = open(path, 'r+b')
+        self.mm = mmap.mmap(self._file.fileno(), self.size)
+        self.write_offset = self._scan()
+
+    def _scan(self):
+        """Find the end of the valid records in the segment.
+        """
+        offset = 0
+        while self.read(offset) is not None:
+            offset = self.next_offset(offset)
+        return offset
+
+    def read(self, offset):
+        """Read the record at the given offset.
+
+        :param int offset: Offset of the record
+        :return: Tuple of (header dict, body bytes), or None if there is no
+            valid record at the offset
+        :rtype: tuple
+        """
+        if offset + RECORD_HEADER.size > self.size:
+            return None
+        magic, hlen, blen, crc = RECORD_HEADER.unpack_from(self.mm, offset)
+        start = offset + RECORD_HEADER.size
+        if magic != RECORD_MAGIC or start + hlen + blen > self.size:
+            return None
+        data = self.mm[start:start + hlen + blen]
+        if zlib.crc32(data) != crc:
+            return None
+        try:
+            header = json.loads(data[:hlen].decode('utf-8'))
+        except ValueError:
+            return None
+        return header, data[hlen:]
+
+    def next_offset(self, offset):
+        """Get the offset of the record after the record at the given offset.
+        """
+        _, hlen, blen, _ = RECORD_HEADER.unpack_from(self.mm, offset)
+        return offset + RECORD_HEADER.size + hlen + blen
+
+    def append(self, header, body):
+        """Append a record to the segment.
+
+        :param bytes header: Serialized record header
+        :param bytes body: Record body
+        :return: False if the record does not fit in the segment
+        :rtype: bool
+        """
+        size = RECORD_HEADER.size + len(header) + len(body)
+        if self.write_offset + size > self.size:
+            return False
+        crc = zlib.crc32(body, zlib.crc32(header))
+        offset = self.write_offset
+        RECORD_HEADER.pack_into(
+                self.mm, offset, RECORD_MAGIC, len(header), len(body), crc)
+        offset += RECORD_HEADER.size
+        self.mm[offset:offset + len(header)] = header
+        offset += len(header)
+        self.mm[offset:offset + len(body)] = body
+        self.write_offset = offset + len(body)
+        return True
+
+    def close(self):
+        """Flush and close the segment.
+        """
+        self.mm.flush()
+        self.mm.close()
+        self._file.close()
+
+
+class Spool:
+    """Disk-backed FIFO of records waiting to be replayed.
+
+    All methods are thread-safe, records can be appended from the upload
+    worker threads as well as from the asyncio loop.
+    """
+    def __init__(self, directory, max_bytes=DEFAULT_SPOOL_MAX_BYTES,
+                 segment_bytes=DEFAULT_SPOOL_SEGMENT_BYTES,
+                 eviction=EVICT_OLDEST):
+        """Constructor.
+
+        :param str directory: Directory to keep the segment files in
+        :param int max_bytes: Maximum size of all segment files
+        :param int segment_bytes: Size of each segment file
+        :param str eviction: Policy once the spool is full, either
+            :code:`drop-oldest` or :code:`drop-newest`
+        """
+        if eviction not in (EVICT_OLDEST, EVICT_NEWEST):
+            raise ValueError(f'Unknown spool eviction policy: {eviction}')
+        if max_bytes < 2 * segment_bytes:
+            raise ValueError('Spool must fit at least two segments')
+
+        self.log = logging.getLogger(__name__)
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.segment_bytes = segment_bytes
+        self.eviction = eviction
+        self.evicted = 0
+        self._lock = threading.Lock()
+        self._segments = []
+        # Position of the record last returned by peek()
+        self._peeked = None
+        self._unsaved = 0
+        self._saved_at = time.monotonic()
+
+        os.makedirs(directory, exist_ok=True)
+        for fn in sorted(os.listdir(directory)):
+            if fn.endswith(SEGMENT_SUFFIX):
+                seq = int(fn[:-len(SEGMENT_SUFFIX)])
+                self._segments.append(
+                        Segment(os.path.join(directory, fn), seq))
+
+        # Restore the replay position
+        self._read_seq, self._read_offset = 0, 0
+        try:
+            with open(os.path.join(directory, CURSOR_FILE), 'r') as f:
+                self._read_seq, self._read_offset = map(int, f.read().split())
+        except (OSError, ValueError):
+            pass
+        while self._segments and self._segments[0].seq < self._read_seq:
+            self._remove_oldest()
+        if self._segments and self._segments[0].seq != self._read_seq:
+            self._read_seq, self._read_offset = self._segments[0].seq, 0
+
+        if self._segments:
+            self.log.info(f'Recovered spool with {len(self._segments)} '
+                          'segment(s)')
+
+    @property
+    def size(self):
+        """Total size of the segment files in bytes.
+        """
+        return sum(seg.size for seg in self._segments)
+
+    def _new_segment(self, size):
+        """Helper function to add a segment, evicting old segments if needed.
+
+        :return: False if there is no room for the segment
+        """
+        while self._segments and self.size + size > self.max_bytes:
+            if self.eviction == EVICT_NEWEST or len(self._segments) == 1:
+                return False
+            self.log.warning('Spool full, dropping oldest segment')
+            self._remove_oldest()
+            self.evicted += 1
+        seq = self._segments[-1].seq + 1 if self._segments else self._read_seq
+        path = os.path.join(self.directory, f'{seq:012d}{SEGMENT_SUFFIX}')
+        self._segments.append(Segment(path, seq, size))
+        return True
+
+    def _remove_oldest(self):
+        """Helper function to delete the oldest segment.
+        """
+        seg = self._segments.pop(0)
+        seg.close()
+        os.remove(seg.path)
+        if self._read_seq <= seg.seq:
+            self._read_seq, self._read_offset = seg.seq + 1, 0
+            self._save_cursor()
+
+    def _save_cursor(self):
+        """Helper function to persist the replay position.
+        """
+        path = os.path.join(self.directory, CURSOR_FILE)
+        with open(path + '.tmp', 'w') as f:
+            f.write(f'{self._read_seq} {self._read_offset}')
+        os.replace(path + '.tmp', path)
+        self._unsaved = 0
+        self._saved_at = time.monotonic()
+
+    def append(self, header, body):
+        """Append a record to the spool.
+
+        :param dict header: Record header
+        :param bytes body: Record body
+        :return: False if the record was dropped because the spool is full
+        :rtype: bool
+        """
+        header = json.dumps(header).encode('utf-8')
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        needed = RECORD_HEADER.size + len(header) + len(body)
+
+        with self._lock:
+            if self._segments and self._segments[-1].append(header, body):
+                return True
+            if not self._new_segment(max(self.segment_bytes, needed)):
+                self.log.warning('Spool full, dropping new record')
+                self.evicted += 1
+                return False
+            return self._segments[-1].append(header, body)
+
+    def peek(self):
+        """Get the oldest record in the spool without removing it.
+
+        :return: Tuple of (header dict, body bytes), or None if empty
+        :rtype: tuple
+        """
+        with self._lock:
+            while self._segments:
+                seg = self._segments[0]
+                record = seg.read(self._read_offset)
+                if record is not None:
+                    self._peeked = (seg.seq, self._read_offset)
+                    return record
+                if len(self._segments) == 1:
+                    return None
+                # Fully replayed segment, move on to the next one
+                self._remove_oldest()
+            return None
+
+    def ack(self):
+        """Remove the record returned by :code:`peek()`.
+
+        .. note:: Nothing is removed if the record was evicted since it was
+            returned by :code:`peek()`.
+
+        .. warning:: This function may block on disk I/O to save the cursor.
+        """
+        with self._lock:
+            if self._peeked != (self._read_seq, self._read_offset):
+                return
+            self._peeked = None
+            seg = self._segments[0]
+            self._read_offset = seg.next_offset(self._read_offset)
+            self._unsaved += 1
+            if self._unsaved >= CURSOR_SAVE_RECORDS or \
+                    time.monotonic() - self._saved_at >= CURSOR_SAVE_INTERVAL:
+                self._save_cursor()
+
+    def empty(self):
+        """Check if there are no records waiting to be replayed.
+        """
+        return self.peek() is None
+
+    def close(self):
+        """Save the cursor, flush and close all segments.
+        """
+        with self._lock:
+            if self._unsaved > 0:
+                self._save_cursor()
+            for seg in self._segments:
+                seg.close()
+            self._segments = []
+
+
+def is_permanent_error(ex):
+    """Check if replaying a spooled record failed for a reason which retrying
+    cannot fix, e.g. the record is malformed or too large, or Azure Blob
+    Storage rejected the request.
+
+    :param Exception ex: Error which the replay failed with
+    :rtype: bool
+    """
+    if isinstance(ex, HttpResponseError):
+        status = ex.status_code
+        return status is not None and 400 <= status < 500 and \
+            status not in RETRY_STATUS_CODES
+    return isinstance(ex, (ValueError, TypeError, KeyError))
+
+
+class StoreAndForward:
+    """Sends messages and frames into the spool while the link to their
+    destination is down, and replays them once it has recovered.
+
+    A link is marked down when sending over it fails or times out. While it
+    is down, everything for that link goes straight into the spool instead
+    of waiting on it. The drainer replays the spool at a fixed rate, and the
+    first successful replay marks the link up again, so a reconnect does not
+    cause a burst of retries.
+
+    Each link has its own spool which is replayed independently. Records
+    whose replay fails permanently (see :code:`is_permanent_error()`) are
+    dropped, all other failures are retried with a back-off.
+    """
+    def __init__(self, message_spool, blob_spool,
+                 drain_rate=DEFAULT_SPOOL_DRAIN_RATE,
+                 send_timeout_ms=DEFAULT_SPOOL_SEND_TIMEOUT_MS):
+        """Constructor.
+
+        :param Spool message_spool: Spool to store messages in
+        :param Spool blob_spool: Spool to store frames in
+        :param drain_rate: Maximum number of records replayed per second
+            from each spool
+        :param send_timeout_ms: Time in milliseconds after which a send to
+            the IoT Edge Runtime counts as failed
+        """
+        self.log = logging.getLogger(__name__)
+        self.message_spool = message_spool
+        self.blob_spool = blob_spool
+        self.drain_interval = 1.0 / drain_rate
+        self.send_timeout = send_timeout_ms / 1000.0
+        self.min_backoff = DRAIN_MIN_BACKOFF
+        self.max_backoff = DRAIN_MAX_BACKOFF
+        self.output_up = True
+        self.storage_up = True
+        self.spooled = 0
+        self.replayed = 0
+        self.dropped = 0
+
+    @property
+    def size(self):
+        """Total size of the spools in bytes.
+        """
+        return self.message_spool.size + self.blob_spool.size
+
+    def output_down(self, ex):
+        """Mark the link to the IoT Edge Runtime as down.
+        """
+        if self.output_up:
+            self.log.warning(f'IoT Edge Runtime unreachable ({ex}), '
+                             'spooling messages')
+        self.output_up = False
+
+    def storage_down(self, ex):
+        """Mark the link to Azure Blob Storage as down.
+        """
+        if self.storage_up:
+            self.log.warning(f'Azure Blob Storage unreachable ({ex}), '
+                             'spooling frames')
+        self.storage_up = False
+
+    def spool_message(self, msg, output_name):
+        """Store an output message in the spool.
+
+        .. warning:: This function blocks on disk I/O.
+
+        :param azure.iot.device.Message msg: Message to store
+        :param str output_name: Output stream name
+        """
+        header = {
+            'type': RECORD_MESSAGE,
+            'output': output_name,
+            'content_type': msg.content_type,
+            'content_encoding': msg.content_encoding,
+            'properties': msg.custom_properties,
+        }
+        if self.message_spool.append(header, msg.data):
+            self.spooled += 1
+
+    def spool_blob(self, container_name, blob_name, blob):
+        """Store a frame in the spool.
+
+        .. warning:: This function blocks on disk I/O.
+
+        :param str container_name: Name of the Azure Blob container
+        :param str blob_name: Name of the blob
+        :param bytes blob: Frame to store
+        """
+        header = {
+            'type': RECORD_BLOB,
+            'container': container_name,
+            'blob': blob_name,
+        }
+        if self.blob_spool.append(header, blob):
+            self.spooled += 1
+
+    async def _replay(self, bs, header, body):
+        """Helper function to resend a spooled record.
+        """
+        if header['type'] == RECORD_MESSAGE:
+            msg = Message(body, content_encoding=header['content_encoding'],
+                          content_type=header['content_type'])
+            msg.custom_properties.update(header['properties'])
+            await asyncio.wait_for(
+                    bs.module_client.send_message_to_output(
+                        msg, header['output']),
+                    self.send_timeout)
+            self.output_up = True
+        elif header['type'] == RECORD_BLOB and bs.bsc is None:
+            self.log.error('Dropping spooled frame, Azure Blob Storage is '
+                           'disabled')
+        elif header['type'] == RECORD_BLOB:
+            blob_client = bs.bsc.get_blob_client(
+                    container=header['container'], blob=header['blob'])
+            # Overwrite, the frame may have been partially uploaded before
+            fut = await bs.upload_pool.submit(
+                    len(body), blob_client.upload_blob, body, overwrite=True)
+            await fut
+            self.storage_up = True
+        else:
+            self.log.error(f'Dropping unknown spool record: {header}')
+
+    async def drain(self, bs):
+        """Replay the spooled records in order, for as long as the bridge
+        runs.
+
+        :param eab.bridge_state.BridgeState bs: Bridge state instance
+        """
+        await asyncio.gather(
+                self._drain(bs, self.message_spool),
+                self._drain(bs, self.blob_spool))
+
+    async def _drain(self, bs, spool):
+        """Helper function to replay the records of one spool in order.
+        """
+        loop = asyncio.get_event_loop()
+        backoff = self.min_backoff
+
+        while True:
+            record = await loop.run_in_executor(None, spool.peek)
+            if record is None:
+                await asyncio.sleep(self.min_backoff)
+                continue
+
+            header, body = record
+            try:
+                await self._replay(bs, header, body)
+                self.replayed += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as ex:
+                if not is_permanent_error(ex):
+                    self.log.debug(f'Spool replay failed: {ex}, retrying in '
+                                   f'{backoff}s')
+                    await asyncio.sleep(backoff)
+                    backoff = min(backoff * 2, self.max_backoff)
+                    continue
+                self.log.error(f'Dropping spooled {header.get("type")} '
+                               f'record, replay failed: {ex}')
+                self.dropped += 1
+
+            backoff = self.min_backoff
+            await loop.run_in_executor(None, spool.ack)
+            await asyncio.sleep(self.drain_interval)
+
+    def close(self):
+        """Close the spools.
+        """
+        self.message_spool.close()
+        self.blob_spool.close()
@@ -19,127 +19,453 @@
 # IN THE SOFTWARE.
 """Azure Bridge EMB subscriber async functions.
 """
-import json
+import time
 import asyncio
 import logging
+import functools
 import traceback as tb
 
 # Azure Imports
-from azure.iot.device import Message
 from azure.core.exceptions import ResourceExistsError
 
+from eab.codec import make_message
+from eab.packer import PACK_META_KEY
 
-async def subscriber_recv(loop, subscriber):
-    """Receive a message from a subscriber on the EII Message Bus.
 
-    :param loop: asyncio loop
-    :param subscriber: EII Message Bus Subscriber
-    """
-    recv = loop.run_in_executor(None, subscriber.recv)
-    msg = await recv
-    return msg
+async def upload_frame(bs, container_name, meta_data, blob,
+                       block_uploader=None, metrics=None):
+    """Upload a frame into Azure Blob Storage
 
+    This only waits until the bridge's upload pool has room for the frame,
+    the returned future completes once the upload itself has finished.
 
-async def upload_frame(bs, container_name, meta_data, blob):
-    """Upload a frame into Azure Blob Storage
+    :param eab.bridge_state.BridgeState bs: Bridge state instance
+    :param str container_name: Name of the Azure Blob container
+    :param dict meta_data: EII meta-data for the frame
+    :param bytes blob: Frame to upload
+    :param eab.upload.BlockUploader block_uploader: If given, large frames
+        are uploaded in blocks with this uploader
+    :param eab.metrics.TopicMetrics metrics: If given, the upload is
+        recorded in these metrics once it completes, unless the blob was
+        stored in the spool instead
+    :return: Future for the upload
+    :rtype: asyncio.Future
     """
-    loop = asyncio.get_event_loop()
-    log = logging.getLogger(container_name)
     ext = 'raw'
 
     if 'encoding_type' in meta_data:
         ext = meta_data['encoding_type']
 
     blob_name = f'{meta_data["img_handle"]}.{ext}'
+    return await upload_named_blob(
+            bs, container_name, blob_name, blob, block_uploader, metrics)
+
+
+async def upload_named_blob(bs, container_name, blob_name, blob,
+                            block_uploader=None, metrics=None):
+    """Upload a blob with the given name into Azure Blob Storage.
+
+    Like :code:`upload_frame()`, this only waits until the bridge's upload
+    pool has room for the blob.
+
+    :param eab.bridge_state.BridgeState bs: Bridge state instance
+    :param str container_name: Name of the Azure Blob container
+    :param str blob_name: Name of the blob
+    :param bytes blob: Data to upload
+    :param eab.upload.BlockUploader block_uploader: If given, large blobs
+        are uploaded in blocks with this uploader
+    :param eab.metrics.TopicMetrics metrics: If given, the upload is
+        recorded in these metrics once it completes, unless the blob was
+        stored in the spool instead
+    :return: Future for the upload
+    :rtype: asyncio.Future
+    """
+    log = logging.getLogger(container_name)
+
+    sf = bs.store_forward
+    if sf is not None and not sf.storage_up:
+        # Go straight to the spool while the blob storage is unreachable
+        log.debug(f'Spooling blob {blob_name}')
+        return await bs.upload_pool.submit(
+                len(blob), sf.spool_blob, container_name, blob_name, blob)
+
+    start = time.monotonic()
+    fut = await _upload_named_blob(
+            bs, log, container_name, blob_name, blob, block_uploader)
+    if metrics is not None:
+        fut.add_done_callback(functools.partial(
+                metrics.upload_done, len(blob), start))
+    return fut
+
+
+async def _upload_named_blob(bs, log, container_name, blob_name, blob,
+                             block_uploader):
+    """Submit the upload of a blob to the bridge's upload pool.
+    """
+    if block_uploader is not None and block_uploader.should_split(len(blob)):
+        log.info(f'Uploading blob {blob_name} in blocks')
+        return await bs.upload_pool.submit_coroutine(
+                len(blob), upload_blob_blocks,
+                bs, block_uploader, container_name, blob_name, blob)
+
+    if bs.async_uploader is not None:
+        log.info(f'Uploading blob {blob_name}')
+        return await bs.upload_pool.submit_coroutine(
+                len(blob), upload_blob_async,
+                bs, container_name, blob_name, blob)
 
     log.debug(f'Creating blob client for {blob_name}')
     blob_client = \
         bs.bsc.get_blob_client(container=container_name, blob=blob_name)
 
     log.info(f'Uploading blob {blob_name}')
-    # TODO: Add thread pool for these uploads (WE'RE GOING FOR SPEED!)
-    upload = loop.run_in_executor(None, blob_client.upload_blob, blob)
-    await upload
+    return await bs.upload_pool.submit(
+            len(blob), upload_blob,
+            bs, blob_client, container_name, blob_name, blob)
+
+
+def upload_blob(bs, blob_client, container_name, blob_name, blob):
+    """Upload a blob, storing it in the spool if the upload fails and the
+    bridge's store-and-forward spool is enabled.
+
+    .. warning:: This function blocks, it is run by the upload pool.
+
+    :param eab.bridge_state.BridgeState bs: Bridge state instance
+    :param blob_client: Azure blob client for the blob
+    :param str container_name: Name of the Azure Blob container
+    :param str blob_name: Name of the blob
+    :param bytes blob: Frame to upload
+    :return: False if the blob was stored in the spool instead
+    :rtype: bool
+    """
+    try:
+        blob_client.upload_blob(blob)
+    except ResourceExistsError:
+        raise
+    except Exception as ex:
+        sf = bs.store_forward
+        if sf is None:
+            raise
+        sf.storage_down(ex)
+        sf.spool_blob(container_name, blob_name, blob)
+        return False
+    return True
+
+
+async def upload_blob_async(bs, container_name, blob_name, blob):
+    """Upload a blob with the bridge's async uploader, storing it in the
+    spool if the upload fails and the bridge's store-and-forward spool is
+    enabled.
+
+    :param eab.bridge_state.BridgeState bs: Bridge state instance
+    :param str container_name: Name of the Azure Blob container
+    :param str blob_name: Name of the blob
+    :param bytes blob: Frame to upload
+    :return: False if the blob was stored in the spool instead
+    :rtype: bool
+    """
+    try:
+        await bs.async_uploader.upload(container_name, blob_name, blob)
+    except (ResourceExistsError, asyncio.CancelledError):
+        raise
+    except Exception as ex:
+        await spool_failed_blob(bs, ex, container_name, blob_name, blob)
+        return False
+    return True
+
+
+async def upload_blob_blocks(bs, block_uploader, container_name, blob_name,
+                             blob):
+    """Upload a blob by staging its blocks concurrently and committing them,
+    storing it in the spool if the upload fails and the bridge's
+    store-and-forward spool is enabled.
+
+    The blocks are staged with the bridge's async uploader if it has one,
+    otherwise on the upload pool's worker threads.
+
+    :param eab.bridge_state.BridgeState bs: Bridge state instance
+    :param eab.upload.BlockUploader block_uploader: Block uploader
+    :param str container_name: Name of the Azure Blob container
+    :param str blob_name: Name of the blob
+    :param bytes blob: Frame to upload
+    :return: False if the blob was stored in the spool instead
+    :rtype: bool
+    """
+    if bs.async_uploader is not None:
+        blob_client = bs.async_uploader.get_blob_client(
+                container_name, blob_name)
+        stage = blob_client.stage_block
+        commit = blob_client.commit_block_list
+    else:
+        blob_client = \
+            bs.bsc.get_blob_client(container=container_name, blob=blob_name)
+        executor = bs.upload_pool.executor
+
+        def stage(block_id, data):
+            return bs.loop.run_in_executor(
+                    executor, blob_client.stage_block, block_id, data)
+
+        def commit(block_ids):
+            return bs.loop.run_in_executor(
+                    executor, blob_client.commit_block_list, block_ids)
+
+    try:
+        await block_uploader.upload(stage, commit, blob)
+    except asyncio.CancelledError:
+        raise
+    except Exception as ex:
+        await spool_failed_blob(bs, ex, container_name, blob_name, blob)
+        return False
+    return True
 
 
-async def upload_frame_done(fut):
+async def spool_failed_blob(bs, ex, container_name, blob_name, blob):
+    """Store a blob whose upload failed in the spool, if the bridge's
+    store-and-forward spool is enabled. Otherwise the error is re-raised.
+
+    :param eab.bridge_state.BridgeState bs: Bridge state instance
+    :param Exception ex: Error which the upload failed with
+    :param str container_name: Name of the Azure Blob container
+    :param str blob_name: Name of the blob
+    :param bytes blob: Frame which failed to upload
+    """
+    sf = bs.store_forward
+    if sf is None:
+        raise ex
+    sf.storage_down(ex)
+    # Writing to the spool blocks on disk I/O
+    await bs.loop.run_in_executor(
+            None, sf.spool_blob, container_name, blob_name, blob)
+
+
+async def send_output(bs, msg, output_name):
+    """Send a message over the IoT Edge Runtime bus.
+
+    If the bridge's store-and-forward spool is enabled, the message is stored
+    in the spool when the send fails or times out, or when the IoT Edge
+    Runtime is already known to be unreachable.
+
+    :param eab.bridge_state.BridgeState bs: Bridge state instance
+    :param azure.iot.device.Message msg: Message to send
+    :param str output_name: Output stream name
+    """
+    sf = bs.store_forward
+    if sf is None:
+        await bs.module_client.send_message_to_output(msg, output_name)
+        return
+
+    if sf.output_up:
+        try:
+            await asyncio.wait_for(
+                    bs.module_client.send_message_to_output(msg, output_name),
+                    sf.send_timeout)
+            return
+        except asyncio.CancelledError:
+            raise
+        except Exception as ex:
+            sf.output_down(ex)
+
+    # Writing to the spool blocks on disk I/O
+    await bs.loop.run_in_executor(None, sf.spool_message, msg, output_name)
+
+
+def upload_frame_done(fut):
     """Upload frame done callback
 
     :param asyncio.Future fut: Future for uploading the frame
     """
+    if fut.cancelled():
+        return
     ex = fut.exception()
     if ex is not None:
         log = logging.getLogger(__name__)
         log.error(f'Failed to upload frame to Azure Blob Storage: {ex}')
 
 
-async def emb_subscriber_listener(bs, subscriber, output_name, container_name):
+def create_container(bs, container_name):
+    """Create a container in Azure Blob Storage if it does not exist.
+
+    .. warning:: This function blocks, it must not be called from the
+        asyncio loop.
+
+    :param eab.bridge_state.BridgeState bs: Bridge state instance
+    :param str container_name: Name of the Azure Blob container
+    """
+    try:
+        container_client = bs.bsc.get_container_client(container_name)
+        container_client.create_container()
+    except ResourceExistsError:
+        # Pass this error, its okay if it already exists
+        pass
+
+
+async def emb_subscriber_listener(bs, topic):
     """EII Message Bus asyncio subscriber listener.
 
     This will resend the meta-data received from EII onto the MSFT IoT Edge
-    Runtime bus using the given output name. The output name must be a
+    Runtime bus using the topic's output name. The output name must be a
     specified output route for the module when deployed via the IoT Edge
     Runtime.
 
-    :param subscriber: EII Message Bus subscriber
-    :param container_name: Name of the Azure Blob container
-    :param output_name: Output stream name
-    """
-    # Get asyncio loop handle
-    loop = asyncio.get_event_loop()
-    log = logging.getLogger(output_name)
-    save_blobs = False
+    The output name, blob container, batching and aggregation settings are
+    read from the topic for every message, so that they can be changed
+    without restarting the listener.
 
-    log.info(f'{output_name} subscriber starting...')
+    :param eab.bridge_state.BridgeState bs: Bridge state instance
+    :param eab.topic.Topic topic: Topic to forward
+    """
+    log = logging.getLogger(topic.output_name)
+    created_container = None
 
-    if bs.bsc is not None and container_name is not None:
-        log.debug(
-            f'Creating blob storage container: {container_name}')
-        save_blobs = True
-        try:
-            container_client = bs.bsc.get_container_client(container_name)
-            container_client.create_container()
-        except ResourceExistsError:
-            # Pass this error, its okay if it already exists
-            pass
+    log.info(f'{topic.output_name} subscriber starting...')
 
     try:
         # Loop forever receiving messages
         while True:
-            log.debug('Waiting for message from the EII Message Bus')
-            msg = await subscriber_recv(loop, subscriber)
-
-            meta = msg.get_meta_data()
-            blob = msg.get_blob()
-
-            if meta is None and blob is not None:
-                # This listener can only handle messages which contain
-                # meta-data that is to be passed on to the MSFT IoT Edge
-                # Runtime bus
-                log.error('Received a message without meta-data')
-                break
-
-            log.debug(f'Received: {meta}')
-
-            if save_blobs and blob is not None:
-                try:
-                    fut = asyncio.ensure_future(
-                        upload_frame(bs, container_name, meta, blob),
-                        loop=loop)
-                    fut.add_done_callback(upload_frame_done)
-                except Exception:
-                    log.error(f'Failed to upload blob: {tb.format_exc()}')
-
-            if blob is not None:
-                # Free the blob early (might be a lot of memory)
-                del blob
-
-            # Package the meta-data into a message object and send it
-            log.debug('Re-sending message over the IoT Edge runtime bus')
-            output_msg = Message(json.dumps(meta))
-            await bs.module_client.send_message_to_output(
-                    output_msg, output_name)
+            log.debug('Waiting for messages from the EII Message Bus')
+            msgs = await topic.reader.recv()
+            log.debug(f'Received {len(msgs)} message(s)')
+
+            frames = [(msg.get_meta_data(), msg.get_blob()) for msg in msgs]
+            del msgs
+
+            # Latencies of the messages received together are measured from
+            # the first of them
+            recv_time = topic.reader.recv_times[0]
+            metrics = topic.metrics
+            if metrics is not None:
+                metrics.received.inc(len(frames))
+
+            aggregator = topic.aggregator
+            if aggregator is not None:
+                # Summarizes every frame received, before any are filtered
+                # out or sampled
+                for meta, _ in frames:
+                    if meta is not None:
+                        aggregator.add(meta)
+                if not topic.forward:
+                    continue
+
+            metadata_spec = topic.metadata_spec
+            if metadata_spec is not None:
+                # Drop the messages which do not match the topic's filter
+                received = len(frames)
+                frames = [(meta, blob) for meta, blob in frames
+                          if meta is None or metadata_spec.matches(meta)]
+                if metrics is not None:
+                    metrics.filtered.inc(received - len(frames))
+
+            if topic.sampler is not None:
+                received = len(frames)
+                frames = topic.sampler.sample(frames)
+                if metrics is not None:
+                    metrics.sampled.inc(received - len(frames))
+
+            encode_conf = topic.encode_conf
+            if encode_conf is not None and topic.container_name is not None:
+                # Encodes the raw frames in parallel in the encode pool
+                frames = await bs.frame_encoder.encode_all(
+                        frames, encode_conf['format'],
+                        encode_conf.get('level'))
+
+            for meta, blob in frames:
+                if meta is None and blob is not None:
+                    # This listener can only handle messages which contain
+                    # meta-data that is to be passed on to the MSFT IoT Edge
+                    # Runtime bus
+                    log.error('Received a message without meta-data')
+                    return
+
+                log.debug(f'Received: {meta}')
+
+                container_name = topic.container_name
+                if container_name is not None and blob is not None:
+                    try:
+                        if container_name != created_container:
+                            log.debug(f'Creating blob storage container: '
+                                      f'{container_name}')
+                            # Blocks on a request to Azure Blob Storage
+                            await bs.loop.run_in_executor(
+                                    None, create_container, bs,
+                                    container_name)
+                            created_container = container_name
+
+                        # Waits here while the upload pool is full, so that
+                        # frames are not read faster than they can be
+                        # uploaded
+                        if topic.packer is not None:
+                            meta[PACK_META_KEY] = await topic.packer.add(
+                                    meta['img_handle'], blob)
+                        else:
+                            fut = await upload_frame(
+                                    bs, container_name, meta, blob,
+                                    topic.block_uploader, metrics)
+                            fut.add_done_callback(upload_frame_done)
+                    except Exception as ex:
+                        log.error(f'Failed to upload blob: {tb.format_exc()}')
+                        if metrics is not None:
+                            metrics.record_error('upload', ex)
+
+                if blob is not None:
+                    # Free the blob early (might be a lot of memory)
+                    del blob
+
+                tracer = topic.tracer
+                if tracer is not None:
+                    # Read before the field might be projected away
+                    frame_time = tracer.frame_time(meta)
+
+                metadata_spec = topic.metadata_spec
+                if metadata_spec is not None:
+                    pointer = meta.get(PACK_META_KEY)
+                    meta = metadata_spec.project(meta)
+                    if pointer is not None:
+                        # Consumers need the pointer to find the frame
+                        meta[PACK_META_KEY] = pointer
+
+                payload = topic.codec.encode(meta)
+                if topic.batcher is not None:
+                    stamp = None
+                    if tracer is not None:
+                        stamp = functools.partial(
+                                tracer.stamp, recv_time=recv_time,
+                                frame_time=frame_time)
+                    await topic.batcher.add(payload, stamp)
+                else:
+                    # Package the meta-data into a message object and send it
+                    log.debug('Re-sending message over the IoT Edge runtime '
+                              'bus')
+                    output_msg = make_message(
+                            topic.codec, payload, topic.compressor)
+                    if tracer is not None:
+                        tracer.stamp(output_msg, recv_time, frame_time)
+                    try:
+                        await send_output(bs, output_msg, topic.output_name)
+                    except Exception as ex:
+                        if metrics is not None:
+                            metrics.record_error('send', ex)
+                        raise
+
+                if metrics is not None:
+                    metrics.forwarded.inc()
+                    metrics.forward_latency.observe(
+                            time.monotonic() - recv_time)
     except asyncio.CancelledError:
         log.info('Subscriber routine cancelled')
-    except Exception:
+        if topic.packer is not None:
+            # Upload whatever is left in the current pack
+            try:
+                await topic.packer.flush()
+            except Exception as ex:
+                log.error(f'Failed to upload final pack: {ex}')
+        if topic.batcher is not None:
+            # Send whatever is left in the current batch
+            try:
+                await topic.batcher.flush()
+            except Exception as ex:
+                log.error(f'Failed to send final batch: {ex}')
+    except Exception as ex:
         log.error(f'Unexpected error in listener: {tb.format_exc()}')
+        if topic.metrics is not None:
+            # The topic is no longer forwarded
+            topic.metrics.record_error('listener', ex)
@@ -0,0 +1,239 @@
+# Copyright (c) 2020 Intel Corporation.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM,OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+"""Azure Bridge performance telemetry reported through the module twin.
+
+Every interval the bridge summarizes the metrics of each topic, and patches
+the summary into the :code:`eab_telemetry` reported property of its module
+twin. A patch is only sent when a value changed meaningfully since the last
+patch, or when nothing was reported for a number of intervals, so that the
+twin update quota of the IoT Hub is not used up by an idle bridge.
+"""
+import time
+import asyncio
+import logging
+import numbers
+
+# Reported property holding the telemetry
+TELEMETRY_PROPERTY = 'eab_telemetry'
+
+# Detail levels of the telemetry
+DETAIL_BASIC = 'basic'
+DETAIL_FULL = 'full'
+DETAILS = (DETAIL_BASIC, DETAIL_FULL)
+
+DEFAULT_TELEMETRY_DETAIL = DETAIL_BASIC
+MIN_TELEMETRY_INTERVAL_S = 10.0
+
+# A number changed meaningfully if it changed by more than this ratio of its
+# last reported value, and by more than the minimum
+CHANGE_RATIO = 0.1
+CHANGE_MIN = 1
+
+# Number of intervals after which the telemetry is patched even if nothing
+# changed
+HEARTBEAT_INTERVALS = 10
+
+
+def histogram_quantile(q, bounds, counts):
+    """Estimate a quantile of a histogram's observations as the upper bound
+    of the bucket it is in.
+
+    :param float q: Quantile between 0 and 1
+    :param tuple bounds: Upper bounds of the buckets
+    :param list counts: Observations in each bucket, followed by the
+        observations over the last bound
+    :return: Upper bound, or None if there are no observations or the
+        quantile is over the last bound
+    """
+    total = sum(counts)
+    if total == 0:
+        return None
+    rank = q * total
+    cumulative = 0
+    for bound, count in zip(bounds, counts):
+        cumulative += count
+        if cumulative >= rank:
+            return bound
+    return None
+
+
+def changed(old, new):
+    """Check if a telemetry value changed meaningfully.
+
+    :param old: Last reported value
+    :param new: New value
+    :rtype: bool
+    """
+    if isinstance(old, dict) and isinstance(new, dict):
+        return old.keys() != new.keys() or \
+            any(changed(old[k], new[k]) for k in new)
+    if isinstance(old, numbers.Number) and isinstance(new, numbers.Number) \
+            and not isinstance(old, bool) and not isinstance(new, bool):
+        return abs(new - old) > max(CHANGE_MIN, CHANGE_RATIO * abs(old))
+    return old != new
+
+
+class TelemetryReporter:
+    """Periodically reports the bridge's performance in its module twin.
+    """
+    def __init__(self, bs, interval_s, detail=DEFAULT_TELEMETRY_DETAIL,
+                 clock=time.monotonic):
+        """Constructor.
+
+        :param eab.bridge_state.BridgeState bs: Bridge state instance, which
+            must have metrics
+        :param float interval_s: Seconds between the summaries
+        :param str detail: Detail level, either basic or full
+        :param clock: Function returning the current monotonic time
+        :raises ValueError: If the interval or detail level are invalid
+        """
+        if interval_s < MIN_TELEMETRY_INTERVAL_S:
+            raise ValueError('Telemetry interval must be at least '
+                             f'{MIN_TELEMETRY_INTERVAL_S}s')
+        if detail not in DETAILS:
+            raise ValueError(f'Unknown telemetry detail level: {detail}')
+        self.log = logging.getLogger(__name__)
+        self.bs = bs
+        self.interval = interval_s
+        self.detail = detail
+        self.clock = clock
+        self.reported = None
+        self.patches = 0
+        self._quiet = 0
+        # Topic->(time, counters, latency buckets) of the last summary
+        self._last = {}
+
+    def _topic_summary(self, name, topic, now):
+        """Summarize a topic's metrics since the last summary.
+        """
+        metrics = topic.metrics
+        counters = (metrics.received.value, metrics.forwarded.value,
+                    metrics.uploaded.value, metrics.uploaded_bytes.value)
+        latency = list(metrics.forward_latency.counts)
+        last_time, last_counters, last_latency = self._last.get(
+            name, (None, counters, latency))
+        self._last[name] = (now, counters, latency)
+
+        elapsed = now - last_time if last_time is not None else 0
+        rates = [round((c - lc) / elapsed, 1) if elapsed > 0 else 0.0
+                 for c, lc in zip(counters, last_counters)]
+
+        last_error = metrics.last_error
+        if last_error is not None:
+            last_error = dict(last_error, time=time.strftime(
+                '%Y-%m-%dT%H:%M:%SZ', time.gmtime(last_error['time'])))
+
+        summary = {
+            'received_per_s': rates[0],
+            'forwarded_per_s': rates[1],
+            'dropped': metrics.filtered.value + metrics.sampled.value,
+            'backlog': topic.reader.queue.qsize(),
+            'errors': metrics.error_count,
+            'last_error': last_error,
+        }
+        if self.detail == DETAIL_FULL:
+            counts = [c - lc for c, lc in zip(latency, last_latency)]
+            bounds = metrics.forward_latency.bounds
+            p99 = histogram_quantile(0.99, bounds, counts)
+            summary.update({
+                'uploads_per_s': rates[2],
+                'upload_kb_per_s': round(rates[3] / 1024, 1),
+                'forward_p99_ms': round(p99 * 1000, 1)
+                if p99 is not None else None,
+            })
+        return summary
+
+    def summary(self):
+        """Summarize the performance of the bridge since the last summary.
+
+        :return: Value of the telemetry reported property
+        :rtype: dict
+        """
+        now = self.clock()
+        topics = {name: self._topic_summary(name, topic, now)
+                  for name, topic in self.bs.topics.items()
+                  if topic.metrics is not None}
+        for name in list(self._last):
+            if name not in topics:
+                del self._last[name]
+
+        telemetry = {
+            'config_hash': self.bs.config_hash,
+            'interval_s': self.interval,
+            'topics': topics,
+        }
+
+        sf = self.bs.store_forward
+        if sf is not None:
+            telemetry['spool'] = {
+                'bytes': sf.size,
+                'spooled': sf.spooled,
+                'replayed': sf.replayed,
+                'dropped': sf.dropped,
+                'output_up': sf.output_up,
+                'storage_up': sf.storage_up,
+            }
+        return telemetry
+
+    def patch(self, telemetry):
+        """Get the reported properties patch for a summary, if it should be
+        sent.
+
+        :param dict telemetry: Summary from :code:`summary()`
+        :return: Patch, or None if nothing changed meaningfully
+        :rtype: dict
+        """
+        self._quiet += 1
+        if self.reported is not None and \
+                self._quiet < HEARTBEAT_INTERVALS and \
+                not changed(self.reported, telemetry):
+            return None
+
+        patch = dict(telemetry)
+        if self.reported is not None:
+            # Reported properties are merged, so removed topics have to be
+            # deleted explicitly
+            removed = set(self.reported['topics']) - set(telemetry['topics'])
+            if removed:
+                patch['topics'] = dict(telemetry['topics'])
+                patch['topics'].update((name, None) for name in removed)
+        return patch
+
+    async def run(self):
+        """Report the telemetry every interval.
+        """
+        self.log.info(f'Reporting telemetry every {self.interval}s')
+        while True:
+            await asyncio.sleep(self.interval)
+            telemetry = self.summary()
+            patch = self.patch(telemetry)
+            if patch is None:
+                continue
+            try:
+                await self.bs.module_client.patch_twin_reported_properties(
+                    {TELEMETRY_PROPERTY: patch})
+            except asyncio.CancelledError:
+                raise
+            except Exception as ex:
+                self.log.error(f'Failed to report telemetry: {ex}')
+                continue
+            self.reported = telemetry
+            self.patches += 1
+            self._quiet = 0
@@ -0,0 +1,165 @@
+# Copyright (c) 2020 Intel Corporation.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM,OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+"""Unit tests for the eab.aggregator module.
+"""
+import json
+import asyncio
+import unittest
+from eab.aggregator import (
+    AGGREGATE_PROPERTY, Reducer, WindowAggregator)
+
+
+class FakeClock:
+    """Clock which only moves when it is told to.
+    """
+    def __init__(self, now=100000):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class TestWindowAggregator(unittest.TestCase):
+    """Unit tests for the :code:`eab.aggregator` module.
+    """
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.clock = FakeClock()
+        self.sent = []
+
+    def tearDown(self):
+        self.loop.close()
+        asyncio.set_event_loop(None)
+
+    async def send(self, msg, output_name):
+        self.sent.append((msg, output_name))
+
+    def aggregator(self, window_ms, slide_ms=None, reducers=()):
+        """Create an aggregator with the fake clock, whose windows are sent
+        by the tests instead of its task.
+        """
+        agg = WindowAggregator(self.send, 'topic', 'summary',
+                               list(reducers), window_ms, slide_ms,
+                               clock=self.clock)
+        # Keeps add() from starting the task which sends the summaries
+        agg._task = self.loop.create_future()
+        return agg
+
+    def test_reducers(self):
+        """Test the reducer operations on a tumbling window.
+        """
+        reducers = [
+            Reducer('all', 'count'),
+            Reducer('defects', 'count', 'defects'),
+            Reducer('types', 'count_by', 'defects.type'),
+            Reducer('total', 'sum', 'defects.area'),
+            Reducer('smallest', 'min', 'defects.area'),
+            Reducer('largest', 'max', 'defects.area'),
+            Reducer('mean', 'mean', 'defects.area'),
+            Reducer('height', 'max', 'height'),
+        ]
+        agg = self.aggregator(1000, reducers=reducers)
+        agg.add({'defects': [{'type': 0, 'area': 4},
+                             {'type': 1, 'area': 'n/a'}]})
+        agg.add({'defects': [{'type': 0, 'area': 2}], 'height': True})
+        agg.add({'defects': []})
+
+        summary = agg.summarize(101000)
+        self.assertEqual(summary, {
+            'topic': 'topic', 'window_start_ms': 100000,
+            'window_end_ms': 101000, 'frames': 3, 'all': 3, 'defects': 3,
+            'types': {'0': 2, '1': 1}, 'total': 6, 'smallest': 2,
+            'largest': 4, 'mean': 3.0, 'height': None,
+        })
+        # The panes of a tumbling window are dropped once it is summarized
+        self.assertIsNone(agg.summarize(102000))
+
+    def test_sliding(self):
+        """Test that sliding windows merge the panes in the window.
+        """
+        agg = self.aggregator(3000, 1000, [Reducer('sum', 'sum', 'v')])
+        for t, v in [(100200, 1), (100900, 2), (101500, 4), (103100, 8)]:
+            self.clock.now = t
+            agg.add({'v': v})
+
+        self.assertEqual(agg.summarize(101000)['sum'], 3)
+        self.assertEqual(agg.summarize(102000)['sum'], 7)
+        self.assertEqual(agg.summarize(103000)['sum'], 7)
+        summary = agg.summarize(104000)
+        self.assertEqual(summary['sum'], 12)
+        self.assertEqual(summary['window_start_ms'], 101000)
+        self.assertEqual(agg.summarize(105000)['frames'], 1)
+        self.assertEqual(agg.summarize(106000)['frames'], 1)
+        self.assertIsNone(agg.summarize(107000))
+        self.assertEqual(len(agg._panes), 0)
+
+    def test_boundaries(self):
+        """Test that frames at the edge of a pane are counted in the window
+        which starts with it.
+        """
+        agg = self.aggregator(100)
+        for t in (100299, 100300, 100399):
+            self.clock.now = t
+            agg.add({})
+
+        self.assertEqual(agg.summarize(100300)['frames'], 1)
+        summary = agg.summarize(100400)
+        self.assertEqual(summary['frames'], 2)
+        self.assertEqual(summary['window_start_ms'], 100300)
+
+    def test_send(self):
+        """Test that a summary is sent at the end of each window.
+        """
+        agg = WindowAggregator(self.send, 'topic', 'summary', [], 50)
+
+        async def run():
+            agg.add({})
+            agg.add({})
+            await asyncio.sleep(0.12)
+            agg.stop()
+
+        self.loop.run_until_complete(run())
+        self.assertEqual(len(self.sent), 1)
+        msg, output_name = self.sent[0]
+        self.assertEqual(output_name, 'summary')
+        self.assertEqual(msg.custom_properties[AGGREGATE_PROPERTY], 'window')
+        self.assertEqual(json.loads(msg.data)['frames'], 2)
+
+    def test_invalid(self):
+        """Test that invalid configurations are rejected.
+        """
+        invalid = [
+            {'az_output_topic': 'a', 'window_ms': 1000, 'slide_ms': 300},
+            {'az_output_topic': 'a', 'window_ms': 1000, 'slide_ms': 2000},
+            {'az_output_topic': 'a', 'reducers': [{'name': 'a', 'op': 'p'}]},
+            {'az_output_topic': 'a', 'reducers': [{'name': 'a', 'op': 'sum'}]},
+            {'az_output_topic': 'a', 'reducers': [{'name': 'frames',
+                                                   'op': 'count'}]},
+            {'az_output_topic': 'a', 'reducers': [{'name': 'a', 'op': 'count'}
+                                                  for _ in range(2)]},
+        ]
+        for conf in invalid:
+            with self.assertRaises(ValueError, msg=conf):
+                WindowAggregator.from_config(None, 'topic', conf)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,326 @@
+# Copyright (c) 2020 Intel Corporation.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM,OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+"""Unit tests for the eab.bridge_state module.
+"""
+import asyncio
+import logging
+import threading
+import unittest
+from eab.bridge_state import BridgeState
+from eab.metrics import BridgeMetrics
+from eab.msgbus import MsgbusContextPool
+
+
+class FakeSubscriber:
+    """Subscriber which never receives a message until it is closed.
+    """
+    def __init__(self, topic):
+        self.topic = topic
+        self.closed = threading.Event()
+
+    def recv(self):
+        self.closed.wait()
+        raise RuntimeError('Subscriber closed')
+
+    def close(self):
+        self.closed.set()
+
+
+class FakeContext:
+    """Message bus context creating fake subscribers.
+    """
+    def __init__(self, config):
+        self.config = config
+
+    def new_subscriber(self, topic):
+        return FakeSubscriber(topic)
+
+
+class FakeBlobClient:
+    """Blob client recording its uploads.
+    """
+    def __init__(self, uploads, blob):
+        self.uploads = uploads
+        self.blob = blob
+
+    def upload_blob(self, data):
+        self.uploads.append(self.blob)
+
+
+class FakeBlobServiceClient:
+    """Blob service client recording the uploaded blobs.
+    """
+    def __init__(self):
+        self.uploads = []
+
+    def get_blob_client(self, container, blob):
+        return FakeBlobClient(self.uploads, blob)
+
+
+class FakeUploadPool:
+    """Upload pool running the uploads right away, until it is shut down.
+    """
+    def __init__(self, loop):
+        self.loop = loop
+        self.closed = False
+
+    async def submit(self, nbytes, fn, *args):
+        if self.closed:
+            raise RuntimeError('Upload pool shut down')
+        fut = self.loop.create_future()
+        fut.set_result(fn(*args))
+        return fut
+
+    def shutdown(self):
+        self.closed = True
+
+
+class FakeEtcdClient:
+    """ETCD client which only records being closed.
+    """
+    def close(self):
+        pass
+
+
+class FakeModuleClient:
+    """IoT Hub module client recording the sent messages until it is
+    disconnected.
+    """
+    def __init__(self):
+        self.connected = True
+        self.sent = []
+
+    async def send_message_to_output(self, msg, output_name):
+        # Takes a while, like a real send
+        await asyncio.sleep(0.01)
+        if not self.connected:
+            raise RuntimeError('Disconnected')
+        self.sent.append((output_name, msg.data))
+
+    async def disconnect(self):
+        self.connected = False
+
+
+TCP_A = {'type': 'zmq_tcp', 'Pub': {'host': 'a', 'port': 1}}
+TCP_B = {'type': 'zmq_tcp', 'Pub': {'host': 'b', 'port': 1}}
+
+
+class TestConfigureTopics(unittest.TestCase):
+    """Unit tests for the topic reconfiguration of the
+    :code:`eab.bridge_state.BridgeState` class.
+    """
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+        # Only the state used by the topics, the singleton constructor
+        # connects to Azure and EII
+        self.bs = BridgeState.__new__(BridgeState)
+        self.bs.log = logging.getLogger(__name__)
+        self.bs.loop = self.loop
+        self.bs.msgbus_ctxs = MsgbusContextPool(FakeContext)
+        self.bs.msgbus_configs = {}
+        self.bs.topics = {}
+        self.bs.bsc = None
+        self.bs.frame_encoder = None
+        self.bs.metrics = None
+
+    def tearDown(self):
+        self.bs._cleanup_msgbus_ctxs()
+        # Let the cancelled listeners finish
+        self.loop.run_until_complete(asyncio.sleep(0))
+        self.loop.close()
+        asyncio.set_event_loop(None)
+
+    def configure(self, topics, msgbus_configs):
+        self.bs._verify_topics(topics, msgbus_configs)
+        self.loop.run_until_complete(
+            self.bs._configure_topics(topics, msgbus_configs))
+
+    def test_diff(self):
+        """Test that only removed topics are stopped and only new topics are
+        started.
+        """
+        self.bs.metrics = BridgeMetrics()
+        msgbus_configs = {'a': TCP_A, 'b': TCP_A, 'c': TCP_B}
+        self.configure({'a': {'az_output_topic': 'a'},
+                        'b': {'az_output_topic': 'b'}}, msgbus_configs)
+        a = self.bs.topics['a']
+        b = self.bs.topics['b']
+        self.assertEqual(len(self.bs.msgbus_ctxs), 1)
+
+        self.configure({'b': {'az_output_topic': 'b'},
+                        'c': {'az_output_topic': 'c'}}, msgbus_configs)
+        self.assertEqual(sorted(self.bs.topics), ['b', 'c'])
+        self.assertTrue(a.subscriber.closed.is_set())
+        self.assertIs(self.bs.topics['b'], b)
+        self.assertFalse(b.subscriber.closed.is_set())
+        self.assertEqual(self.bs.msgbus_configs, {'b': TCP_A, 'c': TCP_B})
+        self.assertEqual(len(self.bs.msgbus_ctxs), 2)
+        # The metrics of the removed topic are no longer exported
+        self.assertNotIn('topic="a"', self.bs.metrics.render())
+        self.assertIn('topic="b"', self.bs.metrics.render())
+
+    def test_restart(self):
+        """Test that a topic is restarted when its message bus configuration
+        or a subscriber setting changes.
+        """
+        topics = {'a': {'az_output_topic': 'a'},
+                  'b': {'az_output_topic': 'b'}}
+        self.configure(topics, {'a': TCP_A, 'b': TCP_A})
+        a = self.bs.topics['a']
+        b = self.bs.topics['b']
+
+        self.configure(
+                {'a': {'az_output_topic': 'a', 'queue_depth': 2},
+                 'b': {'az_output_topic': 'b'}},
+                {'a': TCP_A, 'b': TCP_B})
+        self.assertIsNot(self.bs.topics['a'], a)
+        self.assertTrue(a.subscriber.closed.is_set())
+        self.assertEqual(self.bs.topics['a'].reader.queue_depth, 2)
+        self.assertIsNot(self.bs.topics['b'], b)
+        self.assertTrue(b.subscriber.closed.is_set())
+        self.assertEqual(self.bs.msgbus_configs['b'], TCP_B)
+        self.assertEqual(len(self.bs.msgbus_ctxs), 2)
+
+    def test_update(self):
+        """Test that settings which do not affect the subscription are
+        updated in place.
+        """
+        msgbus_configs = {'a': TCP_A}
+        self.configure({'a': {'az_output_topic': 'a'}}, msgbus_configs)
+        a = self.bs.topics['a']
+
+        self.configure({'a': {'az_output_topic': 'a2', 'max_rate': 1}},
+                       msgbus_configs)
+        self.assertIs(self.bs.topics['a'], a)
+        self.assertFalse(a.subscriber.closed.is_set())
+        self.assertEqual(a.output_name, 'a2')
+        self.assertIsNotNone(a.sampler)
+
+    def test_invalid(self):
+        """Test that an invalid topic is rejected before any running topic
+        is changed.
+        """
+        msgbus_configs = {'a': TCP_A, 'b': TCP_A}
+        self.configure({'a': {'az_output_topic': 'a'}}, msgbus_configs)
+        a = self.bs.topics['a']
+
+        invalid = [
+            ({'az_output_topic': 'b', 'codec': 'unknown'}, ValueError),
+            ({'codec': 'json'}, AssertionError),
+        ]
+        for conf, error in invalid:
+            with self.assertRaises(error):
+                self.configure({'b': conf}, msgbus_configs)
+        with self.assertRaises(RuntimeError):
+            self.configure({'a': {'az_output_topic': 'a'},
+                            'c': {'az_output_topic': 'c'}}, msgbus_configs)
+
+        self.assertEqual(list(self.bs.topics), ['a'])
+        self.assertIs(self.bs.topics['a'], a)
+        self.assertFalse(a.subscriber.closed.is_set())
+
+
+class TestStop(unittest.TestCase):
+    """Unit tests for stopping the :code:`eab.bridge_state.BridgeState`.
+    """
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+        # Only the state used by the topics and stop(), the singleton
+        # constructor connects to Azure and EII
+        self.bs = BridgeState.__new__(BridgeState)
+        self.bs.log = logging.getLogger(__name__)
+        self.bs.loop = self.loop
+        self.bs.msgbus_ctxs = MsgbusContextPool(FakeContext)
+        self.bs.msgbus_configs = {}
+        self.bs.topics = {}
+        self.bs.bsc = FakeBlobServiceClient()
+        self.bs.upload_pool = FakeUploadPool(self.loop)
+        self.bs.module_client = FakeModuleClient()
+        self.bs.etcd = FakeEtcdClient()
+        self.bs.frame_encoder = None
+        self.bs.async_uploader = None
+        self.bs.store_forward = None
+        self.bs.metrics = None
+        self.bs.metrics_server = None
+        self.bs.telemetry_reporter = None
+        self.bs.spool_drainer = None
+        self.bs.config_listener = None
+
+    def tearDown(self):
+        self.loop.close()
+        asyncio.set_event_loop(None)
+
+    def start(self, topic_conf):
+        """Helper to start a topic and wait for its listener to run.
+        """
+        topics = {'a': topic_conf}
+        msgbus_configs = {'a': TCP_A}
+        self.bs._verify_topics(topics, msgbus_configs)
+        self.loop.run_until_complete(
+            self.bs._configure_topics(topics, msgbus_configs))
+        self.loop.run_until_complete(asyncio.sleep(0))
+        return self.bs.topics['a']
+
+    def test_last_pack(self):
+        """Test that the last partly filled pack is uploaded before the
+        upload pool is shut down.
+        """
+        topic = self.start({'az_output_topic': 'a',
+                            'az_blob_container_name': 'frames',
+                            'pack': {'max_frames': 10}})
+        self.loop.run_until_complete(topic.packer.add('img', b'frame'))
+        self.assertEqual(self.bs.bsc.uploads, [])
+
+        self.bs.stop()
+        self.assertEqual(len(self.bs.bsc.uploads), 2)
+        self.assertTrue(self.bs.upload_pool.closed)
+
+    def test_last_batch(self):
+        """Test that the last partial batch is sent before disconnecting.
+        """
+        topic = self.start({'az_output_topic': 'a',
+                            'batch': {'max_count': 10}})
+        self.loop.run_until_complete(topic.batcher.add('{"i": 0}'))
+        self.assertEqual(self.bs.module_client.sent, [])
+
+        self.bs.stop()
+        self.assertEqual(self.bs.module_client.sent, [('a', '[{"i": 0}]')])
+        self.assertFalse(self.bs.module_client.connected)
+
+    def test_replaced_batch(self):
+        """Test that the batch of a batcher replaced just before stopping is
+        sent before disconnecting.
+        """
+        topic = self.start({'az_output_topic': 'a',
+                            'batch': {'max_count': 10}})
+        self.loop.run_until_complete(topic.batcher.add('{"i": 0}'))
+        # Flushes the previous batcher in the background
+        topic.update({'az_output_topic': 'b', 'batch': {'max_count': 10}})
+
+        self.bs.stop()
+        self.assertEqual(self.bs.module_client.sent, [('a', '[{"i": 0}]')])
+
+
+if __name__ == '__main__':
+    unittest.main()
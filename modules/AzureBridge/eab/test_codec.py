@@ -0,0 +1,126 @@
+# Copyright (c) 2020 Intel Corporation.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM,OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+"""Unit tests for the eab.codec module.
+"""
+import gzip
+import json
+import zlib
+import asyncio
+import importlib.util
+import unittest
+from eab.batcher import OutputBatcher, BATCH_PROPERTY
+from eab.codec import *
+
+HAS_MSGPACK = importlib.util.find_spec('msgpack') is not None
+HAS_CBOR = importlib.util.find_spec('cbor2') is not None
+
+META = {'img_handle': 'abc', 'defects': [{'type': 1, 'tl': [1, 2]}]}
+
+
+class TestCodecs(unittest.TestCase):
+    """Unit tests for the :code:`eab.codec` module.
+    """
+    def check_codec(self, name, decode):
+        """Check that single objects and arrays of a codec decode again and
+        that its messages are batched with the codec's properties.
+        """
+        codec = get_codec(name)
+        self.assertEqual(decode(codec.encode(META)), META)
+
+        # Array header sizes of the binary codecs change at these lengths
+        for n in (0, 1, 23, 24, 255, 256):
+            items = [codec.encode({'i': i}) for i in range(n)]
+            self.assertEqual(decode(codec.encode_batch(items)),
+                             [{'i': i} for i in range(n)])
+
+        sent = []
+
+        async def send(msg, output_name):
+            sent.append(msg)
+
+        batcher = OutputBatcher(send, 'out', 2, 1024, 1000, codec)
+        loop = asyncio.new_event_loop()
+        try:
+            for i in range(2):
+                loop.run_until_complete(batcher.add(codec.encode({'i': i})))
+        finally:
+            loop.close()
+
+        self.assertEqual(len(sent), 1)
+        msg = sent[0]
+        self.assertEqual(msg.content_type, codec.content_type)
+        self.assertEqual(msg.content_encoding, codec.content_encoding)
+        self.assertEqual(msg.custom_properties[BATCH_PROPERTY],
+                         codec.batch_format)
+        self.assertEqual(decode(msg.data), [{'i': 0}, {'i': 1}])
+
+    def test_json(self):
+        """Test the JSON codec.
+        """
+        self.check_codec('json', json.loads)
+
+    @unittest.skipUnless(HAS_MSGPACK, 'msgpack is not installed')
+    def test_msgpack(self):
+        """Test the MessagePack codec.
+        """
+        import msgpack
+        self.check_codec('msgpack', msgpack.unpackb)
+
+    @unittest.skipUnless(HAS_CBOR, 'cbor2 is not installed')
+    def test_cbor(self):
+        """Test the CBOR codec.
+        """
+        import cbor2
+        self.check_codec('cbor', cbor2.loads)
+
+    def test_unknown(self):
+        """Test that unknown codecs are rejected.
+        """
+        with self.assertRaises(ValueError):
+            get_codec('xml')
+
+
+class TestCompressor(unittest.TestCase):
+    """Unit tests for the :code:`eab.codec.Compressor` class.
+    """
+    def test_compress(self):
+        """Test that only bodies over the threshold are compressed and marked
+        with the algorithm as their content encoding.
+        """
+        codec = get_codec('json')
+        body = codec.encode([META] * 20)
+
+        for algorithm, decompress in ((COMPRESS_GZIP, gzip.decompress),
+                                      (COMPRESS_DEFLATE, zlib.decompress)):
+            compressor = Compressor(algorithm, min_bytes=len(body))
+            msg = make_message(codec, body, compressor)
+            self.assertEqual(msg.content_encoding, algorithm)
+            self.assertLess(len(msg.data), len(body))
+            self.assertEqual(json.loads(decompress(msg.data)), [META] * 20)
+
+            msg = make_message(codec, body[:-1], compressor)
+            self.assertEqual(msg.content_encoding, codec.content_encoding)
+            self.assertEqual(msg.data, body[:-1])
+
+    def test_unknown(self):
+        """Test that unknown algorithms are rejected.
+        """
+        with self.assertRaises(ValueError):
+            Compressor.from_config({'algorithm': 'lz4'})
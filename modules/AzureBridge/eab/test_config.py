@@ -20,6 +20,7 @@
 """Unit tests for utility functions in the eab.config module.
 """
 import os
+import asyncio
 import unittest
 from dictdiffer import diff
 from eab.config import *
@@ -136,6 +137,101 @@ class TestConfigUtils(unittest.TestCase):
         self.assertEqual(changed_keys, ['dict'])
         self.assertEqual(removed_keys, ['dict2'])
 
+        # Test added top level key and key order independence
+        changed = dict(reversed(list(base.items())))
+        changed['added'] = {'nested_test': 'test'}
+        changed_keys, removed_keys = find_root_changes(base, changed)
+        self.assertEqual(changed_keys, ['added'])
+        self.assertEqual(removed_keys, [])
+
+    def test_merge_patches(self):
+        """Test the :code:`eab.config.merge_patches()` utility function.
+        """
+        orig = {
+            'log_level': 'INFO',
+            'topics': {
+                'a': {'az_output_topic': 'a'},
+                'b': {'az_output_topic': 'b'},
+            },
+            'eii_config': '{}'
+        }
+        new = {
+            'log_level': 'DEBUG',
+            'topics': {
+                'a': {'az_blob_container_name': 'a'},
+                'b': None,
+            }
+        }
+        merged = merge_patches(orig, new)
+        self.assertEqual(merged, {
+            'log_level': 'DEBUG',
+            'topics': {
+                'a': {'az_output_topic': 'a', 'az_blob_container_name': 'a'},
+                'b': None,
+            },
+            'eii_config': '{}'
+        })
+
+        # Original patch must not be modified
+        self.assertEqual(orig['topics']['b'], {'az_output_topic': 'b'})
+
+    def test_patch_coalescer(self):
+        """Test that the :code:`eab.config.PatchCoalescer` merges patches
+        which arrive within its window.
+        """
+        async def run():
+            coalescer = PatchCoalescer(50)
+            coalescer.add({'log_level': 'INFO', 'eii_config': '{}'})
+            await asyncio.sleep(0.02)
+            coalescer.add({'log_level': 'DEBUG'})
+
+            patch, count = await coalescer.get()
+            self.assertEqual(patch, {'log_level': 'DEBUG', 'eii_config': '{}'})
+            self.assertEqual(count, 2)
+
+            # Nothing is handed out until the next patch arrives
+            waiter = asyncio.ensure_future(coalescer.get())
+            await asyncio.sleep(0.1)
+            self.assertFalse(waiter.done())
+            coalescer.add({'log_level': 'WARN'})
+            self.assertEqual(await waiter, ({'log_level': 'WARN'}, 1))
+
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(run())
+        finally:
+            loop.close()
+
+    def test_patch_coalescer_full_config(self):
+        """Test that a full configuration replaces the waiting patch, so
+        that the topics and keys it dropped are deleted.
+        """
+        first = {
+            'topics': {
+                'a': {'az_output_topic': 'a', 'batch': {'max_count': 10}},
+                'b': {'az_output_topic': 'b'},
+            },
+            'eii_config': '{}',
+        }
+        second = {
+            'topics': {'a': {'az_output_topic': 'a'}},
+            'eii_config': '{}',
+        }
+
+        async def run():
+            coalescer = PatchCoalescer(20)
+            coalescer.add(first)
+            coalescer.add(second)
+            return await coalescer.get()
+
+        loop = asyncio.new_event_loop()
+        try:
+            patch, count = loop.run_until_complete(run())
+        finally:
+            loop.close()
+        self.assertEqual(patch, second)
+        self.assertEqual(count, 2)
+
     def test_get_msgbus_config(self):
         """Test the :code:`eab.config.get_msgbus_config()` method.
         """
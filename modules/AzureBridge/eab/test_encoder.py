@@ -0,0 +1,90 @@
+# Copyright (c) 2020 Intel Corporation.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM,OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+"""Unit tests for the eab.encoder module.
+"""
+import asyncio
+import importlib.util
+import unittest
+from eab.encoder import *
+
+HAS_CV2 = importlib.util.find_spec('cv2') is not None
+HAS_ZSTD = importlib.util.find_spec('zstandard') is not None
+
+
+class TestEncoder(unittest.TestCase):
+    """Unit tests for the :code:`eab.encoder` module.
+    """
+    def test_check_encoding(self):
+        """Test verifying encodings and levels.
+        """
+        with self.assertRaises(ValueError):
+            check_encoding('gif')
+        with self.assertRaises(ValueError):
+            check_encoding(ENCODE_PNG, 10)
+
+    @unittest.skipUnless(HAS_ZSTD, 'zstandard is not installed')
+    def test_encode_zstd(self):
+        """Test that zstd compressed frames can be decompressed.
+        """
+        import zstandard
+        blob = bytes(range(256)) * 12
+        encoded = encode_frame(blob, 32, 32, 3, ENCODE_ZSTD, 3)
+        self.assertLess(len(encoded), len(blob))
+        decoded = zstandard.ZstdDecompressor().decompress(encoded)
+        self.assertEqual(decoded, blob)
+
+    @unittest.skipUnless(HAS_CV2, 'cv2 is not installed')
+    def test_encode_png(self):
+        """Test that PNG encoded frames decode to the raw frame.
+        """
+        import cv2
+        import numpy as np
+        blob = bytes(range(256)) * 12
+        encoded = encode_frame(blob, 32, 32, 3, ENCODE_PNG, 3)
+        frame = cv2.imdecode(np.frombuffer(encoded, np.uint8),
+                             cv2.IMREAD_UNCHANGED)
+        self.assertEqual(frame.shape, (32, 32, 3))
+        self.assertEqual(frame.tobytes(), blob)
+
+    @unittest.skipUnless(HAS_ZSTD, 'zstandard is not installed')
+    def test_encode_all(self):
+        """Test that only raw frames are encoded and their meta-data is
+        updated.
+        """
+        loop = asyncio.new_event_loop()
+        encoder = FrameEncoder(1)
+        blob = bytes(1024)
+        frames = [
+            ({'img_handle': 'a', 'width': 32, 'height': 32}, blob),
+            ({'img_handle': 'b', 'encoding_type': 'jpeg'}, blob),
+            ({'img_handle': 'c'}, None),
+        ]
+        try:
+            frames = loop.run_until_complete(
+                encoder.encode_all(frames, ENCODE_ZSTD))
+        finally:
+            encoder.shutdown()
+            loop.close()
+
+        self.assertEqual(frames[0][0]['encoding_type'], ENCODE_ZSTD)
+        self.assertEqual(frames[0][0]['encoding_level'], 3)
+        self.assertLess(len(frames[0][1]), len(blob))
+        self.assertIs(frames[1][1], blob)
+        self.assertIsNone(frames[2][1])
@@ -0,0 +1,226 @@
+# Copyright (c) 2020 Intel Corporation.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM,OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+"""Unit tests for the eab.etcd_client module.
+"""
+import os
+import json
+import unittest
+from types import SimpleNamespace
+from etcd3.events import PutEvent, DeleteEvent
+from eab.config import config_hash
+from eab.etcd_client import EtcdClient
+
+
+def make_event(cls, key, value=b''):
+    """Create an ETCD watch event.
+    """
+    return cls(SimpleNamespace(kv=SimpleNamespace(key=key, value=value)))
+
+
+class FakeTransactions:
+    """Builder of the operations of a fake ETCD transaction.
+    """
+    def put(self, key, value):
+        return ('put', key.encode('utf-8'), value.encode('utf-8'))
+
+    def delete(self, key):
+        return ('delete', key.encode('utf-8'))
+
+
+class FakeEtcd3Client:
+    """ETCD client keeping the keys in memory and recording the
+    transactions applied to them.
+    """
+    def __init__(self):
+        self.transactions = FakeTransactions()
+        self.data = {}
+        self.txns = []
+        self.reads = 0
+        self.watches = {}
+        self.next_watch_id = 0
+        self.closed = False
+
+    def status(self):
+        if self.closed:
+            raise RuntimeError('Client closed')
+
+    def transaction(self, compare, success, failure):
+        self.txns.append(success)
+        for op in success:
+            if op[0] == 'put':
+                self.data[op[1]] = op[2]
+            else:
+                self.data.pop(op[1], None)
+
+    def get_prefix(self, key_prefix):
+        self.reads += 1
+        for key, value in sorted(self.data.items()):
+            if key.startswith(key_prefix):
+                yield value, SimpleNamespace(key=key)
+
+    def add_watch_callback(self, key, callback, range_end=None):
+        self.next_watch_id += 1
+        self.watches[self.next_watch_id] = (key, range_end, callback)
+        return self.next_watch_id
+
+    def cancel_watch(self, watch_id):
+        del self.watches[watch_id]
+
+    def close(self):
+        self.closed = True
+
+    def notify(self, resp):
+        """Call the watch callbacks with a response or an exception.
+        """
+        for _, _, callback in list(self.watches.values()):
+            callback(resp)
+
+
+class TestEtcdClient(unittest.TestCase):
+    """Unit tests for the :code:`eab.etcd_client.EtcdClient` class.
+    """
+    def setUp(self):
+        self.fake = FakeEtcd3Client()
+
+    def make_client(self, prefix='', **kwargs):
+        """Helper to create a client connected to the fake ETCD client.
+        """
+        saved = os.environ.get('ETCD_PREFIX')
+        os.environ['ETCD_PREFIX'] = prefix
+        try:
+            client = EtcdClient(True, **kwargs)
+        finally:
+            if saved is None:
+                del os.environ['ETCD_PREFIX']
+            else:
+                os.environ['ETCD_PREFIX'] = saved
+        client._client = self.fake
+        return client
+
+    def test_apply_op_limit(self):
+        """Test that transactions are split at exactly the operation limit.
+        """
+        client = self.make_client(max_txn_ops=3)
+        puts = {f'/App{i}/config': {'i': i} for i in range(3)}
+        self.assertEqual(client.apply(puts, []), 1)
+        self.assertEqual([len(txn) for txn in self.fake.txns], [3])
+
+        puts['/App3/config'] = {'i': 3}
+        self.assertEqual(client.apply(puts, []), 2)
+        self.assertEqual([len(txn) for txn in self.fake.txns[1:]], [3, 1])
+        self.assertEqual(len(self.fake.data), 4)
+
+    def test_apply_byte_limit(self):
+        """Test that a key larger than the size limit is written in a
+        transaction of its own.
+        """
+        client = self.make_client(max_txn_bytes=100)
+        puts = {
+            '/App1/config': {},
+            '/App2/config': {'data': 'x' * 200},
+            '/App3/config': {},
+        }
+        self.assertEqual(client.apply(puts, []), 3)
+        self.assertEqual([[op[1] for op in txn] for txn in self.fake.txns],
+                         [[b'/App1/config'], [b'/App2/config'],
+                          [b'/App3/config']])
+        self.assertEqual(
+                json.loads(self.fake.data[b'/App2/config'].decode('utf-8')),
+                {'data': 'x' * 200})
+
+    def test_apply_deletes(self):
+        """Test that deletes are chunked along with the puts.
+        """
+        client = self.make_client(max_txn_ops=2)
+        for key in ('/App3/config', '/App4/config', '/App5/config'):
+            self.fake.data[key.encode('utf-8')] = b'{}'
+
+        num_txns = client.apply(
+                {'/App1/config': {}, '/App2/config': {}},
+                ['/App3/config', '/App4/config', '/App5/config'])
+        self.assertEqual(num_txns, 3)
+        self.assertEqual([[op[0] for op in txn] for txn in self.fake.txns],
+                         [['put', 'put'], ['delete', 'delete'], ['delete']])
+        self.assertEqual(sorted(self.fake.data),
+                         [b'/App1/config', b'/App2/config'])
+
+    def test_hash_cache(self):
+        """Test that the hashes of the keys under the prefix are read once
+        and kept up to date by the watch.
+        """
+        self.fake.data = {
+            b'/eii/App1/config': b'{"a": 1}',
+            b'/eii/App2/config': b'{"b": 2}',
+            b'/other/App3/config': b'{}',
+        }
+        client = self.make_client('/eii')
+        hashes = client.get_config_hashes()
+        self.assertEqual(hashes, {'/App1/config': config_hash({'a': 1}),
+                                  '/App2/config': config_hash({'b': 2})})
+        [(key, range_end, _)] = self.fake.watches.values()
+        self.assertEqual((key, range_end), (b'/eii/', b'/eii0'))
+
+        self.fake.notify(SimpleNamespace(events=[
+            make_event(PutEvent, b'/eii/App1/config', b'{"a": 3}'),
+            make_event(DeleteEvent, b'/eii/App2/config'),
+            # Outside of the prefix
+            make_event(PutEvent, b'/other/App3/config', b'{}'),
+        ]))
+        client.apply({'/App4/config': {'d': 4}}, [])
+        self.assertEqual(client.get_config_hashes(),
+                         {'/App1/config': config_hash({'a': 3}),
+                          '/App4/config': config_hash({'d': 4})})
+        self.assertEqual(self.fake.reads, 1)
+
+    def test_watch_failure(self):
+        """Test that the cache is read again after the watch failed.
+        """
+        self.fake.data = {b'/App1/config': b'{"a": 1}'}
+        client = self.make_client()
+        client.get_config_hashes()
+
+        self.fake.notify(RuntimeError('Watch failed'))
+        self.fake.data[b'/App1/config'] = b'{"a": 2}'
+        self.assertEqual(client.get_config_hashes(),
+                         {'/App1/config': config_hash({'a': 2})})
+        self.assertEqual(self.fake.reads, 2)
+
+    def test_close(self):
+        """Test that closing the client cancels the watch and drops the
+        cache.
+        """
+        self.fake.data = {b'/App1/config': b'{}'}
+        client = self.make_client()
+        client.get_config_hashes()
+        self.assertEqual(len(self.fake.watches), 1)
+
+        client.close()
+        self.assertEqual(self.fake.watches, {})
+        self.assertTrue(self.fake.closed)
+
+        self.fake = FakeEtcd3Client()
+        self.fake.data = {b'/App2/config': b'{}'}
+        client._client = self.fake
+        self.assertEqual(list(client.get_config_hashes()), ['/App2/config'])
+        self.assertEqual(len(self.fake.watches), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
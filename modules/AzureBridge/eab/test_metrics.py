@@ -0,0 +1,133 @@
+# Copyright (c) 2020 Intel Corporation.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM,OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+"""Unit tests for the eab.metrics module.
+"""
+import asyncio
+import unittest
+from eab.metrics import BridgeMetrics, Histogram, MetricsServer
+
+
+class TestMetrics(unittest.TestCase):
+    """Unit tests for the :code:`eab.metrics` module.
+    """
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+    def tearDown(self):
+        self.loop.close()
+        asyncio.set_event_loop(None)
+
+    def test_histogram(self):
+        """Test that histogram buckets are rendered cumulatively.
+        """
+        hist = Histogram('latency', 'Latency', ('topic',), (0.1, 1))
+        child = hist.labels('a"b')
+        for value in (0.05, 0.1, 0.5, 3):
+            child.observe(value)
+        self.assertEqual(hist.render()[2:], [
+            'latency_bucket{topic="a\\"b",le="0.1"} 2',
+            'latency_bucket{topic="a\\"b",le="1"} 3',
+            'latency_bucket{topic="a\\"b",le="+Inf"} 4',
+            'latency_sum{topic="a\\"b"} 3.65',
+            'latency_count{topic="a\\"b"} 4',
+        ])
+
+    def test_topic(self):
+        """Test recording the metrics of a topic.
+        """
+        metrics = BridgeMetrics()
+        topic = metrics.topic('camera1')
+        self.assertIs(metrics.topic('camera1'), topic)
+        topic.received.inc(3)
+        topic.filtered.inc()
+
+        done = self.loop.create_future()
+        done.set_result(True)
+        topic.upload_done(1024, 0, done)
+        failed = self.loop.create_future()
+        failed.set_exception(RuntimeError('failed'))
+        topic.upload_done(1024, 0, failed)
+        # Stored in the spool instead of being uploaded
+        spooled = self.loop.create_future()
+        spooled.set_result(False)
+        topic.upload_done(1024, 0, spooled)
+
+        text = metrics.render()
+        self.assertIn('eab_messages_received_total{topic="camera1"} 3\n',
+                      text)
+        self.assertIn('eab_messages_dropped_total{topic="camera1",'
+                      'reason="filter"} 1\n', text)
+        self.assertIn('eab_blob_uploaded_bytes_total{topic="camera1"} '
+                      '1024\n', text)
+        self.assertIn('eab_errors_total{topic="camera1",kind="upload"} 1\n',
+                      text)
+        self.assertIn('# TYPE eab_upload_latency_seconds histogram\n', text)
+        self.assertIn('eab_blob_uploads_total{topic="camera1"} 1\n', text)
+
+    def test_remove_topic(self):
+        """Test that the metrics of a removed topic are no longer exported.
+        """
+        metrics = BridgeMetrics()
+        topics = [metrics.topic(name) for name in ('camera1', 'camera2')]
+        for topic in topics:
+            topic.received.inc()
+            topic.sampled.inc()
+            topic.forward_latency.observe(0.01)
+            topic.record_error('send', RuntimeError('failed'))
+
+        metrics.remove_topic('camera1')
+        text = metrics.render()
+        self.assertNotIn('camera1', text)
+        self.assertIn('eab_errors_total{topic="camera2",kind="send"} 1\n',
+                      text)
+        self.assertIsNot(metrics.topic('camera1'), topics[0])
+
+    def test_server(self):
+        """Test scraping the metrics endpoint.
+        """
+        metrics = BridgeMetrics()
+        metrics.topic('camera1').forwarded.inc()
+        server = MetricsServer(metrics, 0, '127.0.0.1')
+
+        async def get(path):
+            port = server._server.sockets[0].getsockname()[1]
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            writer.write(f'GET {path} HTTP/1.1\r\nHost: x\r\n\r\n'.encode())
+            response = await reader.read()
+            writer.close()
+            return response.decode()
+
+        async def run():
+            await server.start()
+            try:
+                return await get('/metrics'), await get('/')
+            finally:
+                server.close()
+
+        found, missing = self.loop.run_until_complete(run())
+        self.assertTrue(found.startswith('HTTP/1.0 200 OK\r\n'))
+        self.assertIn('eab_messages_forwarded_total{topic="camera1"} 1',
+                      found)
+        self.assertTrue(missing.startswith('HTTP/1.0 404'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,116 @@
+# Copyright (c) 2020 Intel Corporation.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM,OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+"""Unit tests for the eab.msgbus module.
+"""
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from eab.msgbus import MsgbusContextPool
+
+
+class FakeContext:
+    """Message bus context recording its configuration and subscribers.
+    """
+    def __init__(self, config):
+        # Takes a while to connect, like a real context
+        time.sleep(0.05)
+        self.config = config
+        self.topics = []
+
+    def new_subscriber(self, topic):
+        if topic == 'missing':
+            raise RuntimeError('Unknown topic')
+        self.topics.append(topic)
+        return topic
+
+
+class TestMsgbusContextPool(unittest.TestCase):
+    """Unit tests for the :code:`eab.msgbus.MsgbusContextPool` class.
+    """
+    def setUp(self):
+        self.created = []
+        self.pool = MsgbusContextPool(self.factory)
+
+    def factory(self, config):
+        if config.get('fail'):
+            raise RuntimeError('Failed to connect')
+        ctx = FakeContext(config)
+        self.created.append(ctx)
+        return ctx
+
+    def test_shared(self):
+        """Test that topics on the same endpoint share one context, which is
+        dropped with its last reference.
+        """
+        a = {'type': 'zmq_tcp', 'Pub': {'host': 'a', 'port': 1}}
+        b = {'type': 'zmq_tcp', 'Pub': {'host': 'b', 'port': 1}}
+        ctx_a = self.pool.acquire(a)
+        # Equal configurations share the context whatever their key order
+        self.assertIs(self.pool.acquire(dict(reversed(list(a.items())))),
+                      ctx_a)
+        self.assertIsNot(self.pool.acquire(b), ctx_a)
+        self.assertEqual(len(self.created), 2)
+        self.assertEqual(self.pool.refs(a), 2)
+
+        self.assertFalse(self.pool.release(a))
+        self.assertEqual(len(self.pool), 2)
+        self.assertTrue(self.pool.release(a))
+        self.assertEqual(len(self.pool), 1)
+        self.assertFalse(self.pool.release(a))
+
+        # A new context is created once the previous one was dropped
+        self.assertIsNot(self.pool.acquire(a), ctx_a)
+
+        self.pool.clear()
+        self.assertEqual(len(self.pool), 0)
+
+    def test_failure(self):
+        """Test that a context which fails to be created holds no reference.
+        """
+        config = {'type': 'zmq_ipc', 'fail': True}
+        with self.assertRaises(RuntimeError):
+            self.pool.acquire(config)
+        self.assertEqual(self.pool.refs(config), 0)
+        self.assertEqual(len(self.pool), 0)
+
+        config = {'type': 'zmq_ipc'}
+        self.pool.new_subscriber(config, 'a')
+        with self.assertRaises(RuntimeError):
+            self.pool.new_subscriber(config, 'missing')
+        self.assertEqual(self.pool.refs(config), 1)
+
+    def test_concurrent(self):
+        """Test that topics subscribing concurrently create one context per
+        endpoint.
+        """
+        configs = [{'type': 'zmq_tcp', 'Pub': {'port': i % 2}}
+                   for i in range(8)]
+        with ThreadPoolExecutor(8) as executor:
+            subscribers = list(executor.map(
+                self.pool.new_subscriber, configs,
+                [f'topic{i}' for i in range(8)]))
+        self.assertEqual(len(subscribers), 8)
+        self.assertEqual(len(self.created), 2)
+        self.assertEqual(sorted(len(ctx.topics) for ctx in self.created),
+                         [4, 4])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+# Copyright (c) 2020 Intel Corporation.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM,OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+"""Unit tests for the eab.packer module.
+"""
+import json
+import asyncio
+import unittest
+from eab.packer import FramePacker
+
+
+class TestFramePacker(unittest.TestCase):
+    """Unit tests for the :code:`eab.packer.FramePacker` class.
+    """
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.uploads = {}
+
+    def tearDown(self):
+        self.loop.close()
+        asyncio.set_event_loop(None)
+
+    async def upload(self, container_name, blob_name, data):
+        """Record an upload and return a completed future for it.
+        """
+        self.uploads[blob_name] = data
+        fut = self.loop.create_future()
+        fut.set_result(None)
+        return fut
+
+    def test_pack(self):
+        """Test that frames are packed, indexed and can be found with their
+        pointers.
+        """
+        packer = FramePacker(self.upload, 'container', 3, 1024, 1000)
+        frames = {'a': b'111', 'b': b'22', 'c': b'3333', 'd': b'4'}
+
+        async def run():
+            pointers = {}
+            for img_handle, blob in frames.items():
+                pointers[img_handle] = await packer.add(img_handle, blob)
+            # The first pack is full, the second only holds 'd'
+            self.assertEqual(sorted(self.uploads),
+                             ['a.pack', 'a.pack.idx.json'])
+            await packer.flush()
+            return pointers
+
+        pointers = self.loop.run_until_complete(run())
+        self.assertEqual(pointers['d'],
+                         {'blob': 'd.pack', 'offset': 0, 'length': 1})
+
+        for img_handle, blob in frames.items():
+            pointer = pointers[img_handle]
+            data = self.uploads[pointer['blob']]
+            start = pointer['offset']
+            self.assertEqual(data[start:start + pointer['length']], blob)
+
+            index = json.loads(self.uploads[pointer['blob'] + '.idx.json'])
+            self.assertEqual(index[img_handle],
+                             [pointer['offset'], pointer['length']])
+
+    def test_max_bytes(self):
+        """Test that a pack is uploaded before a frame would take it over its
+        maximum size.
+        """
+        packer = FramePacker(self.upload, 'container', 100, 10, 1000)
+
+        async def run():
+            await packer.add('a', bytes(6))
+            pointer = await packer.add('b', bytes(6))
+            self.assertEqual(pointer['blob'], 'b.pack')
+            self.assertEqual(len(self.uploads['a.pack']), 6)
+            await packer.flush()
+
+        self.loop.run_until_complete(run())
+
+    def test_linger(self):
+        """Test that a pack is uploaded once it waited for the linger time.
+        """
+        packer = FramePacker(self.upload, 'container', 100, 1024, 10)
+
+        async def run():
+            await packer.add('a', b'1')
+            self.assertEqual(self.uploads, {})
+            await asyncio.sleep(0.1)
+            self.assertIn('a.pack', self.uploads)
+
+        self.loop.run_until_complete(run())
@@ -0,0 +1,89 @@
+# Copyright (c) 2020 Intel Corporation.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM,OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+"""Unit tests for the eab.projection module.
+"""
+import unittest
+from eab.projection import MetadataSpec
+
+META = {
+    'img_handle': 'abc',
+    'height': 1080,
+    'width': 1920,
+    'defects': [
+        {'type': 0, 'tl': [1, 2], 'br': [3, 4]},
+        {'type': 1, 'tl': [5, 6], 'br': [7, 8]},
+    ],
+    'gva_meta': {'objects': 2, 'model': 'person'},
+}
+
+
+class TestMetadataSpec(unittest.TestCase):
+    """Unit tests for the :code:`eab.projection.MetadataSpec` class.
+    """
+    def test_include(self):
+        """Test keeping only the included fields, also inside lists.
+        """
+        spec = MetadataSpec(include=['img_handle', 'defects.type',
+                                     'gva_meta', 'gva_meta.model'])
+        self.assertEqual(spec.project(META), {
+            'img_handle': 'abc',
+            'defects': [{'type': 0}, {'type': 1}],
+            'gva_meta': {'objects': 2, 'model': 'person'},
+        })
+
+    def test_exclude(self):
+        """Test removing the excluded fields without changing the input.
+        """
+        spec = MetadataSpec(exclude=['height', 'width', 'defects.tl',
+                                     'defects.br', 'missing.field'])
+        self.assertEqual(spec.project(META), {
+            'img_handle': 'abc',
+            'defects': [{'type': 0}, {'type': 1}],
+            'gva_meta': {'objects': 2, 'model': 'person'},
+        })
+        self.assertIn('tl', META['defects'][0])
+
+    def test_filter(self):
+        """Test that messages must match every predicate.
+        """
+        def matches(*filters):
+            return MetadataSpec(filters=list(filters)).matches(META)
+
+        self.assertTrue(matches({'field': 'defects', 'op': 'non_empty'}))
+        self.assertFalse(matches({'field': 'missing', 'op': 'non_empty'}))
+        self.assertTrue(matches({'field': 'gva_meta.objects', 'op': 'ge',
+                                 'value': 2}))
+        self.assertFalse(matches({'field': 'img_handle', 'op': 'gt',
+                                  'value': 1}))
+        self.assertTrue(matches({'field': 'gva_meta.model', 'op': 'in',
+                                 'value': ['person', 'car']}))
+        self.assertFalse(matches({'field': 'img_handle', 'op': 'exists'},
+                                 {'field': 'width', 'op': 'lt',
+                                  'value': 100}))
+
+    def test_invalid(self):
+        """Test that invalid specs are rejected when they are compiled.
+        """
+        with self.assertRaises(ValueError):
+            MetadataSpec(include=['a..b'])
+        with self.assertRaises(ValueError):
+            MetadataSpec(filters=[{'field': 'a', 'op': 'like'}])
+        with self.assertRaises(ValueError):
+            MetadataSpec(filters=[{'field': 'a', 'op': 'eq'}])
@@ -0,0 +1,94 @@
+# Copyright (c) 2020 Intel Corporation.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM,OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+"""Unit tests for the eab.receiver module.
+"""
+import asyncio
+import queue
+import unittest
+from eab.receiver import SubscriberReader
+
+
+class MockSubscriber:
+    """Mock EII Message Bus subscriber which returns the messages put into
+    its queue.
+    """
+    def __init__(self):
+        """Constructor.
+        """
+        self.msgs = queue.Queue()
+        self.recv_count = 0
+
+    def recv(self):
+        """Mocked :code:`recv()` method.
+        """
+        msg = self.msgs.get()
+        if isinstance(msg, Exception):
+            raise msg
+        self.recv_count += 1
+        return msg
+
+
+class TestSubscriberReader(unittest.TestCase):
+    """Unit tests for the :code:`eab.receiver.SubscriberReader` class.
+    """
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+    def tearDown(self):
+        self.loop.close()
+        asyncio.set_event_loop(None)
+
+    def test_recv_batches(self):
+        """Test that all ready messages are returned in order and that the
+        reader stops receiving once its queue is full.
+        """
+        sub = MockSubscriber()
+        for i in range(5):
+            sub.msgs.put(i)
+        reader = SubscriberReader(sub, 'test', 3, self.loop)
+        reader.start()
+
+        async def run():
+            # Give the reader thread time to fill the queue
+            await asyncio.sleep(0.1)
+            self.assertEqual(sub.recv_count, 3)
+            self.assertEqual(await reader.recv(), [0, 1, 2])
+            self.assertEqual(len(reader.recv_times), 3)
+            self.assertEqual(reader.recv_times, sorted(reader.recv_times))
+            await asyncio.sleep(0.1)
+            self.assertEqual(await reader.recv(max_msgs=1), [3])
+            self.assertEqual(await reader.recv(), [4])
+
+        self.loop.run_until_complete(run())
+        reader.stop()
+        sub.msgs.put(RuntimeError('closed'))
+
+    def test_recv_error(self):
+        """Test that an error from the subscriber is raised by
+        :code:`recv()`.
+        """
+        sub = MockSubscriber()
+        sub.msgs.put(RuntimeError('recv failed'))
+        reader = SubscriberReader(sub, 'test', 2, self.loop)
+        reader.start()
+
+        with self.assertRaises(RuntimeError):
+            self.loop.run_until_complete(reader.recv())
@@ -0,0 +1,79 @@
+# Copyright (c) 2020 Intel Corporation.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM,OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+"""Unit tests for the eab.sampler module.
+"""
+import unittest
+from eab.sampler import TokenBucket, TopicSampler
+
+
+class FakeClock:
+    """Clock which only moves when it is told to.
+    """
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestSampler(unittest.TestCase):
+    """Unit tests for the :code:`eab.sampler` module.
+    """
+    def test_token_bucket(self):
+        """Test that the token bucket allows a burst and then the rate.
+        """
+        clock = FakeClock()
+        bucket = TokenBucket(2, clock=clock)
+        self.assertEqual([bucket.take() for _ in range(3)],
+                         [True, True, False])
+        clock.now += 0.5
+        self.assertEqual([bucket.take() for _ in range(2)], [True, False])
+        # Tokens do not accumulate past the burst size
+        clock.now += 10
+        self.assertEqual(sum(bucket.take() for _ in range(5)), 2)
+
+    def test_every_nth(self):
+        """Test forwarding every N-th message.
+        """
+        sampler = TopicSampler(every_nth=3)
+        accepted = [i for i in range(9) if sampler.accept()]
+        self.assertEqual(accepted, [0, 3, 6])
+        self.assertEqual(sampler.dropped, 6)
+
+    def test_blob_ratio(self):
+        """Test that the blob ratio is applied evenly to forwarded messages.
+        """
+        sampler = TopicSampler(blob_ratio=0.1)
+        frames = [({'i': i}, b'blob') for i in range(30)]
+        sampled = sampler.sample(frames)
+        self.assertEqual(len(sampled), 30)
+        uploaded = [meta['i'] for meta, blob in sampled if blob is not None]
+        self.assertEqual(uploaded, [9, 19, 29])
+
+        sampler = TopicSampler(blob_ratio=0)
+        self.assertTrue(all(blob is None
+                            for _, blob in sampler.sample(frames)))
+
+    def test_from_config(self):
+        """Test that topics without sampling keys get no sampler.
+        """
+        self.assertIsNone(TopicSampler.from_config({'az_output_topic': 'a'}))
+        sampler = TopicSampler.from_config({'max_rate': 1})
+        self.assertIsNotNone(sampler.bucket)
@@ -0,0 +1,294 @@
+# Copyright (c) 2020 Intel Corporation.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM,OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+"""Unit tests for the eab.spool module.
+"""
+import os
+import shutil
+import asyncio
+import tempfile
+import unittest
+from azure.core.exceptions import HttpResponseError
+from azure.iot.device import Message
+from eab.spool import Spool, StoreAndForward, EVICT_OLDEST, EVICT_NEWEST
+from eab.subscriber import send_output
+
+
+class TestSpool(unittest.TestCase):
+    """Unit tests for the :code:`eab.spool.Spool` class.
+    """
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def drain(self, spool):
+        """Helper to replay every record in the spool.
+        """
+        records = []
+        while True:
+            record = spool.peek()
+            if record is None:
+                return records
+            records.append(record)
+            spool.ack()
+
+    def test_fifo_across_segments(self):
+        """Test that records are replayed in order across segments and that
+        replayed segments are deleted.
+        """
+        spool = Spool(self.directory, 4096, 1024)
+        for i in range(20):
+            self.assertTrue(spool.append({'i': i}, b'x' * 100))
+
+        records = self.drain(spool)
+        self.assertEqual([h['i'] for h, _ in records], list(range(20)))
+        self.assertEqual(records[0][1], b'x' * 100)
+        self.assertEqual(len(os.listdir(self.directory)), 2)
+        spool.close()
+
+    def test_recovery(self):
+        """Test that records which were not replayed survive a restart.
+        """
+        spool = Spool(self.directory, 4096, 1024)
+        for i in range(5):
+            spool.append({'i': i}, b'body')
+        spool.peek()
+        spool.ack()
+        spool.close()
+
+        spool = Spool(self.directory, 4096, 1024)
+        records = self.drain(spool)
+        self.assertEqual([h['i'] for h, _ in records], [1, 2, 3, 4])
+
+        # New records are appended after the recovered ones
+        spool.append({'i': 5}, b'body')
+        self.assertEqual(self.drain(spool)[0][0], {'i': 5})
+        spool.close()
+
+    def test_eviction(self):
+        """Test the drop-oldest and drop-newest eviction policies.
+        """
+        spool = Spool(self.directory, 2048, 1024, EVICT_OLDEST)
+        for i in range(30):
+            self.assertTrue(spool.append({'i': i}, b'x' * 100))
+        records = self.drain(spool)
+        self.assertEqual(records[-1][0], {'i': 29})
+        self.assertNotEqual(records[0][0], {'i': 0})
+        self.assertGreater(spool.evicted, 0)
+        spool.close()
+
+        shutil.rmtree(self.directory)
+        spool = Spool(self.directory, 2048, 1024, EVICT_NEWEST)
+        accepted = [spool.append({'i': i}, b'x' * 100) for i in range(30)]
+        self.assertFalse(all(accepted))
+        records = self.drain(spool)
+        self.assertEqual(records[0][0], {'i': 0})
+        spool.close()
+
+    def test_ack_evicted(self):
+        """Test that acknowledging a record which was evicted since it was
+        peeked does not skip the next record.
+        """
+        expected = Spool(os.path.join(self.directory, 'expected'), 2048,
+                         1024, EVICT_OLDEST)
+        spool = Spool(os.path.join(self.directory, 'spool'), 2048, 1024,
+                      EVICT_OLDEST)
+        spool.append({'i': 0}, b'x' * 100)
+        self.assertEqual(spool.peek()[0], {'i': 0})
+        expected.append({'i': 0}, b'x' * 100)
+        for i in range(1, 30):
+            spool.append({'i': i}, b'x' * 100)
+            expected.append({'i': i}, b'x' * 100)
+        spool.ack()
+
+        self.assertEqual(self.drain(spool), self.drain(expected))
+        spool.close()
+        expected.close()
+
+
+class FakeModuleClient:
+    """IoT Hub module client recording the messages it sends.
+    """
+    def __init__(self):
+        self.fail = False
+        self.sent = []
+
+    async def send_message_to_output(self, msg, output_name):
+        if self.fail:
+            raise ConnectionError('IoT Edge Runtime unreachable')
+        self.sent.append((output_name, msg.data))
+
+
+class FakeBlobClient:
+    """Blob client uploading to a fake blob service.
+    """
+    def __init__(self, service, blob):
+        self.service = service
+        self.blob = blob
+
+    def upload_blob(self, data, overwrite=False):
+        self.service.attempts.append(self.blob)
+        error = self.service.errors.get(self.blob)
+        if error is not None:
+            raise error
+        self.service.uploaded.append(self.blob)
+
+
+class FakeBlobServiceClient:
+    """Blob service client failing the uploads of some blobs.
+    """
+    def __init__(self):
+        self.errors = {}
+        self.attempts = []
+        self.uploaded = []
+
+    def get_blob_client(self, container, blob):
+        return FakeBlobClient(self, blob)
+
+
+class FakeUploadPool:
+    """Upload pool running the uploads right away.
+    """
+    def __init__(self, loop):
+        self.loop = loop
+
+    async def submit(self, nbytes, fn, *args, **kwargs):
+        fut = self.loop.create_future()
+        try:
+            fut.set_result(fn(*args, **kwargs))
+        except Exception as ex:
+            fut.set_exception(ex)
+        return fut
+
+
+class FakeBridgeState:
+    """Bridge state with a store-and-forward spool.
+    """
+    def __init__(self, loop, store_forward):
+        self.loop = loop
+        self.module_client = FakeModuleClient()
+        self.bsc = FakeBlobServiceClient()
+        self.upload_pool = FakeUploadPool(loop)
+        self.store_forward = store_forward
+
+
+class TestStoreAndForward(unittest.TestCase):
+    """Unit tests for the :code:`eab.spool.StoreAndForward` class.
+    """
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.sf = StoreAndForward(
+                Spool(os.path.join(self.directory, 'messages'), 4096, 1024),
+                Spool(os.path.join(self.directory, 'blobs'), 4096, 1024),
+                drain_rate=1000)
+        self.sf.min_backoff = self.sf.max_backoff = 0.01
+        self.bs = FakeBridgeState(self.loop, self.sf)
+
+    def tearDown(self):
+        self.sf.close()
+        self.loop.close()
+        asyncio.set_event_loop(None)
+        shutil.rmtree(self.directory)
+
+    def drain(self, until):
+        """Helper to run the drainer until the given condition is met.
+        """
+        async def wait():
+            for _ in range(200):
+                if until():
+                    return
+                await asyncio.sleep(0.01)
+            self.fail('Spool not drained')
+
+        task = self.loop.create_task(self.sf.drain(self.bs))
+        try:
+            self.loop.run_until_complete(wait())
+        finally:
+            task.cancel()
+            self.loop.run_until_complete(
+                    asyncio.gather(task, return_exceptions=True))
+
+    def test_send_output(self):
+        """Test that messages are spooled while the IoT Edge Runtime is
+        unreachable and replayed in order once it recovers.
+        """
+        client = self.bs.module_client
+        client.fail = True
+        self.loop.run_until_complete(
+                send_output(self.bs, Message(b'a'), 'out'))
+        self.assertFalse(self.sf.output_up)
+
+        # Sent straight to the spool while the link is down
+        client.fail = False
+        self.loop.run_until_complete(
+                send_output(self.bs, Message(b'b'), 'out'))
+        self.assertEqual(client.sent, [])
+        self.assertEqual(self.sf.spooled, 2)
+
+        self.drain(lambda: self.sf.output_up)
+        self.assertEqual(client.sent, [('out', b'a'), ('out', b'b')])
+        self.assertEqual(self.sf.replayed, 2)
+
+        self.loop.run_until_complete(
+                send_output(self.bs, Message(b'c'), 'out'))
+        self.assertEqual(client.sent[-1], ('out', b'c'))
+
+    def test_links_independent(self):
+        """Test that frames waiting for Azure Blob Storage do not hold back
+        the replay of messages.
+        """
+        self.bs.bsc.errors['frame'] = ConnectionError('Unreachable')
+        self.sf.storage_down(ConnectionError('Unreachable'))
+        self.sf.spool_blob('frames', 'frame', b'data')
+        self.sf.output_down(ConnectionError('Unreachable'))
+        for data in (b'a', b'b'):
+            self.sf.spool_message(Message(data), 'out')
+
+        self.drain(lambda: self.sf.output_up)
+        self.assertEqual(len(self.bs.module_client.sent), 2)
+        self.assertFalse(self.sf.storage_up)
+
+        del self.bs.bsc.errors['frame']
+        self.drain(lambda: self.sf.storage_up)
+        self.assertEqual(self.bs.bsc.uploaded, ['frame'])
+        self.assertEqual(self.sf.replayed, 3)
+
+    def test_permanent_failure(self):
+        """Test that records which can never be replayed are dropped, and
+        that all other failures are retried.
+        """
+        uploaded = self.bs.bsc.uploaded
+        for status in (404, 403, 429):
+            error = HttpResponseError(f'Status {status}')
+            error.status_code = status
+            self.bs.bsc.errors['frame'] = error
+            self.sf.spool_blob('frames', 'frame', b'data')
+            self.sf.spool_blob('frames', 'next', b'data')
+            if status != 429:
+                self.drain(lambda: uploaded[-1:] == ['next'])
+                del uploaded[:]
+
+        attempts = self.bs.bsc.attempts
+        self.drain(lambda: attempts.count('frame') > 3)
+        self.assertEqual(uploaded, [])
+        self.assertEqual(self.sf.dropped, 2)
@@ -0,0 +1,140 @@
+# Copyright (c) 2020 Intel Corporation.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM,OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+"""Unit tests for the eab.telemetry module.
+"""
+import asyncio
+import unittest
+from eab.metrics import BridgeMetrics
+from eab.telemetry import (
+    TelemetryReporter, changed, histogram_quantile, DETAIL_FULL)
+
+
+class FakeClock:
+    """Clock which only moves when it is told to.
+    """
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeReader:
+    """Subscriber reader with an empty queue.
+    """
+    def __init__(self):
+        self.queue = asyncio.Queue()
+
+
+class FakeTopic:
+    """Topic with metrics.
+    """
+    def __init__(self, metrics, name):
+        self.metrics = metrics.topic(name)
+        self.reader = FakeReader()
+
+
+class FakeBridgeState:
+    """Bridge state with metrics and topics.
+    """
+    def __init__(self):
+        self.metrics = BridgeMetrics()
+        self.topics = {}
+        self.store_forward = None
+        self.config_hash = 'abc'
+
+
+class TestTelemetry(unittest.TestCase):
+    """Unit tests for the :code:`eab.telemetry` module.
+    """
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.bs = FakeBridgeState()
+        self.clock = FakeClock()
+
+    def tearDown(self):
+        self.loop.close()
+        asyncio.set_event_loop(None)
+
+    def test_changed(self):
+        """Test which changes are meaningful.
+        """
+        self.assertFalse(changed({'a': 100.0}, {'a': 105.0}))
+        self.assertTrue(changed({'a': 100.0}, {'a': 111.0}))
+        self.assertFalse(changed({'a': 0}, {'a': 1}))
+        self.assertTrue(changed({'a': 0}, {'a': 2}))
+        self.assertTrue(changed({'a': None}, {'a': {'kind': 'send'}}))
+        self.assertTrue(changed({'a': 1}, {'b': 1}))
+
+    def test_quantile(self):
+        """Test estimating a quantile from histogram buckets.
+        """
+        self.assertEqual(histogram_quantile(0.5, (1, 2), [1, 1, 0]), 1)
+        self.assertEqual(histogram_quantile(0.99, (1, 2), [1, 1, 0]), 2)
+        self.assertIsNone(histogram_quantile(0.99, (1, 2), [1, 1, 1]))
+        self.assertIsNone(histogram_quantile(0.5, (1, 2), [0, 0, 0]))
+
+    def test_report(self):
+        """Test that the summary is only patched when it changed.
+        """
+        topic = FakeTopic(self.bs.metrics, 'camera1')
+        self.bs.topics['camera1'] = topic
+        reporter = TelemetryReporter(self.bs, 10, DETAIL_FULL, self.clock)
+
+        first = reporter.summary()
+        self.assertEqual(first['config_hash'], 'abc')
+        self.assertEqual(reporter.patch(first), first)
+        reporter.reported = first
+
+        self.clock.now += 10
+        topic.metrics.received.inc(300)
+        topic.metrics.forwarded.inc(300)
+        topic.metrics.forward_latency.observe(0.004)
+        summary = reporter.summary()
+        camera1 = summary['topics']['camera1']
+        self.assertEqual(camera1['received_per_s'], 30.0)
+        self.assertEqual(camera1['forward_p99_ms'], 5.0)
+        self.assertIsNotNone(reporter.patch(summary))
+        reporter.reported = summary
+
+        # The same rate is not reported again
+        self.clock.now += 10
+        topic.metrics.received.inc(305)
+        topic.metrics.forwarded.inc(305)
+        topic.metrics.forward_latency.observe(0.004)
+        self.assertIsNone(reporter.patch(reporter.summary()))
+
+        # A removed topic is deleted from the reported properties
+        del self.bs.topics['camera1']
+        patch = reporter.patch(reporter.summary())
+        self.assertEqual(patch['topics'], {'camera1': None})
+
+    def test_invalid(self):
+        """Test that invalid settings are rejected.
+        """
+        with self.assertRaises(ValueError):
+            TelemetryReporter(self.bs, 1)
+        with self.assertRaises(ValueError):
+            TelemetryReporter(self.bs, 60, 'verbose')
+
+
+if __name__ == '__main__':
+    unittest.main()
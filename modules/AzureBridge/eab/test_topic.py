@@ -0,0 +1,97 @@
+# Copyright (c) 2020 Intel Corporation.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM,OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+"""Unit tests for the eab.topic module.
+"""
+import asyncio
+import unittest
+from eab.topic import Topic
+
+
+class FakeBridgeState:
+    """Bridge state without Azure Blob Storage.
+    """
+    def __init__(self, loop):
+        self.loop = loop
+        self.bsc = None
+        self.frame_encoder = None
+        self.metrics = None
+
+
+class TestTopic(unittest.TestCase):
+    """Unit tests for the :code:`eab.topic.Topic` class.
+    """
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.bs = FakeBridgeState(self.loop)
+
+    def tearDown(self):
+        self.loop.close()
+        asyncio.set_event_loop(None)
+
+    def test_update(self):
+        """Test that settings are applied in place and only rebuilt when they
+        change.
+        """
+        topic = Topic(self.bs, 'camera1', None, {'az_output_topic': 'out'})
+        self.assertIsNone(topic.sampler)
+        self.assertIsNone(topic.metadata_spec)
+
+        conf = {
+            'az_output_topic': 'out2',
+            'max_rate': 1,
+            'metadata': {'include': ['img_handle']},
+            'az_blob_container_name': 'frames',
+        }
+        topic.update(conf)
+        sampler = topic.sampler
+        self.assertIsNotNone(sampler)
+        self.assertEqual(topic.output_name, 'out2')
+        self.assertEqual(topic.metadata_spec.project({'img_handle': 'a',
+                                                      'width': 1}),
+                         {'img_handle': 'a'})
+        # Blob settings are ignored without Azure Blob Storage
+        self.assertIsNone(topic.container_name)
+
+        topic.update(dict(conf, az_output_topic='out3'))
+        self.assertIs(topic.sampler, sampler)
+        self.assertFalse(topic.requires_restart(dict(conf, max_rate=2)))
+        self.assertTrue(topic.requires_restart(dict(conf, queue_depth=1)))
+
+    def test_aggregate(self):
+        """Test that the aggregator is replaced when its settings change.
+        """
+        aggregate = {'az_output_topic': 'summary', 'forward': False}
+        conf = {'az_output_topic': 'out', 'aggregate': aggregate}
+        topic = Topic(self.bs, 'camera1', None, conf)
+        aggregator = topic.aggregator
+        self.assertEqual(aggregator.output_name, 'summary')
+        self.assertFalse(topic.forward)
+
+        topic.update(dict(conf, az_output_topic='out2'))
+        self.assertIs(topic.aggregator, aggregator)
+
+        topic.update(dict(conf, aggregate=dict(aggregate, window_ms=1000)))
+        self.assertIsNot(topic.aggregator, aggregator)
+        self.assertFalse(topic.forward)
+
+        topic.update({'az_output_topic': 'out'})
+        self.assertIsNone(topic.aggregator)
+        self.assertTrue(topic.forward)
@@ -0,0 +1,94 @@
+# Copyright (c) 2020 Intel Corporation.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM,OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+"""Unit tests for the eab.trace module.
+"""
+import time
+import asyncio
+import unittest
+from azure.iot.device import Message
+from eab.batcher import OutputBatcher
+from eab.trace import (
+    Tracer, FRAME_PROPERTY, RECV_PROPERTY, RECV_MONO_PROPERTY,
+    SEND_PROPERTY, SEND_MONO_PROPERTY)
+
+
+class TestTracer(unittest.TestCase):
+    """Unit tests for the :code:`eab.trace.Tracer` class.
+    """
+    def test_frame_time(self):
+        """Test reading the frame time in each unit.
+        """
+        meta = {'capture': {'ts': 1600000000.25}}
+        self.assertEqual(Tracer('capture.ts', 's').frame_time(meta),
+                         1600000000250)
+        self.assertEqual(Tracer('ts', 'ns').frame_time(
+            {'ts': 1600000000250000000}), 1600000000250)
+        self.assertIsNone(Tracer('ts').frame_time({'ts': 'now'}))
+        self.assertIsNone(Tracer().frame_time(meta))
+        with self.assertRaises(ValueError):
+            Tracer('ts', 'minutes')
+
+    def test_stamp(self):
+        """Test that the receive and send times are added to the message.
+        """
+        msg = Message('{}')
+        recv_time = time.monotonic() - 0.5
+        Tracer().stamp(msg, recv_time, 1600000000000)
+        props = msg.custom_properties
+        self.assertEqual(props[FRAME_PROPERTY], '1600000000000')
+        self.assertEqual(props[RECV_MONO_PROPERTY],
+                         str(int(recv_time * 1000000)))
+        # Times are whole milliseconds, allow for the rounding
+        self.assertAlmostEqual(
+            int(props[SEND_PROPERTY]) - int(props[RECV_PROPERTY]), 500,
+            delta=2)
+        self.assertAlmostEqual(
+            int(props[SEND_MONO_PROPERTY]) - int(props[RECV_MONO_PROPERTY]),
+            500000, delta=2000)
+
+    def test_batch(self):
+        """Test that a batch is stamped with its first object's times.
+        """
+        loop = asyncio.new_event_loop()
+        sent = []
+
+        async def send(msg, output_name):
+            sent.append(msg)
+
+        def stamp(name):
+            return lambda msg: msg.custom_properties.update(stamped=name)
+
+        async def run():
+            batcher = OutputBatcher(send, 'out', 2, 1024, 1000)
+            await batcher.add('{}', stamp('a'))
+            await batcher.add('{}', stamp('b'))
+            await batcher.add('{}')
+            await batcher.flush()
+
+        try:
+            loop.run_until_complete(run())
+        finally:
+            loop.close()
+        self.assertEqual([m.custom_properties.get('stamped') for m in sent],
+                         ['a', None])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,164 @@
+# Copyright (c) 2020 Intel Corporation.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM,OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+"""Unit tests for the eab.upload module.
+"""
+import asyncio
+import threading
+import unittest
+from eab.upload import UploadPool, BlockUploader
+
+
+class TestUploadPool(unittest.TestCase):
+    """Unit tests for the :code:`eab.upload.UploadPool` class.
+    """
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+    def tearDown(self):
+        self.loop.close()
+        asyncio.set_event_loop(None)
+
+    def test_backpressure(self):
+        """Test that :code:`submit()` waits while the in-flight limits are
+        reached and resumes once an upload completes.
+        """
+        pool = UploadPool(2, 100, 2)
+        gate = threading.Event()
+
+        async def run():
+            first = await pool.submit(60, gate.wait)
+            # Second upload does not fit in the byte limit
+            second = asyncio.ensure_future(pool.submit(60, lambda: None))
+            await asyncio.sleep(0.05)
+            self.assertFalse(second.done())
+            self.assertEqual(pool.inflight_jobs, 1)
+            self.assertEqual(pool.inflight_bytes, 60)
+
+            gate.set()
+            await first
+            await (await second)
+            self.assertEqual(pool.inflight_jobs, 0)
+            self.assertEqual(pool.inflight_bytes, 0)
+
+        self.loop.run_until_complete(run())
+        pool.shutdown()
+
+    def test_oversized_blob(self):
+        """Test that a blob larger than the byte limit is still uploaded when
+        the pool is idle.
+        """
+        pool = UploadPool(1, 10, 1)
+
+        async def run():
+            fut = await pool.submit(1000, lambda: 'done')
+            self.assertEqual(await fut, 'done')
+
+        self.loop.run_until_complete(run())
+        pool.shutdown()
+
+    def test_submit_coroutine(self):
+        """Test that coroutine uploads share the in-flight limits and are
+        waited on by :code:`join_tasks()`.
+        """
+        pool = UploadPool(1, 100, 1)
+        gate = asyncio.Event()
+        done = []
+
+        async def upload(name):
+            await gate.wait()
+            done.append(name)
+
+        async def run():
+            await pool.submit_coroutine(10, upload, 'a')
+            second = asyncio.ensure_future(
+                pool.submit_coroutine(10, upload, 'b'))
+            await asyncio.sleep(0.05)
+            self.assertFalse(second.done())
+            self.assertEqual(pool.inflight_jobs, 1)
+
+            gate.set()
+            await second
+            await pool.join_tasks()
+            self.assertEqual(done, ['a', 'b'])
+            self.assertEqual(pool.inflight_jobs, 0)
+            self.assertEqual(pool.inflight_bytes, 0)
+
+        self.loop.run_until_complete(run())
+        pool.shutdown()
+
+
+class TestBlockUploader(unittest.TestCase):
+    """Unit tests for the :code:`eab.upload.BlockUploader` class.
+    """
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+    def tearDown(self):
+        self.loop.close()
+        asyncio.set_event_loop(None)
+
+    def test_upload(self):
+        """Test that a blob is staged in blocks which are committed in order
+        and that the concurrency limit is kept.
+        """
+        uploader = BlockUploader(10, 4, 2)
+        blob = bytes(range(10))
+        staged = {}
+        committed = []
+        active = [0, 0]  # Current and maximum concurrent stages
+
+        async def stage(block_id, data):
+            active[0] += 1
+            active[1] = max(active)
+            await asyncio.sleep(0.01)
+            staged[block_id] = data
+            active[0] -= 1
+
+        async def commit(block_ids):
+            committed.extend(block_ids)
+
+        self.assertFalse(uploader.should_split(len(blob)))
+        self.assertTrue(uploader.should_split(len(blob) + 1))
+
+        self.loop.run_until_complete(uploader.upload(stage, commit, blob))
+        self.assertEqual(committed, ['000000', '000001', '000002'])
+        self.assertEqual(b''.join(staged[i] for i in committed), blob)
+        self.assertEqual(active[1], 2)
+
+    def test_upload_failure(self):
+        """Test that a blob is not committed when staging a block fails.
+        """
+        uploader = BlockUploader(0, 1, 4)
+        committed = []
+
+        async def stage(block_id, data):
+            if block_id == '000001':
+                raise RuntimeError('Stage failed')
+            await asyncio.sleep(1)
+
+        async def commit(block_ids):
+            committed.extend(block_ids)
+
+        with self.assertRaises(RuntimeError):
+            self.loop.run_until_complete(
+                uploader.upload(stage, commit, bytes(4)))
+        self.assertEqual(committed, [])
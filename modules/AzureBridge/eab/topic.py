@@ -0,0 +1,265 @@
+# Copyright (c) 2020 Intel Corporation.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM,OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+"""Azure Bridge per-topic runtime state.
+"""
+import asyncio
+import logging
+import functools
+
+from eab.aggregator import WindowAggregator
+from eab.batcher import OutputBatcher
+from eab.codec import DEFAULT_CODEC, Compressor, get_codec
+from eab.config import DEFAULT_QUEUE_DEPTH
+from eab.packer import FramePacker
+from eab.projection import MetadataSpec
+from eab.receiver import SubscriberReader
+from eab.sampler import TopicSampler
+from eab.subscriber import (
+    emb_subscriber_listener, send_output, upload_named_blob)
+from eab.trace import Tracer
+from eab.upload import BlockUploader
+
+
+class Topic:
+    """Runtime state of an EII Message Bus topic forwarded by the bridge.
+
+    The settings of the topic which do not affect the EII Message Bus
+    subscription (i.e. the output name, codec, compression, meta-data filter
+    and projection, sampling, blob container, encoding, block uploads,
+    packing, batching, aggregation and tracing) are updated in place by
+    :code:`update()` while the listener keeps running. The listener reads
+    them again for every message it forwards.
+    """
+    # Topic configuration keys which require the subscriber to be restarted
+    # when they change
+    RESTART_KEYS = ('queue_depth',)
+
+    # Topic configuration keys of the rate limit and sampling
+    SAMPLE_KEYS = ('max_rate', 'sample_every', 'blob_sample_ratio')
+
+    def __init__(self, bs, name, subscriber, conf):
+        """Constructor.
+
+        :param eab.bridge_state.BridgeState bs: Bridge state instance
+        :param str name: EII Message Bus topic
+        :param subscriber: EII Message Bus subscriber for the topic
+        :param dict conf: Topic configuration from the digital twin
+        """
+        self.log = logging.getLogger(__name__)
+        self.bs = bs
+        self.name = name
+        self.subscriber = subscriber
+        self.conf = None
+        self.output_name = None
+        self.container_name = None
+        self.codec = None
+        self.compressor = None
+        self.batcher = None
+        self.aggregator = None
+        self.forward = True
+        self.metadata_spec = None
+        self.sampler = None
+        self.encode_conf = None
+        self.block_uploader = None
+        self.packer = None
+        self.tracer = None
+        self.task = None
+        # Flushes of replaced batchers and packers which are still running
+        self._flushes = set()
+
+        # Only recorded when the bridge's metrics endpoint is enabled
+        if bs.metrics is not None:
+            self.metrics = bs.metrics.topic(name)
+        else:
+            self.metrics = None
+
+        queue_depth = conf.get('queue_depth', DEFAULT_QUEUE_DEPTH)
+        self.reader = SubscriberReader(subscriber, name, queue_depth, bs.loop)
+
+        self.update(conf)
+
+    def requires_restart(self, conf):
+        """Check if applying the given configuration requires the subscriber
+        to be restarted.
+
+        :param dict conf: New topic configuration
+        :rtype: bool
+        """
+        return any(conf.get(k) != self.conf.get(k) for k in self.RESTART_KEYS)
+
+    def update(self, conf):
+        """Apply a new configuration to the topic without restarting its
+        subscriber.
+
+        :param dict conf: New topic configuration
+        """
+        output_name = conf['az_output_topic']
+        batch_conf = conf.get('batch')
+        codec_name = conf.get('codec', DEFAULT_CODEC)
+
+        metadata_conf = conf.get('metadata')
+        if self.conf is None or metadata_conf != self.conf.get('metadata'):
+            if metadata_conf is not None:
+                self.metadata_spec = MetadataSpec.from_config(metadata_conf)
+            else:
+                self.metadata_spec = None
+
+        if self.conf is None or any(
+                conf.get(k) != self.conf.get(k) for k in self.SAMPLE_KEYS):
+            # Starts the rate limit and sampling over
+            self.sampler = TopicSampler.from_config(conf)
+
+        if self.bs.bsc is not None:
+            self.container_name = conf.get('az_blob_container_name')
+        else:
+            self.container_name = None
+
+        if self.bs.frame_encoder is not None:
+            self.encode_conf = conf.get('encode')
+        else:
+            self.encode_conf = None
+
+        block_conf = conf.get('block_upload')
+        if block_conf is not None:
+            self.block_uploader = BlockUploader.from_config(block_conf)
+        else:
+            self.block_uploader = None
+
+        pack_conf = conf.get('pack')
+        packer = self.packer
+        if packer is None or pack_conf != self.conf.get('pack') or \
+                self.container_name != packer.container_name:
+            if packer is not None:
+                # Upload whatever was packed with the previous settings
+                self._flush_later(packer)
+            if pack_conf is not None and self.container_name is not None:
+                self.packer = FramePacker.from_config(
+                        self._upload, self.container_name, pack_conf)
+            else:
+                self.packer = None
+
+        codec_changed = self.codec is None or codec_name != self.codec.name
+        if codec_changed:
+            self.codec = get_codec(codec_name)
+
+        compression_conf = conf.get('compression')
+        compression_changed = self.conf is None or \
+            compression_conf != self.conf.get('compression')
+        if compression_changed:
+            if compression_conf is not None:
+                self.compressor = Compressor.from_config(compression_conf)
+            else:
+                self.compressor = None
+
+        if self.conf is None or output_name != self.output_name or \
+                batch_conf != self.conf.get('batch') or codec_changed or \
+                compression_changed:
+            if self.batcher is not None:
+                # Send whatever was batched with the previous settings
+                self._flush_later(self.batcher)
+            if batch_conf is not None:
+                self.batcher = OutputBatcher.from_config(
+                        functools.partial(send_output, self.bs),
+                        output_name, batch_conf, self.codec, self.compressor)
+            else:
+                self.batcher = None
+
+        trace_conf = conf.get('trace')
+        if self.conf is None or trace_conf != self.conf.get('trace'):
+            if trace_conf is not None:
+                self.tracer = Tracer.from_config(trace_conf)
+            else:
+                self.tracer = None
+
+        aggregate_conf = conf.get('aggregate')
+        if self.conf is None or aggregate_conf != self.conf.get('aggregate') \
+                or codec_changed or compression_changed:
+            if self.aggregator is not None:
+                # Starts the windows over
+                self.aggregator.stop()
+            if aggregate_conf is not None:
+                self.aggregator = WindowAggregator.from_config(
+                        functools.partial(send_output, self.bs), self.name,
+                        aggregate_conf, self.codec, self.compressor)
+            else:
+                self.aggregator = None
+        self.forward = aggregate_conf is None or \
+            aggregate_conf.get('forward', True)
+
+        self.output_name = output_name
+        self.conf = conf
+
+    def _flush_later(self, pending):
+        """Helper function to flush a replaced batcher or packer in the
+        background, keeping its task until it is done so that
+        :code:`stop()` can hand it over to be awaited.
+        """
+        task = asyncio.ensure_future(self._flush(pending))
+        self._flushes.add(task)
+        task.add_done_callback(self._flushes.discard)
+
+    async def _flush(self, pending):
+        """Send the remaining messages of a batcher or frames of a packer
+        which was replaced.
+        """
+        try:
+            await pending.flush()
+        except Exception as ex:
+            self.log.error(f'Failed to flush {self.name}: {ex}')
+
+    async def _upload(self, container_name, blob_name, data):
+        """Upload a pack or index blob for the topic's packer.
+        """
+        return await upload_named_blob(
+                self.bs, container_name, blob_name, data, self.block_uploader,
+                self.metrics)
+
+    def start(self):
+        """Start receiving and forwarding messages.
+        """
+        self.reader.start()
+        self.task = asyncio.ensure_future(
+                emb_subscriber_listener(self.bs, self))
+
+    def stop(self):
+        """Stop the listener and close the subscriber.
+
+        The cancelled listener sends its last batch and uploads its last
+        pack the next time the asyncio loop runs, so the returned tasks must
+        be awaited before the bridge disconnects from the IoT Edge Runtime or
+        shuts down the upload pool and the spool.
+
+        :return: Tasks of the listener and of the flushes which are still
+            running
+        :rtype: list
+        """
+        tasks = list(self._flushes)
+        if self.task is not None:
+            self.task.cancel()
+            tasks.append(self.task)
+            self.task = None
+
+        if self.aggregator is not None:
+            self.aggregator.stop()
+
+        # Stop the receive thread before closing its subscriber
+        self.reader.stop()
+        self.subscriber.close()
+        return tasks
@@ -0,0 +1,118 @@
+# Copyright (c) 2020 Intel Corporation.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM,OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+"""Azure Bridge latency tracing through message properties.
+
+Traced messages carry the time their EII message was received by the bridge
+and the time the bridge started sending them, both as wall-clock time and
+as monotonic time. The monotonic times let consumers on the same device,
+e.g. the Simple Subscriber, measure the time spent in the bridge and in the
+edgeHub without being affected by clock adjustments. If the meta-data holds
+the time the frame was captured, it is passed on as well, so that the time
+spent in the EII pipeline can be measured.
+"""
+import time
+import numbers
+
+from eab.projection import compile_values
+
+# Wall-clock times in milliseconds since the epoch
+RECV_PROPERTY = 'eab_recv_ms'
+SEND_PROPERTY = 'eab_send_ms'
+FRAME_PROPERTY = 'eab_frame_ms'
+# Monotonic times in microseconds
+RECV_MONO_PROPERTY = 'eab_recv_mono_us'
+SEND_MONO_PROPERTY = 'eab_send_mono_us'
+
+# Milliseconds per unit of the frame time field
+FRAME_TIME_UNITS = {
+    's': 1000.0,
+    'ms': 1.0,
+    'us': 0.001,
+    'ns': 0.000001,
+}
+DEFAULT_FRAME_TIME_UNIT = 'ms'
+
+
+class Tracer:
+    """Adds the trace properties to a topic's messages.
+    """
+    def __init__(self, frame_time_field=None,
+                 frame_time_unit=DEFAULT_FRAME_TIME_UNIT):
+        """Constructor.
+
+        :param str frame_time_field: Dot separated path of the meta-data
+            field holding the time the frame was captured, as time since
+            the epoch
+        :param str frame_time_unit: Unit of the frame time field, one of
+            s, ms, us or ns
+        :raises ValueError: If the field path or unit is invalid
+        """
+        if frame_time_unit not in FRAME_TIME_UNITS:
+            raise ValueError(f'Unknown frame time unit: {frame_time_unit}')
+        if frame_time_field is not None:
+            self._frame_times = compile_values(frame_time_field)
+        else:
+            self._frame_times = None
+        self._frame_scale = FRAME_TIME_UNITS[frame_time_unit]
+
+    @classmethod
+    def from_config(cls, trace_conf):
+        """Create a tracer from a topic's :code:`trace` configuration.
+
+        :param dict trace_conf: Trace configuration from the digital twin
+        :return: Tracer
+        """
+        return cls(trace_conf.get('frame_time_field'),
+                   trace_conf.get('frame_time_unit', DEFAULT_FRAME_TIME_UNIT))
+
+    def frame_time(self, meta_data):
+        """Get the time the frame was captured from its meta-data.
+
+        :param dict meta_data: Meta-data of the frame
+        :return: Milliseconds since the epoch, or None if the meta-data has
+            no frame time
+        :rtype: int
+        """
+        if self._frame_times is None:
+            return None
+        for value in self._frame_times(meta_data):
+            if isinstance(value, numbers.Number) and \
+                    not isinstance(value, bool):
+                return round(value * self._frame_scale)
+        return None
+
+    def stamp(self, msg, recv_time, frame_time=None):
+        """Add the trace properties to a message which is about to be sent.
+
+        :param azure.iot.device.Message msg: Message to send
+        :param float recv_time: Monotonic time the EII message was received
+        :param int frame_time: Time the frame was captured in milliseconds
+            since the epoch, if known
+        """
+        mono = time.monotonic()
+        now = time.time()
+        props = msg.custom_properties
+        # The receive thread only records the monotonic time
+        props[RECV_PROPERTY] = str(int((now - (mono - recv_time)) * 1000))
+        props[RECV_MONO_PROPERTY] = str(int(recv_time * 1000000))
+        props[SEND_PROPERTY] = str(int(now * 1000))
+        props[SEND_MONO_PROPERTY] = str(int(mono * 1000000))
+        if frame_time is not None:
+            props[FRAME_PROPERTY] = str(frame_time)
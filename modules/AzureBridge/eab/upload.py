@@ -0,0 +1,350 @@
+# Copyright (c) 2020 Intel Corporation.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM,OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+"""Azure Bridge bounded blob upload worker pool and async uploader.
+"""
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+# Blob upload modes
+UPLOAD_MODE_THREAD = 'thread'
+UPLOAD_MODE_ASYNC = 'async'
+
+# Default block upload settings
+DEFAULT_BLOCK_THRESHOLD = 8 * 1024 * 1024
+DEFAULT_BLOCK_SIZE = 4 * 1024 * 1024
+DEFAULT_BLOCK_CONCURRENCY = 4
+
+
+class UploadPool:
+    """Bounded pool of worker threads for uploading blobs into Azure Blob
+    Storage.
+
+    The pool tracks the number of uploads and the number of bytes which are
+    currently in-flight. When either limit is reached, :code:`submit()` will
+    wait until enough uploads have completed, which applies backpressure to
+    the caller instead of queueing an unbounded number of frames in memory.
+
+    .. note:: A single blob which is larger than the in-flight byte limit is
+        still allowed through once no other uploads are in-flight, otherwise
+        it would never be uploaded.
+    """
+    def __init__(self, max_workers, max_inflight_bytes, max_inflight_jobs):
+        """Constructor.
+
+        :param int max_workers: Number of upload worker threads
+        :param int max_inflight_bytes: Maximum number of blob bytes which can
+            be queued or uploading at any given time
+        :param int max_inflight_jobs: Maximum number of uploads which can be
+            queued or uploading at any given time
+        """
+        if max_workers < 1:
+            raise ValueError('Upload pool must have at least one worker')
+        if max_inflight_bytes < 1 or max_inflight_jobs < 1:
+            raise ValueError('Upload pool in-flight limits must be positive')
+
+        self.log = logging.getLogger(__name__)
+        self.max_workers = max_workers
+        self.max_inflight_bytes = max_inflight_bytes
+        self.max_inflight_jobs = max_inflight_jobs
+        self.inflight_bytes = 0
+        self.inflight_jobs = 0
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix='eab-upload')
+        self._space = asyncio.Event()
+        self._space.set()
+        self._tasks = set()
+
+    def has_capacity(self, nbytes):
+        """Check if an upload of the given size can be started right now.
+
+        :param int nbytes: Size of the blob to upload
+        :return: True if the upload fits within the in-flight limits
+        :rtype: bool
+        """
+        if self.inflight_jobs == 0:
+            return True
+        if self.inflight_jobs >= self.max_inflight_jobs:
+            return False
+        return self.inflight_bytes + nbytes <= self.max_inflight_bytes
+
+    async def acquire(self, nbytes):
+        """Wait until there is room in the pool for an upload of the given
+        size and then reserve it.
+
+        :param int nbytes: Size of the blob to upload
+        """
+        while not self.has_capacity(nbytes):
+            self.log.debug(
+                f'Upload pool full ({self.inflight_jobs} uploads, '
+                f'{self.inflight_bytes} bytes in-flight), waiting')
+            self._space.clear()
+            await self._space.wait()
+        self.inflight_jobs += 1
+        self.inflight_bytes += nbytes
+
+    def release(self, nbytes):
+        """Release a reservation made with :code:`acquire()`.
+
+        :param int nbytes: Size of the blob which was reserved
+        """
+        self.inflight_jobs -= 1
+        self.inflight_bytes -= nbytes
+        self._space.set()
+
+    async def submit(self, nbytes, fn, *args, **kwargs):
+        """Run the given blocking upload function in the pool once there is
+        room for it.
+
+        The returned future completes when the upload has finished, the
+        coroutine itself only waits for a free slot in the pool.
+
+        :param int nbytes: Size of the blob being uploaded
+        :param fn: Blocking function which performs the upload
+        :return: Future for the upload
+        :rtype: asyncio.Future
+        """
+        loop = asyncio.get_event_loop()
+        await self.acquire(nbytes)
+        try:
+            fut = loop.run_in_executor(
+                self.executor, lambda: fn(*args, **kwargs))
+        except Exception:
+            self.release(nbytes)
+            raise
+        fut.add_done_callback(lambda _: self.release(nbytes))
+        return fut
+
+    async def submit_coroutine(self, nbytes, coro_fn, *args, **kwargs):
+        """Run the given upload coroutine function on the asyncio loop once
+        there is room for it in the pool.
+
+        This applies the same in-flight limits as :code:`submit()` to
+        uploads which do not need a worker thread.
+
+        :param int nbytes: Size of the blob being uploaded
+        :param coro_fn: Coroutine function which performs the upload
+        :return: Task for the upload
+        :rtype: asyncio.Task
+        """
+        await self.acquire(nbytes)
+        try:
+            task = asyncio.ensure_future(coro_fn(*args, **kwargs))
+        except Exception:
+            self.release(nbytes)
+            raise
+        self._tasks.add(task)
+        task.add_done_callback(lambda _: self._task_done(task, nbytes))
+        return task
+
+    def _task_done(self, task, nbytes):
+        """Helper function to release a finished upload task's reservation.
+        """
+        self._tasks.discard(task)
+        self.release(nbytes)
+
+    async def join_tasks(self):
+        """Wait for all uploads started with :code:`submit_coroutine()` to
+        finish.
+        """
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def shutdown(self, wait=True):
+        """Stop the upload worker threads.
+
+        :param bool wait: Wait for pending uploads to finish
+        """
+        self.executor.shutdown(wait=wait)
+
+
+class AsyncBlobUploader:
+    """Uploads blobs with the asyncio Azure Blob Storage client, without
+    going through a worker thread for each upload.
+
+    A single async blob service client is shared by all uploads. Its HTTP
+    session is created on first use with a connection pool of the given
+    size, and a container client is kept for each container.
+
+    .. note:: This requires the :code:`aiohttp` package.
+    """
+    def __init__(self, conn_str, pool_size):
+        """Constructor.
+
+        :param str conn_str: Azure Blob Storage connection string
+        :param int pool_size: Maximum number of HTTP connections
+        """
+        # Imported here, since aiohttp is only needed in this mode
+        try:
+            import aiohttp
+            from azure.core.pipeline.transport import AioHttpTransport
+            from azure.storage.blob.aio import BlobServiceClient
+        except ImportError as ex:
+            raise RuntimeError(
+                f'Async blob uploads require the aiohttp package: {ex}')
+
+        self.log = logging.getLogger(__name__)
+        self.conn_str = conn_str
+        self.pool_size = pool_size
+        self._aiohttp = aiohttp
+        self._transport_cls = AioHttpTransport
+        self._bsc_cls = BlobServiceClient
+        self._session = None
+        self._bsc = None
+        self._containers = {}
+
+    def _get_container_client(self, container_name):
+        """Helper function to get the shared client for a container.
+        """
+        if self._bsc is None:
+            self.log.debug(f'Creating async blob service client with '
+                           f'{self.pool_size} connections')
+            connector = self._aiohttp.TCPConnector(limit=self.pool_size)
+            self._session = self._aiohttp.ClientSession(connector=connector)
+            transport = self._transport_cls(
+                    session=self._session, session_owner=False)
+            self._bsc = self._bsc_cls.from_connection_string(
+                    self.conn_str, transport=transport)
+
+        client = self._containers.get(container_name)
+        if client is None:
+            client = self._bsc.get_container_client(container_name)
+            self._containers[container_name] = client
+        return client
+
+    def get_blob_client(self, container_name, blob_name):
+        """Get an async client for a blob, e.g. to upload it in blocks.
+
+        :param str container_name: Name of the Azure Blob container
+        :param str blob_name: Name of the blob
+        """
+        client = self._get_container_client(container_name)
+        return client.get_blob_client(blob_name)
+
+    async def upload(self, container_name, blob_name, data, **kwargs):
+        """Upload a blob.
+
+        :param str container_name: Name of the Azure Blob container
+        :param str blob_name: Name of the blob
+        :param bytes data: Blob data
+        """
+        client = self._get_container_client(container_name)
+        await client.upload_blob(blob_name, data, **kwargs)
+
+    async def close(self):
+        """Close the blob service client and its HTTP session.
+        """
+        if self._bsc is not None:
+            await self._bsc.close()
+            await self._session.close()
+            self._bsc = None
+            self._session = None
+            self._containers = {}
+
+
+class BlockUploader:
+    """Uploads large blobs as a list of blocks which are staged concurrently
+    and then committed, instead of in a single request.
+
+    The uploader does not talk to Azure Blob Storage itself, it is given
+    coroutine functions to stage and commit the blocks, so that the same
+    splitting is used by the threaded and the async upload paths.
+    """
+    def __init__(self, threshold, block_size, max_concurrency):
+        """Constructor.
+
+        :param int threshold: Blobs larger than this many bytes are
+            uploaded in blocks
+        :param int block_size: Size of each block in bytes
+        :param int max_concurrency: Maximum number of blocks of a blob which
+            are staged at the same time
+        """
+        if block_size < 1 or max_concurrency < 1:
+            raise ValueError('Block size and concurrency must be positive')
+        self.threshold = threshold
+        self.block_size = block_size
+        self.max_concurrency = max_concurrency
+
+    @classmethod
+    def from_config(cls, block_conf):
+        """Create a block uploader from a topic's :code:`block_upload`
+        configuration.
+
+        :param dict block_conf: Block upload configuration from the digital
+            twin
+        :return: BlockUploader
+        """
+        return cls(block_conf.get('threshold', DEFAULT_BLOCK_THRESHOLD),
+                   block_conf.get('block_size', DEFAULT_BLOCK_SIZE),
+                   block_conf.get('max_concurrency',
+                                  DEFAULT_BLOCK_CONCURRENCY))
+
+    def should_split(self, nbytes):
+        """Check if a blob of the given size is uploaded in blocks.
+
+        :param int nbytes: Size of the blob
+        :rtype: bool
+        """
+        return nbytes > self.threshold
+
+    def block_ids(self, nbytes):
+        """Get the IDs of the blocks for a blob of the given size.
+
+        All IDs of a blob must have the same length, so they are the block's
+        index padded with zeros.
+
+        :param int nbytes: Size of the blob
+        :return: List of block IDs
+        :rtype: list
+        """
+        count = max(1, -(-nbytes // self.block_size))
+        return [f'{i:06d}' for i in range(count)]
+
+    async def upload(self, stage, commit, blob):
+        """Stage the blocks of a blob and commit them.
+
+        If staging any block fails, the blocks still being staged are
+        cancelled and the blob is not committed.
+
+        :param stage: Coroutine function called with a block ID and the
+            block's data to stage it
+        :param commit: Coroutine function called with the list of block IDs
+            to commit the blob
+        :param bytes blob: Blob data
+        """
+        slots = asyncio.Semaphore(self.max_concurrency)
+        block_ids = self.block_ids(len(blob))
+
+        async def stage_block(index, block_id):
+            async with slots:
+                # Sliced here, so only the blocks being staged are copied
+                start = index * self.block_size
+                await stage(block_id, blob[start:start + self.block_size])
+
+        tasks = [asyncio.ensure_future(stage_block(i, block_id))
+                 for i, block_id in enumerate(block_ids)]
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            raise
+
+        await commit(block_ids)
@@ -19,11 +19,161 @@
 # IN THE SOFTWARE.
 """Simple subscriber on MSFT Azure Edge Runtime.
 """
+import os
+import gzip
 import json
+import time
+import zlib
 import asyncio
 import logging
+import cbor2
+import msgpack
 from azure.iot.device.aio import IoTHubModuleClient
 
+# Custom property set by the Azure Bridge on batched messages
+BATCH_PROPERTY = 'eab_batch'
+
+# Trace properties set by the Azure Bridge on messages of traced topics,
+# wall-clock times are in milliseconds and monotonic times in microseconds
+FRAME_PROPERTY = 'eab_frame_ms'
+RECV_PROPERTY = 'eab_recv_ms'
+RECV_MONO_PROPERTY = 'eab_recv_mono_us'
+SEND_MONO_PROPERTY = 'eab_send_mono_us'
+
+# Upper bounds of the latency histogram buckets in milliseconds
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000,
+                      10000)
+
+# Decoders for each content type the Azure Bridge sends
+DECODERS = {
+    'application/json': json.loads,
+    'application/x-msgpack': msgpack.unpackb,
+    'application/cbor': cbor2.loads,
+}
+
+# Decompressors for the content encodings of compressed messages
+DECOMPRESSORS = {
+    'gzip': gzip.decompress,
+    'deflate': zlib.decompress,
+}
+
+
+def decode(msg):
+    """Decode the meta-data objects in a message from the Azure Bridge.
+
+    :param msg: Received message
+    :return: List of meta-data objects
+    :rtype: list
+    """
+    # Messages without a content type are JSON
+    content_type = msg.content_type or 'application/json'
+    decoder = DECODERS.get(content_type)
+    if decoder is None:
+        raise ValueError(f'Unsupported content type: {content_type}')
+    data = msg.data
+    if msg.content_encoding in DECOMPRESSORS:
+        data = DECOMPRESSORS[msg.content_encoding](data)
+    body = decoder(data)
+    if msg.custom_properties.get(BATCH_PROPERTY) is not None:
+        # Batched message, the body is a list of meta-data objects
+        return body
+    return [body]
+
+
+class LatencyHistogram:
+    """Histogram of the latencies of a hop.
+    """
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.count = 0
+        self.max = 0.0
+
+    def observe(self, latency_ms):
+        """Record a latency in milliseconds.
+        """
+        for i, bound in enumerate(LATENCY_BUCKETS_MS):
+            if latency_ms <= bound:
+                break
+        else:
+            i = len(LATENCY_BUCKETS_MS)
+        self.counts[i] += 1
+        self.count += 1
+        self.max = max(self.max, latency_ms)
+
+    def quantile(self, q):
+        """Get the upper bound of the bucket a quantile is in.
+        """
+        rank = q * self.count
+        cumulative = 0
+        for bound, count in zip(LATENCY_BUCKETS_MS, self.counts):
+            cumulative += count
+            if cumulative >= rank:
+                return f'<={bound}ms'
+        return f'>{LATENCY_BUCKETS_MS[-1]}ms'
+
+    def format(self):
+        """Format the histogram for the log.
+        """
+        buckets = ', '.join(
+            f'<={bound}ms: {count}' for bound, count
+            in zip(LATENCY_BUCKETS_MS, self.counts) if count)
+        if self.counts[-1]:
+            buckets += f', >{LATENCY_BUCKETS_MS[-1]}ms: {self.counts[-1]}'
+        return (f'n={self.count} p50 {self.quantile(0.5)} '
+                f'p99 {self.quantile(0.99)} max={self.max:.1f}ms '
+                f'[{buckets.lstrip(", ")}]')
+
+
+def hop_latencies(props, now_ms, now_mono_us):
+    """Get the latency of each hop of a traced message.
+
+    The monotonic times are only comparable because the Simple Subscriber
+    runs on the same device as the Azure Bridge.
+
+    :param dict props: Custom properties of the message
+    :param float now_ms: Wall-clock time the message was received in
+        milliseconds since the epoch
+    :param float now_mono_us: Monotonic time the message was received in
+        microseconds
+    :return: Dictionary of hop->latency in milliseconds, empty if the
+        message is not traced
+    :rtype: dict
+    """
+    try:
+        recv_ms = int(props[RECV_PROPERTY])
+        recv_mono = int(props[RECV_MONO_PROPERTY])
+        send_mono = int(props[SEND_MONO_PROPERTY])
+    except (KeyError, ValueError):
+        return {}
+
+    latencies = {
+        'bridge': (send_mono - recv_mono) / 1000.0,
+        'edgehub': (now_mono_us - send_mono) / 1000.0,
+        'total': (now_mono_us - recv_mono) / 1000.0,
+    }
+    if FRAME_PROPERTY in props:
+        frame_ms = int(props[FRAME_PROPERTY])
+        latencies['eii'] = float(recv_ms - frame_ms)
+        latencies['total'] = now_ms - frame_ms
+    return latencies
+
+
+async def log_latencies(log, histograms, interval):
+    """Log the latency histogram of each hop every interval and start them
+    over.
+
+    :param log: Logger
+    :param dict histograms: Dictionary of hop->LatencyHistogram
+    :param float interval: Seconds between the logs
+    """
+    while True:
+        await asyncio.sleep(interval)
+        for hop in ('eii', 'bridge', 'edgehub', 'total'):
+            histogram = histograms.get(hop)
+            if histogram is not None and histogram.count:
+                log.info(f'Latency {hop}: {histogram.format()}')
+        histograms.clear()
+
 
 async def main():
     """Main method for asyncio.
@@ -44,6 +194,12 @@ async def main():
     ch.setFormatter(fmt)
     log.addHandler(ch)
 
+    # Latencies of the traced messages, logged every interval
+    histograms = {}
+    interval = float(os.getenv('LATENCY_LOG_INTERVAL_S', '60'))
+    logger = asyncio.ensure_future(log_latencies(log, histograms, interval))
+
+    module_client = None
     try:
         # The client object is used to interact with your Azure IoT hub.
         log.info('Initializing IoT Hub module client')
@@ -53,12 +209,22 @@ async def main():
         log.info('Running')
         while True:
             msg = await module_client.receive_message_on_input('input1')
-            meta_data = json.loads(msg.data)
-            log.info(f'Received: {json.dumps(meta_data, indent=4)}')
+            latencies = hop_latencies(msg.custom_properties,
+                                      time.time() * 1000,
+                                      time.monotonic() * 1000000)
+            for hop, latency in latencies.items():
+                if hop not in histograms:
+                    histograms[hop] = LatencyHistogram()
+                histograms[hop].observe(latency)
+
+            for meta_data in decode(msg):
+                log.info(f'Received: {json.dumps(meta_data, indent=4)}')
     except Exception as e:
         log.error(f'Error receiving messages: {e}')
     finally:
-        await module_client.disconnect()
+        logger.cancel()
+        if module_client is not None:
+            await module_client.disconnect()
 
 
 if __name__ == '__main__':